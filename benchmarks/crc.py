@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+# rdserialtool
+# Copyright (C) 2019-2021 Ryan Finnie
+# SPDX-License-Identifier: MPL-2.0
+
+# Modbus CRC-16 time per frame, for frame sizes from a short request to
+# a full RD response, and for checking a batch of complete RD frames.
+
+import argparse
+import os
+import struct
+import time
+
+import rdserial.modbus
+
+SIZES = (8, 13, 31, 175, 255)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Modbus CRC benchmark')
+    parser.add_argument('--bytes', '-n', type=int, default=1600000, help='Bytes to checksum per frame size')
+    args = parser.parse_args()
+
+    # Build any lazily built tables first
+    rdserial.modbus.modbus_crc(os.urandom(max(SIZES)))
+
+    print('bytes  us/frame')
+    for size in SIZES:
+        data = os.urandom(size)
+        iterations = args.bytes // size
+        start = time.perf_counter()
+        for i in range(iterations):
+            rdserial.modbus.modbus_crc(data)
+        elapsed = time.perf_counter() - start
+        print('{:5}  {:8.2f}'.format(size, elapsed / iterations * 1e6))
+
+    frames = []
+    for i in range(10000):
+        data = os.urandom(173)
+        frames.append(data + struct.pack('<H', rdserial.modbus.modbus_crc(data)))
+    # The CRC of a frame with its own CRC appended is zero; this is what
+    # modbus_crc_valid() checks, but also works on earlier revisions
+    start = time.perf_counter()
+    for frame in frames:
+        assert(rdserial.modbus.modbus_crc(frame) == 0)
+    elapsed = time.perf_counter() - start
+    print('{} RD 175-byte frames checked in {:.0f} ms'.format(len(frames), elapsed * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+# rdserialtool
+# Copyright (C) 2019-2021 Ryan Finnie
+# SPDX-License-Identifier: MPL-2.0
+
+# Memory held per retained UM and RD sample, measured with tracemalloc.
+
+import argparse
+import datetime
+import random
+import tracemalloc
+
+import rdserial.dps
+import rdserial.um
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sample memory benchmark')
+    parser.add_argument('--samples', '-n', type=int, default=5000)
+    args = parser.parse_args()
+
+    response = rdserial.um.Response(device_type='UM25C')
+    response.volts = 5.1
+    response.amps = 0.5
+    response.watts = 2.55
+    frame = response.dump()
+    registers = [random.randrange(65536) for i in range(85)]
+
+    def um_sample():
+        return rdserial.um.Response(frame, collection_time=datetime.datetime.now(), device_type='UM25C')
+
+    def rd_sample():
+        device_state = rdserial.dps.RDDeviceState()
+        device_state.load(registers)
+        return device_state
+
+    for label, sample in (('UM25C Response', um_sample), ('RDDeviceState', rd_sample)):
+        # Warm up any lazily built shared tables first
+        sample()
+        tracemalloc.start()
+        samples = [sample() for i in range(args.samples)]
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print('{:16} {:8.0f} bytes/sample'.format(label, current / len(samples)))
+
+
+if __name__ == '__main__':
+    main()
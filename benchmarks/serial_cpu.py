@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+# rdserialtool
+# Copyright (C) 2019-2021 Ryan Finnie
+# SPDX-License-Identifier: MPL-2.0
+
+# Client CPU and wall time per UM25C poll over a pty.  The emulator runs
+# in a separate process, from this checkout, so that only the client's
+# process time is measured.
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import rdserial.device
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serial transport CPU benchmark')
+    parser.add_argument('--polls', '-n', type=int, default=2000)
+    parser.add_argument('--timeout', type=float, default=None, help='Serial receive timeout')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    link = os.path.join(tmpdir, 'um.pty')
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    emulator = subprocess.Popen(
+        [sys.executable, '-m', 'rdserial.emulator.tool', '-d', 'um25c', '--link', link],
+        env=env, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while not os.path.exists(link):
+            time.sleep(0.05)
+        socket = rdserial.device.Serial(link, baudrate=115200, timeout=args.timeout)
+        socket.connect()
+        for i in range(20):
+            socket.send(b'\xf0')
+            socket.recv(130)
+        cpu_start, wall_start = time.process_time(), time.perf_counter()
+        for i in range(args.polls):
+            socket.send(b'\xf0')
+            assert(len(socket.recv(130)) == 130)
+        cpu, wall = time.process_time() - cpu_start, time.perf_counter() - wall_start
+        socket.close()
+    finally:
+        emulator.terminate()
+        emulator.wait()
+        os.rmdir(tmpdir)
+    print('CPU per frame   {:8.1f} us'.format(cpu / args.polls * 1e6))
+    print('wall per frame  {:8.1f} us'.format(wall / args.polls * 1e6))
+
+
+if __name__ == '__main__':
+    main()
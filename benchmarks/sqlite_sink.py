@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+# rdserialtool
+# Copyright (C) 2019-2021 Ryan Finnie
+# SPDX-License-Identifier: MPL-2.0
+
+# SQLiteSink insert rate for UM25C samples, committing per sample and in
+# batches, then the size of a week of 1 Hz samples and the time taken
+# by a one hour range query over it.
+
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import types
+
+import rdserial.sink
+import rdserial.um
+import rdserial.um.tool
+
+DEVICE_ID = 'um25c@bench'
+START_TIME = 1.7e9
+
+
+def um_records(count):
+    tool = rdserial.um.tool.Tool()
+    tool.args = types.SimpleNamespace(device='um25c', fields=None, json_trends=False)
+    rng = random.Random(0)
+    records = []
+    for i in range(count):
+        response = rdserial.um.Response(device_type='UM25C')
+        response.volts = rng.uniform(4.8, 5.2)
+        response.amps = rng.uniform(0, 3)
+        response.watts = response.volts * response.amps
+        records.append(tool.sample_record(response))
+    return tool.sample_columns(), records
+
+
+def run(filename, columns, records, count, batch_size, flush_interval):
+    sink = rdserial.sink.SQLiteSink(
+        filename, 'um', columns, DEVICE_ID, batch_size=batch_size, flush_interval=flush_interval,
+    )
+    start = time.perf_counter()
+    for i in range(count):
+        record = dict(records[i % len(records)])
+        record['collection_time'] = START_TIME + i
+        sink.write(record)
+    sink.close()
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SQLite sink benchmark')
+    parser.add_argument(
+        '--rows', '-n', type=int, default=604800, help='Rows for the batched run (default: a week at 1 Hz)',
+    )
+    args = parser.parse_args()
+
+    columns, records = um_records(1000)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        rate = run(os.path.join(tmpdir, 'sample.db'), columns, records, 5000, 4096, 0)
+        print('commit per sample   {:8.0f} rows/s'.format(rate))
+        filename = os.path.join(tmpdir, 'batch.db')
+        rate = run(filename, columns, records, args.rows, 4096, 3600)
+        print('batches of 4096     {:8.0f} rows/s'.format(rate))
+        print('{} rows          {:8.0f} MB'.format(args.rows, os.path.getsize(filename) / 1e6))
+
+        db = sqlite3.connect(filename)
+        queries = 20
+        start = time.perf_counter()
+        for i in range(queries):
+            query_start = START_TIME + (args.rows - 3600) * i / queries
+            db.execute(
+                'SELECT time, volts, amps FROM um WHERE device_id = ? AND time BETWEEN ? AND ?',
+                (DEVICE_ID, query_start, query_start + 3600),
+            ).fetchall()
+        elapsed = time.perf_counter() - start
+        print('1 h range query     {:8.2f} ms'.format(elapsed / queries * 1000))
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+# rdserialtool
+# Copyright (C) 2019-2021 Ryan Finnie
+# SPDX-License-Identifier: MPL-2.0
+
+# UM samples per second collected by rdserialtool in watch mode
+# (without a watch delay) and in stream mode, against an emulated UM25C
+# paced at 9600 baud and unpaced with 5 ms of latency.
+
+import argparse
+import signal
+import subprocess
+import sys
+import time
+
+import rdserial.emulator
+
+MODES = (
+    ('watch', ['--watch', '--watch-seconds', '0']),
+    ('stream', ['--stream']),
+)
+FORMATS = (
+    ('human', []),
+    ('json', ['--json']),
+)
+
+
+def run(baudrate, mode_args, format_args, seconds):
+    emulator = rdserial.emulator.UMEmulator(device_type='UM25C', baudrate=baudrate, latency=0.005)
+    port = emulator.start()
+    try:
+        process = subprocess.Popen(
+            [
+                sys.executable, '-m', 'rdserial.tool', '--quiet', '--device', 'um25c',
+                '--serial-device', port, '--baud', str(baudrate or 9600), '--connect-delay', '0',
+            ] + mode_args + format_args,
+            stdout=subprocess.DEVNULL,
+        )
+        # Skip connection setup
+        time.sleep(1)
+        responses = emulator.responses
+        time.sleep(seconds)
+        responses = emulator.responses - responses
+        process.send_signal(signal.SIGINT)
+        process.wait()
+    finally:
+        emulator.close()
+    return responses / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description='UM streaming benchmark')
+    parser.add_argument('--seconds', '-n', type=float, default=5.0)
+    args = parser.parse_args()
+
+    print('{:16} {:8}  {:>6}  {:>6}'.format('samples/s', '', 'human', 'json'))
+    for baudrate, label in ((9600, '9600 baud'), (None, 'unpaced 5 ms')):
+        for mode, mode_args in MODES:
+            results = [run(baudrate, mode_args, format_args, args.seconds) for name, format_args in FORMATS]
+            print('{:16} {:8}  {:6.1f}  {:6.1f}'.format(label, mode, *results))
+            label = ''
+
+
+if __name__ == '__main__':
+    main()
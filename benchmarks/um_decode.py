@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+# rdserialtool
+# Copyright (C) 2019-2021 Ryan Finnie
+# SPDX-License-Identifier: MPL-2.0
+
+# UM frame decode and dump() rate, in frames per second.
+
+import argparse
+import time
+
+import rdserial.um
+
+
+def main():
+    parser = argparse.ArgumentParser(description='UM frame decode benchmark')
+    parser.add_argument('--iterations', '-n', type=int, default=20000)
+    args = parser.parse_args()
+
+    response = rdserial.um.Response(device_type='UM25C')
+    response.volts = 5.1234
+    response.amps = 0.1234
+    response.watts = 0.6
+    frame = response.dump()
+
+    for device_type in ('UM24C', 'UM25C', 'UM34C'):
+        start = time.perf_counter()
+        for i in range(args.iterations):
+            rdserial.um.Response(frame, device_type=device_type)
+        elapsed = time.perf_counter() - start
+        print('decode {}  {:8.0f} frames/s'.format(device_type, args.iterations / elapsed))
+
+    start = time.perf_counter()
+    for i in range(args.iterations):
+        response.dump()
+    elapsed = time.perf_counter() - start
+    print('dump        {:8.0f} frames/s'.format(args.iterations / elapsed))
+
+
+if __name__ == '__main__':
+    main()
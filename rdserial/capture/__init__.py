@@ -0,0 +1,131 @@
+# rdserialtool
+# Copyright (C) 2019-2021 Ryan Finnie
+# SPDX-License-Identifier: MPL-2.0
+
+# Append-only binary capture of raw device data.
+#
+# A capture file starts with FILE_HEADER, followed by any number of
+# records.  Each record is RECORD_HEADER followed by the payload:
+#
+#   monotonic   double  time.monotonic() at collection
+#   wall        double  time.time() at collection
+#   device_type uint8   see DEVICE_TYPES
+#   unit        uint8   Modbus unit number (0 for UM)
+#   base        uint16  first register (0 for UM)
+#   length      uint16  register count (Modbus) or byte count (UM)
+#
+# The payload is the raw 130-byte frame for UM devices, or the register
+# values as big-endian 16-bit words for Modbus devices.
+
+import collections
+import os
+import struct
+import time
+
+FILE_MAGIC = b'RDSERCAP'
+FILE_VERSION = 1
+FILE_HEADER = struct.Struct('>8sH')
+RECORD_HEADER = struct.Struct('>ddBBHH')
+
+DEVICE_TYPES = {
+    'um24c': 1,
+    'um25c': 2,
+    'um34c': 3,
+    'dps': 16,
+    'dps3005': 17,
+    'dps5005': 18,
+    'dps5015': 19,
+    'dps5020': 20,
+    'dps8005': 21,
+    'dph5005': 22,
+    'rd': 32,
+    'rd6006': 33,
+}
+DEVICE_NAMES = {v: k for k, v in DEVICE_TYPES.items()}
+
+
+def is_modbus(device_type):
+    return DEVICE_TYPES[device_type] >= 16
+
+
+class Record(collections.namedtuple(
+    'Record', ('monotonic', 'wall', 'device_type', 'unit', 'base', 'length', 'payload'),
+)):
+    """A single captured UM frame or Modbus register block"""
+
+    __slots__ = ()
+
+    @property
+    def registers(self):
+        return struct.unpack('>{}H'.format(self.length), self.payload)
+
+
+class CaptureWriter:
+    def __init__(self, filename, device_type):
+        self.filename = filename
+        self.device_type = device_type
+        self._device_code = DEVICE_TYPES[device_type]
+        self.file = open(filename, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION))
+            self.file.flush()
+
+    def _write(self, unit, base, length, payload, monotonic=None, wall=None):
+        if monotonic is None:
+            monotonic = time.monotonic()
+        if wall is None:
+            wall = time.time()
+        self.file.write(RECORD_HEADER.pack(
+            monotonic, wall, self._device_code, unit, base, length,
+        ) + payload)
+        self.file.flush()
+
+    def write_frame(self, data, **kwargs):
+        self._write(0, 0, len(data), bytes(data), **kwargs)
+
+    def write_registers(self, base, registers, unit=1, **kwargs):
+        payload = struct.pack('>{}H'.format(len(registers)), *registers)
+        self._write(unit, base, len(registers), payload, **kwargs)
+
+    def close(self):
+        if self.file:
+            self.file.close()
+        self.file = None
+
+
+class CaptureReader:
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, 'rb')
+        header = self.file.read(FILE_HEADER.size)
+        if len(header) != FILE_HEADER.size:
+            raise ValueError('Truncated capture file header', filename)
+        magic, version = FILE_HEADER.unpack(header)
+        if magic != FILE_MAGIC:
+            raise ValueError('Not a capture file', filename)
+        if version != FILE_VERSION:
+            raise ValueError('Unsupported capture file version', version)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        # A short read at the end is a record still being written; rewind
+        # so it can be read once complete.
+        header = self.file.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+            self.file.seek(-len(header), os.SEEK_CUR)
+            raise StopIteration
+        monotonic, wall, device_code, unit, base, length = RECORD_HEADER.unpack(header)
+        device_type = DEVICE_NAMES[device_code]
+        payload_length = (length * 2 if is_modbus(device_type) else length)
+        payload = self.file.read(payload_length)
+        if len(payload) < payload_length:
+            self.file.seek(-(RECORD_HEADER.size + len(payload)), os.SEEK_CUR)
+            raise StopIteration
+        return Record(monotonic, wall, device_type, unit, base, length, payload)
+
+    def close(self):
+        if self.file:
+            self.file.close()
+        self.file = None
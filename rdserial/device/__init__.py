@@ -2,7 +2,13 @@
 # Copyright (C) 2019-2021 Ryan Finnie
 # SPDX-License-Identifier: MPL-2.0
 
+import array
 import logging
+import struct
+import time
+
+import rdserial.capture
+import rdserial.modbus
 
 try:
     import bluetooth
@@ -16,14 +22,26 @@ except ImportError:
     HAS_SERIAL = False
 
 
+def _buffer_view(transport, size, offset=0):
+    # Bytes before offset are kept, as the start of the same response
+    if len(transport._buffer) < offset + size:
+        buffer = bytearray(offset + size)
+        buffer[:offset] = transport._buffer[:offset]
+        transport._buffer = buffer
+    return memoryview(transport._buffer)[:offset + size]
+
+
 class Serial:
-    def __init__(self, port, baudrate=9600):
+    def __init__(self, port, baudrate=9600, timeout=None, inter_byte_timeout=None):
         if not HAS_SERIAL:
             raise NotImplementedError('pyserial not available')
 
         self.port = port
         self.baudrate = baudrate
+        self.timeout = timeout
+        self.inter_byte_timeout = inter_byte_timeout
         self.socket = None
+        self._buffer = bytearray()
 
     def connect(self):
         if self.socket:
@@ -33,6 +51,8 @@ class Serial:
         self.socket.port = self.port
         self.socket.baudrate = self.baudrate
         self.socket.writeTimeout = 0
+        self.socket.timeout = self.timeout
+        self.socket.inter_byte_timeout = self.inter_byte_timeout
         self.socket.open()
         return self.socket is not None
 
@@ -41,6 +61,10 @@ class Serial:
             self.socket.close()
         self.socket = None
 
+    def reset_input_buffer(self):
+        """Discard received but unread data, such as a late response"""
+        self.socket.reset_input_buffer()
+
     def send(self, request):
         if not request:
             return 0
@@ -50,14 +74,28 @@ class Serial:
         return size
 
     def recv(self, size):
-        result = b''
-        logging.debug('Serial: RECV begin')
-        while len(result) < size:
-            buf = self.socket.read()
-            result += buf
+        result = bytes(self.recv_into(size))
         logging.debug('Serial: RECV end ({})'.format(result))
         return result
 
+    def recv_into(self, size, offset=0):
+        """Receive into the reusable connection buffer
+
+        The bytes are received at offset, after any earlier part of the
+        response, and a memoryview of the buffer up to their end is
+        returned.  It is only valid until the next receive.
+        """
+        view = _buffer_view(self, size, offset)
+        logging.debug('Serial: RECV begin')
+        # The port timeouts are set once, on connect.  pyserial applies
+        # timeout as a deadline for the whole read, which otherwise
+        # blocks until all bytes arrive; a short read means a timeout.
+        buf = self.socket.read(size)
+        view[offset:offset + len(buf)] = buf
+        if len(buf) < size:
+            raise TimeoutError('Serial: RECV timed out ({} of {} bytes)'.format(len(buf), size))
+        return view
+
     def __str__(self):
         return '%s' % self.port
 
@@ -70,6 +108,7 @@ class Bluetooth:
         self.address = address
         self.port = port
         self.socket = None
+        self._buffer = bytearray()
 
     def connect(self):
         if self.socket:
@@ -84,6 +123,17 @@ class Bluetooth:
             self.socket.close()
         self.socket = None
 
+    def reset_input_buffer(self):
+        """Discard received but unread data, such as a late response"""
+        self.socket.setblocking(False)
+        try:
+            while self.socket.recv(1024):
+                pass
+        except OSError:
+            pass
+        finally:
+            self.socket.setblocking(True)
+
     def send(self, request):
         if not request:
             return 0
@@ -94,13 +144,152 @@ class Bluetooth:
         return size
 
     def recv(self, size):
-        result = b''
-        logging.debug('Bluetooth: RECV begin')
-        while len(result) < size:
-            buf = self.socket.recv(size)
-            result += buf
+        result = bytes(self.recv_into(size))
         logging.debug('Bluetooth: RECV end ({})'.format(result))
         return result
 
+    def recv_into(self, size, offset=0):
+        """Receive into the reusable connection buffer
+
+        Only the remaining bytes are requested from the socket, so reads
+        never run past the end of the response.  As with Serial, the
+        bytes are received at offset and the returned memoryview is only
+        valid until the next receive.
+        """
+        view = _buffer_view(self, size, offset)
+        pos = offset
+        end = offset + size
+        logging.debug('Bluetooth: RECV begin')
+        socket_recv_into = getattr(self.socket, 'recv_into', None)
+        while pos < end:
+            if socket_recv_into:
+                pos += socket_recv_into(view[pos:], end - pos)
+            else:
+                buf = self.socket.recv(end - pos)
+                view[pos:pos + len(buf)] = buf
+                pos += len(buf)
+        return view
+
     def __str__(self):
         return '%s:%s' % (self.address, self.port)
+
+
+class Replay:
+    """File-backed transport answering requests from a capture file
+
+    UM 0xf0 polls are answered with the next captured frame.  Modbus
+    register reads are answered from a register image, updated with the
+    next captured blocks overlapping the requested registers, so reads
+    need not line up with the captured blocks.  Writes and other UM
+    commands are acknowledged but otherwise ignored.
+
+    With realtime, responses are delayed to match the original capture
+    timing; otherwise they are returned immediately.
+    """
+
+    def __init__(self, filename, realtime=False):
+        self.filename = filename
+        self.realtime = realtime
+        self.socket = None
+        self._buffer = bytearray()
+        self._pending = b''
+        self._time_offset = None
+        self._record = None
+        self._images = {}
+
+    def connect(self):
+        if self.socket:
+            return True
+        logging.debug('Replay: Opening {}'.format(self.filename))
+        self.socket = rdserial.capture.CaptureReader(self.filename)
+        return self.socket is not None
+
+    def close(self):
+        if self.socket:
+            self.socket.close()
+        self.socket = None
+
+    def _next_record(self, match):
+        record, self._record = self._record, None
+        if record is None or not match(record):
+            for record in self.socket:
+                if match(record):
+                    break
+            else:
+                raise EOFError('End of capture', self.filename)
+
+        if self.realtime:
+            now = time.monotonic()
+            if self._time_offset is None:
+                self._time_offset = now - record.monotonic
+            to_sleep = record.monotonic + self._time_offset - now
+            if to_sleep > 0:
+                time.sleep(to_sleep)
+        return record
+
+    def _modbus_response(self, request):
+        unit, function = request[0], request[1]
+        if function == 0x03:
+            base, length = struct.unpack('>HH', request[2:6])
+            image = self._images.setdefault(unit, array.array('H', bytes(0x20000)))
+            # Consume overlapping records until the range is covered, or
+            # until a record would refresh a register again (the start of
+            # the next captured poll).
+            seen = bytearray(length)
+            while not all(seen):
+                try:
+                    record = self._next_record(lambda x: (
+                        rdserial.capture.is_modbus(x.device_type)
+                        and x.unit == unit
+                        and x.base < (base + length)
+                        and (x.base + x.length) > base
+                    ))
+                except EOFError:
+                    if not any(seen):
+                        raise
+                    break
+                lo = max(record.base, base) - base
+                hi = min(record.base + record.length, base + length) - base
+                if any(seen[lo:hi]):
+                    self._record = record
+                    break
+                image[record.base:record.base + record.length] = array.array('H', record.registers)
+                seen[lo:hi] = b'\x01' * (hi - lo)
+            response = struct.pack('>BBB{}H'.format(length), unit, function, length * 2, *image[base:base + length])
+        elif function == 0x06:
+            return request
+        elif function == 0x10:
+            response = request[0:6]
+        else:
+            raise ValueError('Unsupported Modbus function', function)
+        return response + struct.pack('<H', rdserial.modbus.modbus_crc(response))
+
+    def reset_input_buffer(self):
+        self._pending = b''
+
+    def send(self, request):
+        if not request:
+            return 0
+        logging.debug('Replay: SEND ({})'.format(request))
+        if request == b'\xf0':
+            record = self._next_record(lambda x: not rdserial.capture.is_modbus(x.device_type))
+            self._pending += record.payload
+        elif len(request) >= 8:
+            self._pending += self._modbus_response(request)
+        return len(request)
+
+    def recv(self, size):
+        if not self._pending:
+            raise EOFError('No captured response pending', self.filename)
+        result = self._pending[:size]
+        self._pending = self._pending[size:]
+        logging.debug('Replay: RECV ({})'.format(result))
+        return result
+
+    def recv_into(self, size, offset=0):
+        view = _buffer_view(self, size, offset)
+        view[offset:] = self.recv(size)
+        return view
+
+    def __str__(self):
+        return '%s' % self.filename
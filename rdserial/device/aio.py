@@ -0,0 +1,205 @@
+# rdserialtool
+# Copyright (C) 2019-2021 Ryan Finnie
+# SPDX-License-Identifier: MPL-2.0
+
+# asyncio transports.  Instead of blocking a thread per device, reads and
+# writes wait for readiness of the serial or RFCOMM file descriptor on the
+# event loop, with deadline-based timeouts.
+
+import asyncio
+import logging
+import socket as socket_module
+
+try:
+    import serial
+    HAS_SERIAL = True
+except ImportError:
+    HAS_SERIAL = False
+HAS_BLUETOOTH = hasattr(socket_module, 'AF_BLUETOOTH') and hasattr(socket_module, 'BTPROTO_RFCOMM')
+
+
+class _AsyncTransport:
+    name = 'Async'
+
+    def fileno(self):
+        raise NotImplementedError
+
+    def _read(self, size):
+        """Non-blocking read
+
+        Raises BlockingIOError if nothing is available, or
+        ConnectionResetError if the connection was closed.
+        """
+        raise NotImplementedError
+
+    def _write(self, data):
+        """Non-blocking write; returns the number of bytes written"""
+        raise NotImplementedError
+
+    def reset_input_buffer(self):
+        """Discard any received data not yet read, without blocking"""
+        while True:
+            try:
+                self._read(4096)
+            except BlockingIOError:
+                return
+
+    async def _wait(self, add, remove):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        fd = self.fileno()
+
+        def ready():
+            if not future.done():
+                future.set_result(None)
+
+        add(fd, ready)
+        try:
+            await future
+        finally:
+            remove(fd)
+
+    async def send(self, request, timeout=None):
+        if not request:
+            return 0
+        loop = asyncio.get_running_loop()
+        deadline = (None if timeout is None else loop.time() + timeout)
+        logging.debug('{}: SEND begin ({})'.format(self.name, request))
+        view = memoryview(request)
+        pos = 0
+        while pos < len(view):
+            size = self._write(view[pos:])
+            if size:
+                pos += size
+                continue
+            await self._wait_deadline(loop.add_writer, loop.remove_writer, deadline)
+        logging.debug('{}: SEND end ({} bytes)'.format(self.name, pos))
+        return pos
+
+    async def recv(self, size, timeout=None):
+        loop = asyncio.get_running_loop()
+        deadline = (None if timeout is None else loop.time() + timeout)
+        result = bytearray(size)
+        view = memoryview(result)
+        pos = 0
+        logging.debug('{}: RECV begin'.format(self.name))
+        while pos < size:
+            try:
+                buf = self._read(size - pos)
+            except BlockingIOError:
+                await self._wait_deadline(loop.add_reader, loop.remove_reader, deadline)
+                continue
+            view[pos:pos + len(buf)] = buf
+            pos += len(buf)
+        result = bytes(result)
+        logging.debug('{}: RECV end ({})'.format(self.name, result))
+        return result
+
+    async def _wait_deadline(self, add, remove, deadline):
+        if deadline is None:
+            return await self._wait(add, remove)
+        remaining = deadline - asyncio.get_running_loop().time()
+        if remaining <= 0:
+            raise TimeoutError('{}: Timed out'.format(self.name))
+        try:
+            await asyncio.wait_for(self._wait(add, remove), remaining)
+        except asyncio.TimeoutError:
+            raise TimeoutError('{}: Timed out'.format(self.name))
+
+
+class AsyncSerial(_AsyncTransport):
+    name = 'Serial'
+
+    def __init__(self, port, baudrate=9600):
+        if not HAS_SERIAL:
+            raise NotImplementedError('pyserial not available')
+
+        self.port = port
+        self.baudrate = baudrate
+        self.socket = None
+
+    async def connect(self):
+        if self.socket:
+            return True
+        logging.debug('Serial: Connecting to {}'.format(self.port))
+        self.socket = serial.Serial()
+        self.socket.port = self.port
+        self.socket.baudrate = self.baudrate
+        self.socket.timeout = 0
+        self.socket.writeTimeout = 0
+        self.socket.open()
+        return self.socket is not None
+
+    async def close(self):
+        if self.socket:
+            self.socket.close()
+        self.socket = None
+
+    def fileno(self):
+        return self.socket.fileno()
+
+    def reset_input_buffer(self):
+        self.socket.reset_input_buffer()
+
+    def _read(self, size):
+        # With a zero timeout, pyserial returns nothing if no data is
+        # waiting, and raises SerialException if the port has gone away
+        buf = self.socket.read(size)
+        if not buf:
+            raise BlockingIOError
+        return buf
+
+    def _write(self, data):
+        try:
+            return self.socket.write(data) or 0
+        except serial.SerialTimeoutException:
+            return 0
+
+    def __str__(self):
+        return '%s' % self.port
+
+
+class AsyncBluetooth(_AsyncTransport):
+    name = 'Bluetooth'
+
+    def __init__(self, address, port=1):
+        if not HAS_BLUETOOTH:
+            raise NotImplementedError('RFCOMM sockets not available')
+
+        self.address = address
+        self.port = port
+        self.socket = None
+
+    async def connect(self):
+        if self.socket:
+            return True
+        logging.debug('Bluetooth: Connecting to {} port {}'.format(self.address, self.port))
+        self.socket = socket_module.socket(
+            socket_module.AF_BLUETOOTH, socket_module.SOCK_STREAM, socket_module.BTPROTO_RFCOMM,
+        )
+        self.socket.setblocking(False)
+        await asyncio.get_running_loop().sock_connect(self.socket, (self.address, self.port))
+        return self.socket is not None
+
+    async def close(self):
+        if self.socket:
+            self.socket.close()
+        self.socket = None
+
+    def fileno(self):
+        return self.socket.fileno()
+
+    def _read(self, size):
+        buf = self.socket.recv(size)
+        if not buf:
+            raise ConnectionResetError('{}: Connection closed'.format(self.name))
+        return buf
+
+    def _write(self, data):
+        try:
+            return self.socket.send(data)
+        except BlockingIOError:
+            return 0
+
+    def __str__(self):
+        return '%s:%s' % (self.address, self.port)
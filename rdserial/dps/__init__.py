@@ -2,7 +2,11 @@
 # Copyright (C) 2019-2021 Ryan Finnie
 # SPDX-License-Identifier: MPL-2.0
 
+import array
+import bisect
 import datetime
+import time
+import types
 
 PROTECTION_GOOD = 0
 PROTECTION_OV = 1
@@ -13,7 +17,7 @@ PROTECTION_OP = 3
 def _simple_int(multiple=1):
     return {
         'from_int': lambda x: x / multiple,
-        'to_int': lambda x: int(x * multiple),
+        'to_int': lambda x: int(round(x * multiple)),
     }
 
 
@@ -24,106 +28,256 @@ def _simple_bool():
     }
 
 
-class DPSDeviceState:
-    def __init__(self, collection_time=None):
-        self.register_properties = {
-            'setting_volts': {
-                'description': 'Voltage setting',
-                'register': 0x00,
-                **_simple_int(100),
-            },
-            'setting_amps': {
-                'description': 'Amperage setting',
-                'register': 0x01,
-                **_simple_int(1000),
-            },
-            'volts': {
-                'description': 'Output volts',
-                'register': 0x02,
-                **_simple_int(100),
-            },
-            'amps': {
-                'description': 'Output amps',
-                'register': 0x03,
-                **_simple_int(100),
-            },
-            'watts': {
-                'description': 'Output watts',
-                'register': 0x04,
-                **_simple_int(100),
-            },
-            'input_volts': {
-                'description': 'Input volts',
-                'register': 0x05,
-                **_simple_int(100),
-            },
-            'key_lock': {
-                'description': 'Key lock',
-                'register': 0x06,
-                **_simple_bool(),
-            },
-            'protection': {
-                'description': 'Protection status',
-                'register': 0x07,
-                **_simple_int(),
-            },
-            'constant_current': {
-                'description': 'Constant current mode',
-                'register': 0x08,
-                **_simple_bool(),
-            },
-            'output_state': {
-                'description': 'Output state',
-                'register': 0x09,
-                **_simple_bool(),
-            },
-            'brightness': {
-                'description': 'Brightness level',
-                'register': 0x0a,
-                **_simple_int(),
-            },
-            'model': {
-                'description': 'Device model',
-                'register': 0x0b,
-                **_simple_int(),
-            },
-            'firmware': {
-                'description': 'Device firmware',
-                'register': 0x0c,
-                **_simple_int(),
-            },
-            'group_loader': {
-                'description': 'Group loader',
-                'register': 0x23,
-                'from_int': lambda x: 0,  # Write-only
-                'to_int': lambda x: int(x),
-            },
-        }
+def _cold():
+    return {'tier': 'cold'}
 
-        if collection_time is None:
-            collection_time = datetime.datetime.now()
-        self.collection_time = collection_time
-        for name in self.register_properties:
-            setattr(self, name, self.register_properties[name]['from_int'](0))
-        self.groups = {}
+
+def _read_only():
+    return {'read_only': True}
+
+
+def _write_only():
+    return {
+        'from_int': lambda x: 0,
+        'to_int': lambda x: int(x),
+        'write_only': True,
+    }
+
+
+class RegisterTable:
+    """Immutable register map, shared by every state using the layout
+
+    Raw register values are stored per state in names order.  positions is
+    a register-sorted tuple of (register, index) for the readable
+    registers, so loading only visits mapped registers.  Each register has
+    a poll tier: 'hot' registers are expected to change between polls,
+    'cold' registers (identification and settings) rarely do.  writable
+    is the sorted registers which are both readable and writable.
+    """
+
+    def __init__(self, properties, default_tier='hot'):
+        self.properties = types.MappingProxyType(
+            {k: types.MappingProxyType(v) for k, v in properties.items()}
+        )
+        self.names = tuple(properties)
+        self.from_ints = tuple(v['from_int'] for v in properties.values())
+        self.to_ints = tuple(v['to_int'] for v in properties.values())
+        self.positions = tuple(sorted(
+            (v['register'], i) for i, v in enumerate(properties.values())
+            if not v.get('write_only')
+        ))
+        self.registers = tuple(x[0] for x in self.positions)
+        self.tiers = tuple(v.get('tier', default_tier) for v in properties.values())
+        self.writable = tuple(sorted(
+            v['register'] for v in properties.values()
+            if not v.get('write_only') and not v.get('read_only')
+        ))
+
+    def field_registers(self, names=None, tier=None):
+        """Sorted readable registers holding the named fields
+
+        All readable registers are returned if names is None, optionally
+        limited to those in the given tier.  Raises KeyError for unknown
+        names.
+        """
+        if names is None:
+            names = self.names
+        indexes = {name: i for i, name in enumerate(self.names)}
+        return tuple(sorted(
+            self.properties[name]['register'] for name in names
+            if not self.properties[name].get('write_only')
+            and (tier is None or self.tiers[indexes[name]] == tier)
+        ))
+
+    def new_raw(self):
+        return array.array('H', bytes(2 * len(self.names)))
+
+    def load(self, raw, data, offset=0):
+        lo = bisect.bisect_left(self.registers, offset)
+        hi = bisect.bisect_left(self.registers, offset + len(data))
+        for register, index in self.positions[lo:hi]:
+            raw[index] = data[register - offset]
+
+
+class _Register:
+    """Lazily-decoded view of a raw register value"""
+
+    __slots__ = ('index',)
+
+    def __init__(self, index):
+        self.index = index
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return obj.register_table.from_ints[self.index](obj._raw[self.index])
+
+    def __set__(self, obj, value):
+        obj._raw[self.index] = obj.register_table.to_ints[self.index](value)
+
+
+def _add_registers(cls, table):
+    for index, name in enumerate(table.names):
+        setattr(cls, name, _Register(index))
+    return cls
+
+
+class _State:
+    """Base for device and group states
+
+    States only hold an array of raw register values; attributes are
+    decoded on access using the shared register table.
+    """
+
+    __slots__ = ('_raw',)
+    register_table = None
+
+    @property
+    def register_properties(self):
+        return self.register_table.properties
 
     def load(self, data, offset=0):
-        pos_map = {v['register']: k for k, v in self.register_properties.items()}
-        i = 0
-        for raw_val in data:
-            val_pos = offset + i
-            if val_pos in pos_map:
-                name = pos_map[val_pos]
-                translation = self.register_properties[name]['from_int']
-                val = translation(raw_val)
-                setattr(self, name, val)
-            i = i + 1
-
-
-class DPSGroupState:
+        self.register_table.load(self._raw, data, offset)
+
+
+class _GroupState(_State):
+    __slots__ = ('group', 'register_table')
+    _group_tables = None
+
+    @classmethod
+    def group_register_table(cls, group):
+        table = cls._group_tables.get(group)
+        if table is None:
+            table = RegisterTable(cls.group_register_properties(group), default_tier='cold')
+            cls._group_tables[group] = table
+        return table
+
+    @staticmethod
+    def group_register_properties(group):
+        raise NotImplementedError
+
     def __init__(self, group):
         self.group = group
-        self.register_properties = {
+        self.register_table = self.group_register_table(group)
+        self._raw = self.register_table.new_raw()
+
+
+class _DeviceState(_State):
+    __slots__ = ('collection_timestamp', 'groups')
+
+    def __init__(self, collection_time=None, collection_timestamp=None):
+        if collection_timestamp is not None:
+            self.collection_timestamp = collection_timestamp
+        elif collection_time is not None:
+            self.collection_time = collection_time
+        else:
+            self.collection_timestamp = time.time()
+        self._raw = self.register_table.new_raw()
+        self.groups = {}
+
+    @property
+    def collection_time(self):
+        return datetime.datetime.fromtimestamp(self.collection_timestamp)
+
+    @collection_time.setter
+    def collection_time(self, collection_time):
+        self.collection_timestamp = collection_time.timestamp()
+
+
+class DPSDeviceState(_DeviceState):
+    __slots__ = ()
+    register_table = RegisterTable({
+        'setting_volts': {
+            'description': 'Voltage setting',
+            'register': 0x00,
+            **_simple_int(100),
+        },
+        'setting_amps': {
+            'description': 'Amperage setting',
+            'register': 0x01,
+            **_simple_int(1000),
+        },
+        'volts': {
+            'description': 'Output volts',
+            'register': 0x02,
+            **_simple_int(100),
+            **_read_only(),
+        },
+        'amps': {
+            'description': 'Output amps',
+            'register': 0x03,
+            **_simple_int(100),
+            **_read_only(),
+        },
+        'watts': {
+            'description': 'Output watts',
+            'register': 0x04,
+            **_simple_int(100),
+            **_read_only(),
+        },
+        'input_volts': {
+            'description': 'Input volts',
+            'register': 0x05,
+            **_simple_int(100),
+            **_read_only(),
+        },
+        'key_lock': {
+            'description': 'Key lock',
+            'register': 0x06,
+            **_simple_bool(),
+        },
+        'protection': {
+            'description': 'Protection status',
+            'register': 0x07,
+            **_simple_int(),
+            **_read_only(),
+        },
+        'constant_current': {
+            'description': 'Constant current mode',
+            'register': 0x08,
+            **_simple_bool(),
+            **_read_only(),
+        },
+        'output_state': {
+            'description': 'Output state',
+            'register': 0x09,
+            **_simple_bool(),
+        },
+        'brightness': {
+            'description': 'Brightness level',
+            'register': 0x0a,
+            **_simple_int(),
+            **_cold(),
+        },
+        'model': {
+            'description': 'Device model',
+            'register': 0x0b,
+            **_simple_int(),
+            **_cold(),
+            **_read_only(),
+        },
+        'firmware': {
+            'description': 'Device firmware',
+            'register': 0x0c,
+            **_simple_int(),
+            **_cold(),
+            **_read_only(),
+        },
+        'group_loader': {
+            'description': 'Group loader',
+            'register': 0x23,
+            **_write_only(),
+        },
+    })
+
+
+class DPSGroupState(_GroupState):
+    __slots__ = ()
+    _group_tables = {}
+
+    @staticmethod
+    def group_register_properties(group):
+        return {
             'setting_volts': {
                 'description': 'Voltage setting',
                 'register': 0x50 + (0x10 * group),
@@ -166,175 +320,166 @@ class DPSGroupState:
             },
         }
 
-        for name in self.register_properties:
-            setattr(self, name, self.register_properties[name]['from_int'](0))
 
-    def load(self, data, offset=0):
-        pos_map = {v['register']: k for k, v in self.register_properties.items()}
-        i = 0
-        for raw_val in data:
-            val_pos = offset + i
-            if val_pos in pos_map:
-                name = pos_map[val_pos]
-                translation = self.register_properties[name]['from_int']
-                val = translation(raw_val)
-                setattr(self, name, val)
-            i = i + 1
-
-
-class RDDeviceState:
-    def __init__(self, collection_time=None):
-        self.register_properties = {
-            'model': {
-                'description': 'Device model',
-                'register': 0x00,
-                **_simple_int(),
-            },
-            'serial': {
-                'description': 'Device serial',
-                'register': 0x02,  # 0x01 high?
-                **_simple_int(),
-            },
-            'firmware': {
-                'description': 'Device firmware',
-                'register': 0x03,
-                **_simple_int(),
-            },
-            'fan_temp_c': {
-                'description': 'Fan start temperature (C)',
-                'register': 0x05,  # 0x04 high?
-                **_simple_int(),
-            },
-            'fan_temp_f': {
-                'description': 'Fan start temperature (F)',
-                'register': 0x07,  # 0x06 high?
-                **_simple_int(),
-            },
-            'setting_volts': {
-                'description': 'Voltage setting',
-                'register': 0x08,
-                **_simple_int(100),
-            },
-            'setting_amps': {
-                'description': 'Amperage setting',
-                'register': 0x09,
-                **_simple_int(1000),
-            },
-            'volts': {
-                'description': 'Output volts',
-                'register': 0x0a,
-                **_simple_int(100),
-            },
-            'amps': {
-                'description': 'Output amps',
-                'register': 0x0b,
-                **_simple_int(100),
-            },
-            'watts': {
-                'description': 'Output watts',
-                'register': 0x0d,  # 0x0c high?
-                **_simple_int(100),
-            },
-            'input_volts': {
-                'description': 'Input volts',
-                'register': 0x0e,
-                **_simple_int(100),
-            },
-            'key_lock': {
-                'description': 'Key lock',
-                'register': 0x0f,
-                **_simple_bool(),
-            },
-            'protection': {
-                'description': 'Protection status',
-                'register': 0x10,
-                **_simple_int(),
-            },
-            'constant_current': {
-                'description': 'Constant current mode',
-                'register': 0x11,
-                **_simple_bool(),
-            },
-            'output_state': {
-                'description': 'Output state',
-                'register': 0x12,
-                **_simple_bool(),
-            },
-            'group_loader': {
-                'description': 'Group loader',
-                'register': 0x13,
-                'from_int': lambda x: 0,  # Write-only
-                'to_int': lambda x: int(x),
-            },
-            # 0x14 - 0x2f: All 0
-            # 0x21: Unknown, 1/2/3 observed
-            'temp_c': {
-                'description': 'Temperature (C)',
-                'register': 0x23,  # 0x22 high?
-                **_simple_int(),
-            },
-            'temp_f': {
-                'description': 'Temperature (F)',
-                'register': 0x25,  # 0x24 high?
-                **_simple_int(),
-            },
-            'cumulative_charge': {
-                'description': 'Cumulative charge (Ah)',
-                'register': 0x27,  # 0x26 high?
-                **_simple_int(1000),
-            },
-            'cumulative_energy': {
-                'description': 'Cumulative energy (Wh)',
-                'register': 0x29,  # 0x28 high?
-                **_simple_int(1000),
-            },
-            'datetime_year': {'description': 'Year', 'register': 0x30, **_simple_int()},
-            'datetime_month': {'description': 'Month', 'register': 0x31, **_simple_int()},
-            'datetime_day': {'description': 'Day', 'register': 0x32, **_simple_int()},
-            'datetime_hour': {'description': 'Hour', 'register': 0x33, **_simple_int()},
-            'datetime_minute': {'description': 'Minute', 'register': 0x34, **_simple_int()},
-            'datetime_second': {'description': 'Second', 'register': 0x35, **_simple_int()},
-            'brightness': {
-                'description': 'Brightness level',
-                'register': 0x48,
-                **_simple_int(),
-            },
-            'ovp': {
-                'description': 'Over-voltage limit (V)',
-                'register': 0x52,
-                **_simple_int(100),
-            },
-            'ocp': {
-                'description': 'Over-current limit (A)',
-                'register': 0x53,
-                **_simple_int(1000),
-            },
-        }
+class RDDeviceState(_DeviceState):
+    __slots__ = ()
+    register_table = RegisterTable({
+        'model': {
+            'description': 'Device model',
+            'register': 0x00,
+            **_simple_int(),
+            **_cold(),
+            **_read_only(),
+        },
+        'serial': {
+            'description': 'Device serial',
+            'register': 0x02,  # 0x01 high?
+            **_simple_int(),
+            **_cold(),
+            **_read_only(),
+        },
+        'firmware': {
+            'description': 'Device firmware',
+            'register': 0x03,
+            **_simple_int(),
+            **_cold(),
+            **_read_only(),
+        },
+        'fan_temp_c': {
+            'description': 'Fan start temperature (C)',
+            'register': 0x05,  # 0x04 high?
+            **_simple_int(),
+            **_cold(),
+            **_read_only(),
+        },
+        'fan_temp_f': {
+            'description': 'Fan start temperature (F)',
+            'register': 0x07,  # 0x06 high?
+            **_simple_int(),
+            **_cold(),
+            **_read_only(),
+        },
+        'setting_volts': {
+            'description': 'Voltage setting',
+            'register': 0x08,
+            **_simple_int(100),
+        },
+        'setting_amps': {
+            'description': 'Amperage setting',
+            'register': 0x09,
+            **_simple_int(1000),
+        },
+        'volts': {
+            'description': 'Output volts',
+            'register': 0x0a,
+            **_simple_int(100),
+            **_read_only(),
+        },
+        'amps': {
+            'description': 'Output amps',
+            'register': 0x0b,
+            **_simple_int(100),
+            **_read_only(),
+        },
+        'watts': {
+            'description': 'Output watts',
+            'register': 0x0d,  # 0x0c high?
+            **_simple_int(100),
+            **_read_only(),
+        },
+        'input_volts': {
+            'description': 'Input volts',
+            'register': 0x0e,
+            **_simple_int(100),
+            **_read_only(),
+        },
+        'key_lock': {
+            'description': 'Key lock',
+            'register': 0x0f,
+            **_simple_bool(),
+        },
+        'protection': {
+            'description': 'Protection status',
+            'register': 0x10,
+            **_simple_int(),
+            **_read_only(),
+        },
+        'constant_current': {
+            'description': 'Constant current mode',
+            'register': 0x11,
+            **_simple_bool(),
+            **_read_only(),
+        },
+        'output_state': {
+            'description': 'Output state',
+            'register': 0x12,
+            **_simple_bool(),
+        },
+        'group_loader': {
+            'description': 'Group loader',
+            'register': 0x13,
+            **_write_only(),
+        },
+        # 0x14 - 0x2f: All 0
+        # 0x21: Unknown, 1/2/3 observed
+        'temp_c': {
+            'description': 'Temperature (C)',
+            'register': 0x23,  # 0x22 high?
+            **_simple_int(),
+            **_read_only(),
+        },
+        'temp_f': {
+            'description': 'Temperature (F)',
+            'register': 0x25,  # 0x24 high?
+            **_simple_int(),
+            **_read_only(),
+        },
+        'cumulative_charge': {
+            'description': 'Cumulative charge (Ah)',
+            'register': 0x27,  # 0x26 high?
+            **_simple_int(1000),
+            **_read_only(),
+        },
+        'cumulative_energy': {
+            'description': 'Cumulative energy (Wh)',
+            'register': 0x29,  # 0x28 high?
+            **_simple_int(1000),
+            **_read_only(),
+        },
+        'datetime_year': {'description': 'Year', 'register': 0x30, **_simple_int(), **_cold()},
+        'datetime_month': {'description': 'Month', 'register': 0x31, **_simple_int(), **_cold()},
+        'datetime_day': {'description': 'Day', 'register': 0x32, **_simple_int(), **_cold()},
+        'datetime_hour': {'description': 'Hour', 'register': 0x33, **_simple_int(), **_cold()},
+        'datetime_minute': {'description': 'Minute', 'register': 0x34, **_simple_int(), **_cold()},
+        'datetime_second': {'description': 'Second', 'register': 0x35, **_simple_int(), **_cold()},
+        'brightness': {
+            'description': 'Brightness level',
+            'register': 0x48,
+            **_simple_int(),
+            **_cold(),
+        },
+        'ovp': {
+            'description': 'Over-voltage limit (V)',
+            'register': 0x52,
+            **_simple_int(100),
+            **_cold(),
+        },
+        'ocp': {
+            'description': 'Over-current limit (A)',
+            'register': 0x53,
+            **_simple_int(1000),
+            **_cold(),
+        },
+    })
 
-        if collection_time is None:
-            collection_time = datetime.datetime.now()
-        self.collection_time = collection_time
-        for name in self.register_properties:
-            setattr(self, name, self.register_properties[name]['from_int'](0))
-        self.groups = {}
 
-    def load(self, data, offset=0):
-        pos_map = {v['register']: k for k, v in self.register_properties.items()}
-        i = 0
-        for raw_val in data:
-            val_pos = offset + i
-            if val_pos in pos_map:
-                name = pos_map[val_pos]
-                translation = self.register_properties[name]['from_int']
-                val = translation(raw_val)
-                setattr(self, name, val)
-            i = i + 1
-
-
-class RDGroupState:
-    def __init__(self, group):
-        self.group = group
-        self.register_properties = {
+class RDGroupState(_GroupState):
+    __slots__ = ()
+    _group_tables = {}
+
+    @staticmethod
+    def group_register_properties(group):
+        return {
             'setting_volts': {
                 'description': 'Voltage setting',
                 'register': 0x50 + (0x04 * group),
@@ -357,17 +502,8 @@ class RDGroupState:
             },
         }
 
-        for name in self.register_properties:
-            setattr(self, name, self.register_properties[name]['from_int'](0))
 
-    def load(self, data, offset=0):
-        pos_map = {v['register']: k for k, v in self.register_properties.items()}
-        i = 0
-        for raw_val in data:
-            val_pos = offset + i
-            if val_pos in pos_map:
-                name = pos_map[val_pos]
-                translation = self.register_properties[name]['from_int']
-                val = translation(raw_val)
-                setattr(self, name, val)
-            i = i + 1
+_add_registers(DPSDeviceState, DPSDeviceState.register_table)
+_add_registers(DPSGroupState, DPSGroupState.group_register_table(0))
+_add_registers(RDDeviceState, RDDeviceState.register_table)
+_add_registers(RDGroupState, RDGroupState.group_register_table(0))
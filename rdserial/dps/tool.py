@@ -3,13 +3,16 @@
 # SPDX-License-Identifier: MPL-2.0
 
 import logging
-import json
 import datetime
-import time
-import statistics
+import threading
 
+import rdserial.capture
+import rdserial.scheduler
+import rdserial.sink
+import rdserial.trend
 import rdserial.dps
 import rdserial.modbus
+import rdserial.profile
 
 
 dps_supported_devices = ['dps', 'dps3005', 'dps5005', 'dps5015', 'dps5020', 'dps8005', 'dph5005']
@@ -17,9 +20,52 @@ rd_supported_devices = ['rd', 'rd6006']
 supported_devices = dps_supported_devices + rd_supported_devices
 
 
+def state_classes(device):
+    """Device and group state classes for a device"""
+    if device in rd_supported_devices:
+        return rdserial.dps.RDDeviceState, rdserial.dps.RDGroupState
+    return rdserial.dps.DPSDeviceState, rdserial.dps.DPSGroupState
+
+
+def fillable_registers(device):
+    """Registers which may be rewritten with their current values
+
+    These are the readable and writable registers of the device and its
+    memory groups, less the clock, which would be set back by the time
+    taken to read and rewrite it.
+    """
+    device_state_class, device_group_state_class = state_classes(device)
+    device_table = device_state_class.register_table
+    fillable = set(device_table.writable)
+    for group in range(10):
+        fillable.update(device_group_state_class.group_register_table(group).writable)
+    fillable.difference_update(
+        properties['register'] for name, properties in device_table.properties.items()
+        if name.startswith('datetime_')
+    )
+    return fillable
+
+
+def field_names(device):
+    """Names accepted by --fields for a device"""
+    return tuple(state_classes(device)[0].register_table.names)
+
+
 class Tool:
     def __init__(self, parent=None):
         self.trends = {}
+        self.recorder = None
+        self.scheduler = None
+        self.sink = None
+        self.sample_template = None
+        self.sample_fields = None
+        self.read_plan = None
+        self.hot_read_plan = None
+        self.cold_blocks = None
+        self.cycles = 0
+        self.device_name = None
+        self.output_lock = threading.Lock()
+        self.stop = threading.Event()
         if parent is not None:
             self.args = parent.args
             self.socket = parent.socket
@@ -28,19 +74,33 @@ class Tool:
         if not self.args.watch:
             return ''
 
-        if name in self.trends:
-            trend = statistics.mean(self.trends[name])
-            self.trends[name] = self.trends[name][1:] + [value]
-            if value > trend:
-                return '\u2197'
-            elif value < trend:
-                return '\u2198'
-            else:
-                return ' '
+        window = self.trends.get(name)
+        if window is None:
+            self.trends[name] = rdserial.trend.RollingWindow(self.args.trend_points)
+            self.trends[name].fill(value)
+            return ' '
+        trend = window.mean
+        window.push(value)
+        if value > trend:
+            return '\u2197'
+        elif value < trend:
+            return '\u2198'
         else:
-            self.trends[name] = [value for x in range(self.args.trend_points)]
             return ' '
 
+    def json_trends(self, out):
+        """Rolling statistics of the numeric fields in out, after adding them"""
+        trends = {}
+        for name, value in out.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            window = self.trends.get(name)
+            if window is None:
+                window = self.trends[name] = rdserial.trend.RollingWindow(self.args.trend_points)
+            window.push(value)
+            trends[name] = window.stats()
+        return trends
+
     def send_commands(self):
         register_commands = {}
 
@@ -83,6 +143,7 @@ class Tool:
             ))
             register_commands[register_num] = register_val
 
+        clock_registers = set()
         if getattr(self.args, 'set_clock'):
             logging.info('Setting device clock')
             now = datetime.datetime.now()
@@ -97,14 +158,9 @@ class Tool:
                     register_name, description, register_num, val, register_val
                 ))
                 register_commands[register_num] = register_val
+                clock_registers.add(register_num)
 
-        if self.args.all_groups:
-            groups = range(10)
-        elif self.args.group is not None:
-            groups = self.args.group
-        else:
-            groups = []
-        for group in groups:
+        for group in self.selected_groups():
             device_group_state = self.device_group_state_class(group)
 
             for arg_name, register_name in group_command_map:
@@ -123,29 +179,77 @@ class Tool:
                 ))
                 register_commands[register_num] = register_val
 
+        # Profile settings are only written where they differ from the
+        # device, and command line settings take precedence
+        known = {}
+        if self.args.profile:
+            profile_commands = rdserial.profile.profile_registers(
+                rdserial.profile.load_profile(self.args.profile),
+                self.device_state_class, self.device_group_state_class,
+            )
+            for base, length in rdserial.modbus.plan_reads(profile_commands, max_gap=self.args.max_read_gap):
+                known.update(enumerate(self.read_registers(base, length), base))
+            changed = {
+                register: value for register, value in profile_commands.items()
+                if register not in register_commands and known[register] != value
+            }
+            logging.info('Profile {}: {} of {} register(s) differ from the device'.format(
+                self.args.profile, len(changed), len(profile_commands),
+            ))
+            for register, value in sorted(changed.items()):
+                logging.debug('Profile register {}: {} ({})'.format(register, value, known[register]))
+            register_commands.update(changed)
+
         if len(register_commands) > 0:
             logging.info('')
+        else:
+            return
 
-        # Optimize into a set of minimal register writes
-        register_commands_opt = {}
-        for register in sorted(register_commands.keys()):
-            found_opt = False
-            for g in register_commands_opt:
-                if (register == g + len(register_commands_opt[g])) and (len(register_commands_opt[g]) < 32):
-                    register_commands_opt[g].append(register_commands[register])
-                    found_opt = True
-                    break
-            if not found_opt:
-                register_commands_opt[register] = [register_commands[register]]
-        for register_base in register_commands_opt:
+        # Plan the fewest transactions, filling gaps between writes with
+        # the current values of readable and writable registers.  Values
+        # already read for the profile need not be read again.
+        fillable = fillable_registers(self.args.device)
+        write_plan, fill = rdserial.modbus.plan_writes(register_commands, fillable=fillable, known=known)
+        for base, length in rdserial.modbus.plan_reads(fill):
+            logging.debug('Reading {} register(s) at base {} to fill write gaps'.format(length, base))
+            known.update(enumerate(self.read_registers(base, length), base))
+        values = dict(known)
+        values.update(register_commands)
+
+        for register_base, length in write_plan:
+            block = [values[x] for x in range(register_base, register_base + length)]
             logging.debug('Writing {} register(s) ({}) at base {}'.format(
-                len(register_commands_opt[register_base]),
-                register_commands_opt[register_base],
+                length,
+                block,
                 register_base,
             ))
             self.modbus_client.write_registers(
-                register_base, register_commands_opt[register_base], unit=self.args.modbus_unit,
+                register_base, block, unit=self.args.modbus_unit,
             )
+        self.invalidate_cold()
+
+        if self.args.verify_writes:
+            readable = set(self.device_state_class.register_table.registers)
+            for group in range(10):
+                readable.update(self.device_group_state_class.group_register_table(group).registers)
+            self.verify_writes({
+                register: value for register, value in register_commands.items()
+                if register in readable and register not in clock_registers
+            })
+
+    def verify_writes(self, register_commands):
+        """Read back written registers in one merged read, raising on mismatches"""
+        readback = {}
+        for base, length in rdserial.modbus.plan_reads(register_commands):
+            readback.update(enumerate(self.read_registers(base, length), base))
+        mismatches = [
+            'register {} is {}, expected {}'.format(register, readback[register], value)
+            for register, value in sorted(register_commands.items())
+            if readback[register] != value
+        ]
+        if mismatches:
+            raise RuntimeError('Write verification failed: {}'.format(', '.join(mismatches)))
+        logging.debug('Verified {} written register(s)'.format(len(register_commands)))
 
     def print_human(self, device_state):
         protection_map = {
@@ -205,50 +309,149 @@ class Tool:
             if hasattr(device_group_state, 'poweron_output'):
                 print('    Output on power-on: {}'.format(device_group_state.poweron_output))
 
-    def print_json(self, device_state):
-        out = {x: getattr(device_state, x) for x in device_state.register_properties}
-        out['collection_time'] = (device_state.collection_time - datetime.datetime.fromtimestamp(0)).total_seconds()
+    def print_fields(self, device_state):
+        for name in self.args.fields:
+            value = getattr(device_state, name)
+            print('{}: {}{}'.format(
+                device_state.register_properties[name]['description'],
+                value,
+                self.trend_s(name, value),
+            ))
+        print('Collection time: {}'.format(device_state.collection_time))
+        if len(device_state.groups) > 0:
+            print()
+        for group, device_group_state in sorted(device_state.groups.items()):
+            print('Group {}:'.format(group))
+            for name, properties in device_group_state.register_properties.items():
+                print('    {}: {}'.format(properties['description'], getattr(device_group_state, name)))
+
+    def sample_columns(self):
+        """Flattened names of every sample field, for tabular sinks"""
+        table = self.device_state_class.register_table
+        columns = [x for x in table.names if not table.properties[x].get('write_only')]
+        for group in range(10):
+            columns += [
+                'groups.{}.{}'.format(group, x)
+                for x in self.device_group_state_class.group_register_table(group).names
+            ]
+        return columns
+
+    def sample_record(self, device_state):
+        if self.sample_template is None:
+            self.sample_fields = tuple(self.args.fields or device_state.register_properties)
+            names = list(self.sample_fields) + ['collection_time', 'groups']
+            if self.args.json_trends:
+                names.append('trends')
+            if self.device_name:
+                names.append('device_name')
+            self.sample_template = rdserial.sink.record_template(names)
+        out = dict.fromkeys(self.sample_template)
+        for x in self.sample_fields:
+            out[x] = getattr(device_state, x)
+        if self.args.json_trends:
+            out['trends'] = self.json_trends(out)
+        out['collection_time'] = device_state.collection_timestamp
         out['groups'] = {}
-        for group, device_group_state in device_state.groups.items():
-            out['groups'][group] = {x: getattr(device_group_state, x) for x in device_group_state.register_properties}
-        print(json.dumps(out, sort_keys=True))
+        for group, device_group_state in sorted(device_state.groups.items()):
+            out['groups'][group] = {
+                x: getattr(device_group_state, x) for x in sorted(device_group_state.register_properties)
+            }
+        if self.device_name:
+            out['device_name'] = self.device_name
+        return out
 
-    def assemble_device_state(self):
-        device_state = self.device_state_class()
-        registers_length = (85 if self.device_mode == 'rd' else 13)
+    def read_registers(self, base, length):
         registers = self.modbus_client.read_registers(
-            0x00, registers_length, unit=self.args.modbus_unit,
+            base, length, unit=self.args.modbus_unit,
         )
-        device_state.load(registers)
+        if self.recorder:
+            self.recorder.write_registers(base, registers, unit=self.args.modbus_unit)
+        return registers
 
+    def selected_groups(self):
         if self.args.all_groups:
-            groups = range(10)
+            return range(10)
         elif self.args.group is not None:
-            groups = self.args.group
+            return self.args.group
+        return []
+
+    def plan_reads(self):
+        """Plan the reads covering the device state and selected groups
+
+        read_plan covers every selected register; hot_read_plan only the
+        hot tier of the device state.
+        """
+        table = self.device_state_class.register_table
+        registers = list(table.field_registers(self.args.fields))
+        for group in self.selected_groups():
+            registers += self.device_group_state_class.group_register_table(group).registers
+        self.read_plan = rdserial.modbus.plan_reads(registers, max_gap=self.args.max_read_gap)
+        self.hot_read_plan = rdserial.modbus.plan_reads(
+            table.field_registers(self.args.fields, tier='hot'), max_gap=self.args.max_read_gap,
+        )
+        for base, length in self.read_plan:
+            logging.debug('Planned read of {} register(s) at base {}'.format(length, base))
+        for base, length in self.hot_read_plan:
+            logging.debug('Planned hot read of {} register(s) at base {}'.format(length, base))
+        return self.read_plan
+
+    def invalidate_cold(self):
+        """Re-read the cold tier on the next poll"""
+        self.cold_blocks = None
+
+    def replan(self):
+        """Plan the reads again on the next poll, e.g. for other groups"""
+        self.read_plan = None
+        self.invalidate_cold()
+
+    def assemble_device_state(self):
+        if self.read_plan is None:
+            self.plan_reads()
+        if self.cold_blocks is None or self.cycles % self.args.cold_poll_cycles == 0:
+            blocks = [(base, self.read_registers(base, length)) for base, length in self.read_plan]
+            self.cold_blocks = blocks
+            self.cycles = 0
         else:
-            groups = []
-        for group in groups:
-            register_offset = (0x04 if self.device_mode == 'rd' else 0x10)
+            # Hot blocks are loaded last, over the cached cold values
+            blocks = self.cold_blocks + [
+                (base, self.read_registers(base, length)) for base, length in self.hot_read_plan
+            ]
+        self.cycles += 1
+
+        device_state = self.device_state_class()
+        for base, registers in blocks:
+            device_state.load(registers, offset=base)
+        for group in self.selected_groups():
             device_group_state = self.device_group_state_class(group)
-            registers = self.modbus_client.read_registers(
-                0x50 + (register_offset * group),
-                len(device_group_state.register_properties),
-                unit=self.args.modbus_unit,
-            )
-            device_group_state.load(registers, offset=(0x50 + (register_offset * group)))
+            for base, registers in blocks:
+                device_group_state.load(registers, offset=base)
             device_state.groups[group] = device_group_state
 
         return device_state
 
+    def collect(self):
+        return self.assemble_device_state()
+
+    def output(self, device_state):
+        with self.output_lock:
+            if self.sink:
+                self.sink.write(self.sample_record(device_state))
+                return
+            if self.device_name:
+                print('{}:'.format(self.device_name))
+            if self.args.fields:
+                self.print_fields(device_state)
+            else:
+                self.print_human(device_state)
+            if self.args.watch:
+                print()
+
     def loop(self):
-        while True:
+        while not self.stop.is_set():
             try:
-                device_state = self.assemble_device_state()
-                if self.args.json:
-                    self.print_json(device_state)
-                else:
-                    self.print_human(device_state)
-            except KeyboardInterrupt:
+                device_state = self.collect()
+                self.output(device_state)
+            except (KeyboardInterrupt, EOFError):
                 raise
             except Exception:
                 if self.args.watch:
@@ -256,27 +459,47 @@ class Tool:
                 else:
                     raise
             if self.args.watch:
-                if not self.args.json:
-                    print()
-                time.sleep(self.args.watch_seconds)
+                self.scheduler.wait()
             else:
                 return
 
-    def main(self):
-        if self.args.device in rd_supported_devices:
-            self.device_mode = 'rd'
-            self.device_state_class = rdserial.dps.RDDeviceState
-            self.device_group_state_class = rdserial.dps.RDGroupState
-        else:
-            self.device_mode = 'dps'
-            self.device_state_class = rdserial.dps.DPSDeviceState
-            self.device_group_state_class = rdserial.dps.DPSGroupState
+    def setup(self):
+        self.device_mode = ('rd' if self.args.device in rd_supported_devices else 'dps')
+        self.device_state_class, self.device_group_state_class = state_classes(self.args.device)
+        for name in (self.args.fields or []):
+            if name not in field_names(self.args.device):
+                raise ValueError('Unknown field for {}'.format(self.args.device), name)
         self.modbus_client = rdserial.modbus.RTUClient(
             self.socket,
             baudrate=self.args.baud,
         )
+
+    def main(self):
+        self.setup()
+        if self.args.record:
+            self.recorder = rdserial.capture.CaptureWriter(self.args.record, self.args.device)
+        self.sink = rdserial.sink.open_sink(
+            self.args, table=self.device_mode, columns=self.sample_columns(),
+            device_id=(self.device_name or '{}@{}'.format(self.args.device, self.socket)),
+        )
+        if self.args.watch:
+            self.scheduler = rdserial.scheduler.Scheduler(
+                self.args.watch_seconds, policy=self.args.watch_policy, sleep=self.stop.wait,
+            )
         try:
             self.send_commands()
             self.loop()
         except KeyboardInterrupt:
             pass
+        except EOFError:
+            logging.info('End of replay')
+        finally:
+            if self.sink:
+                with self.output_lock:
+                    self.sink.close()
+            if self.recorder:
+                self.recorder.close()
+            if self.scheduler and self.scheduler.ticks:
+                logging.info('{}Watch schedule: {}'.format(
+                    '{}: '.format(self.device_name) if self.device_name else '', self.scheduler,
+                ))
@@ -0,0 +1,278 @@
+# rdserialtool
+# Copyright (C) 2019-2021 Ryan Finnie
+# SPDX-License-Identifier: MPL-2.0
+
+# Pseudo-terminal device emulators, for testing and benchmarking without
+# hardware.  Linux/Unix only.
+
+import logging
+import os
+import random
+import select
+import struct
+import threading
+import time
+import tty
+
+import rdserial.dps
+import rdserial.modbus
+import rdserial.um
+
+
+class Emulator:
+    """Base pty device emulator
+
+    latency is added before each response, randomly varied by up to
+    +/- jitter seconds.  drop_rate and corrupt_rate are the probabilities
+    of a response being dropped entirely or sent with a damaged last
+    byte.  If baudrate is set, responses are paced to the wire time of
+    a 10-bit character at that rate.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, drop_rate=0.0, corrupt_rate=0.0, baudrate=None, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.corrupt_rate = corrupt_rate
+        self.baudrate = baudrate
+        self.random = random.Random(seed)
+        self.master = None
+        self.slave = None
+        self.port = None
+        self.requests = 0
+        self.responses = 0
+        self.dropped = 0
+        self.corrupted = 0
+        self._thread = None
+        self._running = False
+        self._buffer = b''
+
+    def open(self):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        logging.debug('Emulator: Listening on {}'.format(self.port))
+        return self.port
+
+    def close(self):
+        self.stop()
+        for fd in (self.master, self.slave):
+            if fd is not None:
+                os.close(fd)
+        self.master = self.slave = self.port = None
+
+    def start(self):
+        if self.master is None:
+            self.open()
+        self._running = True
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self.port
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join()
+        self._thread = None
+
+    def serve_forever(self):
+        self._running = True
+        while self._running:
+            readable, _, _ = select.select([self.master], [], [], 0.1)
+            if not readable:
+                continue
+            self._buffer += os.read(self.master, 4096)
+            while self._buffer:
+                consumed, response = self.handle(self._buffer)
+                if not consumed:
+                    break
+                self._buffer = self._buffer[consumed:]
+                self.requests += 1
+                if response:
+                    self.respond(response)
+
+    def respond(self, response):
+        delay = self.latency
+        if self.jitter:
+            delay += self.random.uniform(-self.jitter, self.jitter)
+        if self.baudrate:
+            delay += len(response) * 10 / self.baudrate
+        if delay > 0:
+            time.sleep(delay)
+
+        if self.drop_rate and self.random.random() < self.drop_rate:
+            logging.debug('Emulator: Dropping response')
+            self.dropped += 1
+            return
+        if self.corrupt_rate and self.random.random() < self.corrupt_rate:
+            logging.debug('Emulator: Corrupting response')
+            self.corrupted += 1
+            response = response[:-1] + bytes([response[-1] ^ 0xff])
+        os.write(self.master, response)
+        self.responses += 1
+
+    def handle(self, data):
+        """Handle buffered request data
+
+        Returns a tuple of the number of bytes consumed (0 if more data is
+        needed) and the response bytes, if any.
+        """
+        raise NotImplementedError
+
+
+class UMEmulator(Emulator):
+    def __init__(self, device_type='UM24C', **kwargs):
+        super().__init__(**kwargs)
+        self.response = rdserial.um.Response(device_type=device_type)
+        self.response.start = 0x0963
+        self.response.end = 0xfff1
+        self.response.volts = 5.0
+        self.response.amps = 0.5
+        self.response.temp_c = 25
+        self.response.temp_f = 77
+        self.response.screen_brightness = 4
+        self.response.screen_timeout = 2
+        self.response.record_threshold = 0.10
+
+    def update(self):
+        response = self.response
+        response.volts = 5.0 + self.random.uniform(-0.05, 0.05)
+        response.amps = 0.5 + self.random.uniform(-0.01, 0.01)
+        response.watts = response.volts * response.amps
+        response.resistance = response.volts / response.amps
+
+    def handle(self, data):
+        command = data[0]
+        response = self.response
+        if command == 0xf0:
+            self.update()
+            return 1, response.dump()
+        elif command == 0xf1:
+            response.screen_selected = (response.screen_selected + 1) % 6
+        elif command == 0xf2:
+            pass  # Screen rotation is not visible in the frame
+        elif command == 0xf3:
+            response.data_group_selected = (response.data_group_selected + 1) % 10
+        elif command == 0xf4:
+            response.data_groups[response.data_group_selected].amp_hours = 0
+            response.data_groups[response.data_group_selected].watt_hours = 0
+        elif 0xa0 <= command <= 0xa9:
+            response.data_group_selected = command - 0xa0
+        elif 0xb0 <= command <= 0xce:
+            response.record_threshold = (command - 0xb0) / 100
+        elif 0xd0 <= command <= 0xd5:
+            response.screen_brightness = command - 0xd0
+        elif 0xe0 <= command <= 0xe9:
+            response.screen_timeout = command - 0xe0
+        else:
+            logging.debug('Emulator: Unknown command 0x{:02x}'.format(command))
+        return 1, None
+
+
+class ModbusEmulator(Emulator):
+    """Modbus RTU slave emulating a DPS or RD power supply"""
+
+    def __init__(self, device_mode='dps', unit=1, load_ohms=10.0, **kwargs):
+        super().__init__(**kwargs)
+        self.device_mode = device_mode
+        self.unit = unit
+        self.load_ohms = load_ohms
+        self.registers = [0] * 0x100
+        if device_mode == 'rd':
+            self.device_state_class = rdserial.dps.RDDeviceState
+            self.device_group_state_class = rdserial.dps.RDGroupState
+            initial = {
+                'model': 60062, 'serial': 5403, 'firmware': 125,
+                'fan_temp_c': 40, 'fan_temp_f': 104, 'temp_c': 25, 'temp_f': 77,
+                'input_volts': 50.0, 'brightness': 4, 'ovp': 62.0, 'ocp': 6.2,
+            }
+        else:
+            self.device_state_class = rdserial.dps.DPSDeviceState
+            self.device_group_state_class = rdserial.dps.DPSGroupState
+            initial = {'model': 5005, 'firmware': 14, 'input_volts': 19.3, 'brightness': 4}
+        initial.update({'setting_volts': 5.0, 'setting_amps': 1.0})
+        for name, value in initial.items():
+            self.set_value(self.device_state_class.register_table, name, value)
+        for group in range(10):
+            table = self.device_group_state_class.group_register_table(group)
+            self.set_value(table, 'setting_volts', 5.0)
+            self.set_value(table, 'setting_amps', 1.0)
+
+    def get_value(self, table, name):
+        properties = table.properties[name]
+        return properties['from_int'](self.registers[properties['register']])
+
+    def set_value(self, table, name, value):
+        properties = table.properties[name]
+        self.registers[properties['register']] = properties['to_int'](value) & 0xffff
+
+    def update(self):
+        table = self.device_state_class.register_table
+        if self.get_value(table, 'output_state'):
+            setting_volts = self.get_value(table, 'setting_volts')
+            setting_amps = self.get_value(table, 'setting_amps')
+            amps = setting_volts / self.load_ohms
+            constant_current = amps > setting_amps
+            if constant_current:
+                amps = setting_amps
+            volts = amps * self.load_ohms
+            volts += self.random.uniform(-0.01, 0.01)
+        else:
+            volts = amps = 0
+            constant_current = False
+        self.set_value(table, 'volts', max(volts, 0))
+        self.set_value(table, 'amps', amps)
+        self.set_value(table, 'watts', max(volts, 0) * amps)
+        self.set_value(table, 'constant_current', constant_current)
+
+    def write(self, register, values):
+        self.registers[register:register + len(values)] = values
+        table = self.device_state_class.register_table
+        loader = table.properties['group_loader']['register']
+        if register <= loader < register + len(values) and self.registers[loader] < 10:
+            group = self.device_group_state_class.group_register_table(self.registers[loader])
+            for name in ('setting_volts', 'setting_amps'):
+                self.set_value(table, name, self.get_value(group, name))
+
+    def exception(self, function, code):
+        response = struct.pack('>BBB', self.unit, function | 0x80, code)
+        return response + struct.pack('<H', rdserial.modbus.modbus_crc(response))
+
+    def handle(self, data):
+        if len(data) < 8:
+            return 0, None
+        function = data[1]
+        if function == 0x10:
+            length = 9 + data[6]
+            if len(data) < length:
+                return 0, None
+        elif function in (0x03, 0x06):
+            length = 8
+        else:
+            # Unknown function; discard the buffer to resynchronize
+            return len(data), None
+        request = data[:length]
+        if not rdserial.modbus.modbus_crc_valid(request):
+            logging.debug('Emulator: Bad CRC, discarding buffer')
+            return len(data), None
+        if request[0] != self.unit:
+            return length, None
+
+        register, value = struct.unpack('>HH', request[2:6])
+        if function == 0x03:
+            if value < 1 or value > 125 or register + value > len(self.registers):
+                return length, self.exception(function, 0x02)
+            self.update()
+            values = self.registers[register:register + value]
+            response = struct.pack('>BBB{}H'.format(value), self.unit, function, value * 2, *values)
+        elif function == 0x06:
+            if register >= len(self.registers):
+                return length, self.exception(function, 0x02)
+            self.write(register, [value])
+            response = request[:6]
+        else:
+            if value < 1 or value > 123 or register + value > len(self.registers) or request[6] != value * 2:
+                return length, self.exception(function, 0x02)
+            self.write(register, list(struct.unpack('>{}H'.format(value), request[7:7 + value * 2])))
+            response = request[:6]
+        return length, response + struct.pack('<H', rdserial.modbus.modbus_crc(response))
@@ -0,0 +1,126 @@
+# rdserialtool
+# Copyright (C) 2019-2021 Ryan Finnie
+# SPDX-License-Identifier: MPL-2.0
+
+import argparse
+import sys
+import os
+import logging
+import signal
+
+from rdserial import __version__
+import rdserial.emulator
+import rdserial.um.tool
+import rdserial.dps.tool
+
+
+def parse_args(argv=None):
+    """Parse user arguments."""
+    if argv is None:
+        argv = sys.argv
+
+    parser = argparse.ArgumentParser(
+        description='rdserial-emulator ({})'.format(__version__),
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        prog=os.path.basename(argv[0]),
+    )
+
+    parser.add_argument(
+        '--version', '-V', action='version',
+        version=__version__,
+        help='Report the program version',
+    )
+    parser.add_argument(
+        '--debug', action='store_true',
+        help='Print extra debugging information.',
+    )
+
+    supported_devices = []
+    supported_devices += rdserial.um.tool.supported_devices
+    supported_devices += rdserial.dps.tool.supported_devices
+    parser.add_argument(
+        '--device', '-d', required=True,
+        choices=sorted(supported_devices),
+        help='Device type to emulate',
+    )
+    parser.add_argument(
+        '--link', metavar='PATH',
+        help='Create a symlink to the pseudo-terminal at this path',
+    )
+    parser.add_argument(
+        '--modbus-unit', type=int, default=1,
+        help='Modbus unit number [DPS/RD]',
+    )
+    parser.add_argument(
+        '--baud', type=int, default=None,
+        help='Pace responses to the wire time at this baud rate',
+    )
+    parser.add_argument(
+        '--latency', type=float, default=0.0,
+        help='Seconds to wait before each response',
+    )
+    parser.add_argument(
+        '--jitter', type=float, default=0.0,
+        help='Maximum random variation of the response latency, in seconds',
+    )
+    parser.add_argument(
+        '--drop-rate', type=float, default=0.0,
+        help='Probability of a response being dropped',
+    )
+    parser.add_argument(
+        '--corrupt-rate', type=float, default=0.0,
+        help='Probability of a response being corrupted',
+    )
+    parser.add_argument(
+        '--seed', type=int, default=None,
+        help='Random seed for jitter and error injection',
+    )
+
+    args = parser.parse_args(args=argv[1:])
+
+    return args
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)s: %(message)s' if args.debug else '%(message)s',
+        level=logging.DEBUG if args.debug else logging.INFO,
+    )
+
+    kwargs = {
+        'latency': args.latency,
+        'jitter': args.jitter,
+        'drop_rate': args.drop_rate,
+        'corrupt_rate': args.corrupt_rate,
+        'baudrate': args.baud,
+        'seed': args.seed,
+    }
+    if args.device in rdserial.um.tool.supported_devices:
+        emulator = rdserial.emulator.UMEmulator(device_type=args.device.upper(), **kwargs)
+    else:
+        emulator = rdserial.emulator.ModbusEmulator(
+            device_mode=('rd' if args.device in rdserial.dps.tool.rd_supported_devices else 'dps'),
+            unit=args.modbus_unit,
+            **kwargs
+        )
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    port = emulator.open()
+    if args.link:
+        os.symlink(port, args.link)
+    logging.info('Emulating {} on {}'.format(args.device.upper(), args.link or port))
+    try:
+        emulator.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.link:
+            os.unlink(args.link)
+        emulator.close()
+        logging.info('{} requests, {} responses, {} dropped, {} corrupted'.format(
+            emulator.requests, emulator.responses, emulator.dropped, emulator.corrupted,
+        ))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
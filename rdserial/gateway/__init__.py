@@ -0,0 +1,250 @@
+# rdserialtool
+# Copyright (C) 2019-2021 Ryan Finnie
+# SPDX-License-Identifier: MPL-2.0
+
+# Modbus TCP to RTU gateway, so several programs can share one serial or
+# RFCOMM link to a DPS/RD device.
+#
+# Client connections are handled in their own threads, and hand requests
+# to a single bus thread.  Each round, the bus thread waits a short window
+# for requests to gather, then takes the oldest request from each client
+# in turn, so one busy client cannot starve the others.  Runs of register
+# reads within a round are planned together with plan_reads, so identical
+# or overlapping reads cost one RTU transaction.  Exception responses
+# from the device are passed on to the client.
+
+import collections
+import logging
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+import rdserial.modbus
+
+MBAP_HEADER = struct.Struct('>HHHB')
+
+EXCEPTION_ILLEGAL_FUNCTION = 0x01
+EXCEPTION_ILLEGAL_DATA_ADDRESS = 0x02
+EXCEPTION_ILLEGAL_DATA_VALUE = 0x03
+EXCEPTION_GATEWAY_TARGET_FAILED = 0x0b
+
+
+def _recv_exact(sock, size):
+    data = b''
+    while len(data) < size:
+        buf = sock.recv(size - len(data))
+        if not buf:
+            return None
+        data += buf
+    return data
+
+
+def exception_response(function, code):
+    return bytes([function | 0x80, code])
+
+
+class _Request:
+    __slots__ = ('unit', 'function', 'base', 'length', 'values', 'response', 'done')
+
+    def __init__(self, unit, function, base, length=1, values=None):
+        self.unit = unit
+        self.function = function
+        self.base = base
+        self.length = length
+        self.values = values
+        self.response = None
+        self.done = threading.Event()
+
+    def finish(self, response):
+        self.response = response
+        self.done.set()
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        sock = self.request
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            while True:
+                header = _recv_exact(sock, MBAP_HEADER.size)
+                if header is None:
+                    break
+                transaction, protocol, length, unit = MBAP_HEADER.unpack(header)
+                pdu = (_recv_exact(sock, length - 1) if length > 1 else None)
+                if protocol != 0 or not pdu:
+                    break
+                response = self.server.handle_pdu(self, unit, pdu)
+                sock.sendall(MBAP_HEADER.pack(transaction, 0, len(response) + 1, unit) + response)
+        finally:
+            self.server.remove_client(self)
+
+
+class Gateway(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """Modbus TCP server forwarding requests to an RTUClient
+
+    Supports read holding registers (0x03), write single register (0x06)
+    and write multiple registers (0x10).  TCP unit IDs 0 and 255 are sent
+    to default_unit.  window is how long the bus thread waits for more
+    requests before starting a round; max_gap is passed to plan_reads.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, modbus_client, default_unit=1, window=0.01, max_gap=0):
+        self.modbus_client = modbus_client
+        self.default_unit = default_unit
+        self.window = window
+        self.max_gap = max_gap
+        self.requests = 0
+        self.transactions = 0
+        self.rounds = 0
+        self._queues = collections.OrderedDict()
+        self._condition = threading.Condition()
+        super().__init__(address, _Handler)
+        self._worker = threading.Thread(target=self._bus_worker, daemon=True)
+        self._worker.start()
+
+    def handle_pdu(self, client, unit, pdu):
+        function = pdu[0]
+        if unit in (0, 255):
+            unit = self.default_unit
+        try:
+            if function == 0x03:
+                base, length = struct.unpack('>HH', pdu[1:5])
+                if not 1 <= length <= rdserial.modbus.MAX_READ_REGISTERS:
+                    return exception_response(function, EXCEPTION_ILLEGAL_DATA_VALUE)
+                request = _Request(unit, function, base, length)
+            elif function == 0x06:
+                base, value = struct.unpack('>HH', pdu[1:5])
+                request = _Request(unit, function, base, values=[value])
+            elif function == 0x10:
+                base, length, byte_count = struct.unpack('>HHB', pdu[1:6])
+                if not 1 <= length <= 123 or byte_count != length * 2:
+                    return exception_response(function, EXCEPTION_ILLEGAL_DATA_VALUE)
+                values = list(struct.unpack('>{}H'.format(length), pdu[6:6 + byte_count]))
+                request = _Request(unit, function, base, length, values)
+            else:
+                return exception_response(function, EXCEPTION_ILLEGAL_FUNCTION)
+        except struct.error:
+            return exception_response(function, EXCEPTION_ILLEGAL_DATA_VALUE)
+        if request.base + request.length > 0x10000:
+            return exception_response(function, EXCEPTION_ILLEGAL_DATA_ADDRESS)
+
+        with self._condition:
+            self._queues.setdefault(client, collections.deque()).append(request)
+            self.requests += 1
+            self._condition.notify()
+        request.done.wait()
+        return request.response
+
+    def remove_client(self, client):
+        with self._condition:
+            self._queues.pop(client, None)
+
+    def _next_round(self):
+        with self._condition:
+            while not any(self._queues.values()):
+                self._condition.wait()
+        if self.window:
+            time.sleep(self.window)
+        with self._condition:
+            batch = [queue.popleft() for queue in self._queues.values() if queue]
+            # Rotate, so no client is always served first
+            if self._queues:
+                self._queues.move_to_end(next(iter(self._queues)))
+        self.rounds += 1
+        return batch
+
+    def _bus_worker(self):
+        while True:
+            batch = self._next_round()
+            reads = []
+            for request in batch:
+                if request.function == 0x03:
+                    reads.append(request)
+                    continue
+                # Reads queued before a write must not see it
+                self._read(reads)
+                reads = []
+                self._write(request)
+            self._read(reads)
+
+    def _read(self, requests):
+        units = collections.defaultdict(list)
+        for request in requests:
+            units[request.unit].append(request)
+        for unit, unit_requests in units.items():
+            registers = set()
+            for request in unit_requests:
+                registers.update(range(request.base, request.base + request.length))
+            image = {}
+            failed = set()
+            rejected = set()
+            for base, length in rdserial.modbus.plan_reads(registers, max_gap=self.max_gap):
+                try:
+                    values = self._read_registers(base, length, unit)
+                except rdserial.modbus.ModbusException:
+                    # The merged read was refused; the device may accept
+                    # some of its requests on their own
+                    rejected.update(range(base, base + length))
+                    continue
+                except Exception:
+                    failed.update(range(base, base + length))
+                    continue
+                image.update(zip(range(base, base + length), values))
+            for request in unit_requests:
+                span = range(request.base, request.base + request.length)
+                if failed.intersection(span):
+                    request.finish(exception_response(request.function, EXCEPTION_GATEWAY_TARGET_FAILED))
+                    continue
+                if rejected.intersection(span):
+                    try:
+                        values = self._read_registers(request.base, request.length, unit)
+                    except rdserial.modbus.ModbusException as e:
+                        request.finish(exception_response(request.function, e.code))
+                        continue
+                    except Exception:
+                        request.finish(exception_response(request.function, EXCEPTION_GATEWAY_TARGET_FAILED))
+                        continue
+                    image.update(zip(span, values))
+                request.finish(
+                    struct.pack('>BB{}H'.format(request.length), request.function, request.length * 2, *(image[x] for x in span))
+                )
+
+    def _read_registers(self, base, length, unit):
+        self.transactions += 1
+        try:
+            return self.modbus_client.read_registers(base, length, unit=unit)
+        except rdserial.modbus.ModbusException as e:
+            logging.warning('Gateway: Read of {} register(s) at base {} refused: {}'.format(length, base, e))
+            raise
+        except Exception:
+            logging.exception('Gateway: Read of {} register(s) at base {} failed'.format(length, base))
+            raise
+
+    def _write(self, request):
+        self.transactions += 1
+        try:
+            if request.function == 0x06:
+                self.modbus_client.write_register(request.base, request.values[0], unit=request.unit)
+                response = struct.pack('>BHH', request.function, request.base, request.values[0])
+            else:
+                self.modbus_client.write_registers(request.base, request.values, unit=request.unit)
+                response = struct.pack('>BHH', request.function, request.base, request.length)
+        except rdserial.modbus.ModbusException as e:
+            logging.warning('Gateway: Write of {} register(s) at base {} refused: {}'.format(request.length, request.base, e))
+            response = exception_response(request.function, e.code)
+        except Exception:
+            logging.exception('Gateway: Write of {} register(s) at base {} failed'.format(request.length, request.base))
+            response = exception_response(request.function, EXCEPTION_GATEWAY_TARGET_FAILED)
+        request.finish(response)
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'transactions': self.transactions,
+            'rounds': self.rounds,
+        }
@@ -10,111 +10,296 @@ import struct
 import logging
 
 
-def modbus_crc(data):
-    lookup_table = (
-        0x0000, 0xc0c1, 0xc181, 0x0140, 0xc301, 0x03c0, 0x0280, 0xc241,
-        0xc601, 0x06c0, 0x0780, 0xc741, 0x0500, 0xc5c1, 0xc481, 0x0440,
-        0xcc01, 0x0cc0, 0x0d80, 0xcd41, 0x0f00, 0xcfc1, 0xce81, 0x0e40,
-        0x0a00, 0xcac1, 0xcb81, 0x0b40, 0xc901, 0x09c0, 0x0880, 0xc841,
-        0xd801, 0x18c0, 0x1980, 0xd941, 0x1b00, 0xdbc1, 0xda81, 0x1a40,
-        0x1e00, 0xdec1, 0xdf81, 0x1f40, 0xdd01, 0x1dc0, 0x1c80, 0xdc41,
-        0x1400, 0xd4c1, 0xd581, 0x1540, 0xd701, 0x17c0, 0x1680, 0xd641,
-        0xd201, 0x12c0, 0x1380, 0xd341, 0x1100, 0xd1c1, 0xd081, 0x1040,
-        0xf001, 0x30c0, 0x3180, 0xf141, 0x3300, 0xf3c1, 0xf281, 0x3240,
-        0x3600, 0xf6c1, 0xf781, 0x3740, 0xf501, 0x35c0, 0x3480, 0xf441,
-        0x3c00, 0xfcc1, 0xfd81, 0x3d40, 0xff01, 0x3fc0, 0x3e80, 0xfe41,
-        0xfa01, 0x3ac0, 0x3b80, 0xfb41, 0x3900, 0xf9c1, 0xf881, 0x3840,
-        0x2800, 0xe8c1, 0xe981, 0x2940, 0xeb01, 0x2bc0, 0x2a80, 0xea41,
-        0xee01, 0x2ec0, 0x2f80, 0xef41, 0x2d00, 0xedc1, 0xec81, 0x2c40,
-        0xe401, 0x24c0, 0x2580, 0xe541, 0x2700, 0xe7c1, 0xe681, 0x2640,
-        0x2200, 0xe2c1, 0xe381, 0x2340, 0xe101, 0x21c0, 0x2080, 0xe041,
-        0xa001, 0x60c0, 0x6180, 0xa141, 0x6300, 0xa3c1, 0xa281, 0x6240,
-        0x6600, 0xa6c1, 0xa781, 0x6740, 0xa501, 0x65c0, 0x6480, 0xa441,
-        0x6c00, 0xacc1, 0xad81, 0x6d40, 0xaf01, 0x6fc0, 0x6e80, 0xae41,
-        0xaa01, 0x6ac0, 0x6b80, 0xab41, 0x6900, 0xa9c1, 0xa881, 0x6840,
-        0x7800, 0xb8c1, 0xb981, 0x7940, 0xbb01, 0x7bc0, 0x7a80, 0xba41,
-        0xbe01, 0x7ec0, 0x7f80, 0xbf41, 0x7d00, 0xbdc1, 0xbc81, 0x7c40,
-        0xb401, 0x74c0, 0x7580, 0xb541, 0x7700, 0xb7c1, 0xb681, 0x7640,
-        0x7200, 0xb2c1, 0xb381, 0x7340, 0xb101, 0x71c0, 0x7080, 0xb041,
-        0x5000, 0x90c1, 0x9181, 0x5140, 0x9301, 0x53c0, 0x5280, 0x9241,
-        0x9601, 0x56c0, 0x5780, 0x9741, 0x5500, 0x95c1, 0x9481, 0x5440,
-        0x9c01, 0x5cc0, 0x5d80, 0x9d41, 0x5f00, 0x9fc1, 0x9e81, 0x5e40,
-        0x5a00, 0x9ac1, 0x9b81, 0x5b40, 0x9901, 0x59c0, 0x5880, 0x9841,
-        0x8801, 0x48c0, 0x4980, 0x8941, 0x4b00, 0x8bc1, 0x8a81, 0x4a40,
-        0x4e00, 0x8ec1, 0x8f81, 0x4f40, 0x8d01, 0x4dc0, 0x4c80, 0x8c41,
-        0x4400, 0x84c1, 0x8581, 0x4540, 0x8701, 0x47c0, 0x4680, 0x8641,
-        0x8201, 0x42c0, 0x4380, 0x8341, 0x4100, 0x81c1, 0x8081, 0x4040,
-    )
-
-    crc = 0xffff
-    for b in data:
-        n = b ^ crc
-        crc >>= 8
-        crc ^= lookup_table[n % 256]
+CRC_TABLE = (
+    0x0000, 0xc0c1, 0xc181, 0x0140, 0xc301, 0x03c0, 0x0280, 0xc241,
+    0xc601, 0x06c0, 0x0780, 0xc741, 0x0500, 0xc5c1, 0xc481, 0x0440,
+    0xcc01, 0x0cc0, 0x0d80, 0xcd41, 0x0f00, 0xcfc1, 0xce81, 0x0e40,
+    0x0a00, 0xcac1, 0xcb81, 0x0b40, 0xc901, 0x09c0, 0x0880, 0xc841,
+    0xd801, 0x18c0, 0x1980, 0xd941, 0x1b00, 0xdbc1, 0xda81, 0x1a40,
+    0x1e00, 0xdec1, 0xdf81, 0x1f40, 0xdd01, 0x1dc0, 0x1c80, 0xdc41,
+    0x1400, 0xd4c1, 0xd581, 0x1540, 0xd701, 0x17c0, 0x1680, 0xd641,
+    0xd201, 0x12c0, 0x1380, 0xd341, 0x1100, 0xd1c1, 0xd081, 0x1040,
+    0xf001, 0x30c0, 0x3180, 0xf141, 0x3300, 0xf3c1, 0xf281, 0x3240,
+    0x3600, 0xf6c1, 0xf781, 0x3740, 0xf501, 0x35c0, 0x3480, 0xf441,
+    0x3c00, 0xfcc1, 0xfd81, 0x3d40, 0xff01, 0x3fc0, 0x3e80, 0xfe41,
+    0xfa01, 0x3ac0, 0x3b80, 0xfb41, 0x3900, 0xf9c1, 0xf881, 0x3840,
+    0x2800, 0xe8c1, 0xe981, 0x2940, 0xeb01, 0x2bc0, 0x2a80, 0xea41,
+    0xee01, 0x2ec0, 0x2f80, 0xef41, 0x2d00, 0xedc1, 0xec81, 0x2c40,
+    0xe401, 0x24c0, 0x2580, 0xe541, 0x2700, 0xe7c1, 0xe681, 0x2640,
+    0x2200, 0xe2c1, 0xe381, 0x2340, 0xe101, 0x21c0, 0x2080, 0xe041,
+    0xa001, 0x60c0, 0x6180, 0xa141, 0x6300, 0xa3c1, 0xa281, 0x6240,
+    0x6600, 0xa6c1, 0xa781, 0x6740, 0xa501, 0x65c0, 0x6480, 0xa441,
+    0x6c00, 0xacc1, 0xad81, 0x6d40, 0xaf01, 0x6fc0, 0x6e80, 0xae41,
+    0xaa01, 0x6ac0, 0x6b80, 0xab41, 0x6900, 0xa9c1, 0xa881, 0x6840,
+    0x7800, 0xb8c1, 0xb981, 0x7940, 0xbb01, 0x7bc0, 0x7a80, 0xba41,
+    0xbe01, 0x7ec0, 0x7f80, 0xbf41, 0x7d00, 0xbdc1, 0xbc81, 0x7c40,
+    0xb401, 0x74c0, 0x7580, 0xb541, 0x7700, 0xb7c1, 0xb681, 0x7640,
+    0x7200, 0xb2c1, 0xb381, 0x7340, 0xb101, 0x71c0, 0x7080, 0xb041,
+    0x5000, 0x90c1, 0x9181, 0x5140, 0x9301, 0x53c0, 0x5280, 0x9241,
+    0x9601, 0x56c0, 0x5780, 0x9741, 0x5500, 0x95c1, 0x9481, 0x5440,
+    0x9c01, 0x5cc0, 0x5d80, 0x9d41, 0x5f00, 0x9fc1, 0x9e81, 0x5e40,
+    0x5a00, 0x9ac1, 0x9b81, 0x5b40, 0x9901, 0x59c0, 0x5880, 0x9841,
+    0x8801, 0x48c0, 0x4980, 0x8941, 0x4b00, 0x8bc1, 0x8a81, 0x4a40,
+    0x4e00, 0x8ec1, 0x8f81, 0x4f40, 0x8d01, 0x4dc0, 0x4c80, 0x8c41,
+    0x4400, 0x84c1, 0x8581, 0x4540, 0x8701, 0x47c0, 0x4680, 0x8641,
+    0x8201, 0x42c0, 0x4380, 0x8341, 0x4100, 0x81c1, 0x8081, 0x4040,
+)
+
+_crc_table16 = None
+
+
+def _build_crc_table16():
+    # Processing the 16-bit register against a little-endian word of
+    # data is two byte steps, precomputed for every possible value.
+    global _crc_table16
+    table = [0] * 65536
+    for x in range(65536):
+        crc = (x >> 8) ^ CRC_TABLE[x & 0xff]
+        table[x] = (crc >> 8) ^ CRC_TABLE[crc & 0xff]
+    _crc_table16 = table
+    return table
+
+
+def modbus_crc(data, crc=0xffff):
+    """Modbus CRC-16 of data (bytes-like)
+
+    Short frames are done a byte at a time; longer ones two bytes at a
+    time via a lazily-built 65536-entry table.  crc may be passed to
+    continue a CRC over multiple chunks.
+    """
+    length = len(data)
+    if length < 16:
+        lookup_table = CRC_TABLE
+        for b in data:
+            crc = (crc >> 8) ^ lookup_table[(crc ^ b) & 0xff]
+        return crc
+
+    lookup_table = _crc_table16 or _build_crc_table16()
+    for w in struct.unpack_from('<{}H'.format(length >> 1), data):
+        crc = lookup_table[crc ^ w]
+    if length & 1:
+        crc = (crc >> 8) ^ CRC_TABLE[(crc ^ data[-1]) & 0xff]
     return crc
 
 
+def modbus_crc_valid(frame):
+    """Check a complete frame, including its trailing CRC, in one pass"""
+    # The CRC of a frame with its own CRC appended is always zero
+    return len(frame) > 2 and modbus_crc(frame) == 0
+
+
+class ModbusException(Exception):
+    """Exception response from a Modbus device"""
+
+    def __init__(self, function, code):
+        super().__init__('Modbus exception {} for function {}'.format(code, function))
+        self.function = function
+        self.code = code
+
+
+MAX_READ_REGISTERS = 125
+MAX_WRITE_REGISTERS = 123
+
+
+def plan_reads(registers, max_length=MAX_READ_REGISTERS, max_gap=None):
+    """Plan the fewest register reads covering the given registers
+
+    Returns a list of (base, length) blocks, each no longer than
+    max_length.  Unneeded registers between needed ones are read as
+    well, unless the gap is larger than max_gap.
+    """
+    blocks = []
+    for register in sorted(set(registers)):
+        if blocks:
+            base, length = blocks[-1]
+            if (register - base < max_length) and (max_gap is None or register - (base + length) <= max_gap):
+                blocks[-1] = (base, register - base + 1)
+                continue
+        blocks.append((register, 1))
+    return blocks
+
+
+def _plan_write_blocks(registers, fillable, max_length):
+    blocks = []
+    for register in registers:
+        if blocks:
+            base, length = blocks[-1]
+            end = base + length
+            if register - base < max_length and all(x in fillable for x in range(end, register)):
+                blocks[-1] = (base, register - base + 1)
+                continue
+        blocks.append((register, 1))
+    return blocks
+
+
+def plan_writes(registers, fillable=(), known=(), max_length=MAX_WRITE_REGISTERS):
+    """Plan the fewest transactions writing the given registers
+
+    Writes separated by a gap are merged into one block if every
+    register in the gap is fillable, i.e. can be rewritten with its
+    current value.  Gap registers which are not known must be read
+    first; the plan with fewest reads plus writes is chosen, between
+    filling only known registers and filling any fillable ones.
+
+    Returns a list of (base, length) write blocks, and a sorted tuple of
+    gap registers whose current values must be read.
+    """
+    written = set(registers)
+    registers = sorted(written)
+    fillable = set(fillable)
+    known = set(known)
+    blocks = _plan_write_blocks(registers, fillable & known, max_length)
+    filled_blocks = _plan_write_blocks(registers, fillable, max_length)
+    fill = tuple(sorted(
+        x for base, length in filled_blocks for x in range(base, base + length)
+        if x not in known and x not in written
+    ))
+    if len(filled_blocks) + len(plan_reads(fill)) < len(blocks):
+        return filled_blocks, fill
+    return blocks, ()
+
+
+def silent_interval(baudrate):
+    if baudrate > 19200:
+        return 1.75/1000
+    return 3.5 * (1 + 8 + 2) / baudrate
+
+
+def _with_crc(request):
+    return request + struct.pack('<H', modbus_crc(request))
+
+
+def read_registers_request(base, length, unit=1):
+    return _with_crc(struct.pack('>BBHH', unit, 0x03, base, length))
+
+
+def read_registers_response(response, length, unit=1):
+    assert(modbus_crc_valid(response))
+    assert(struct.unpack_from('>BBB', response) == (unit, 0x03, length * 2))
+
+    registers = list(struct.unpack_from('>{}H'.format(length), response, 3))
+    logging.debug('Registers: {}'.format(registers))
+    return registers
+
+
+def write_register_request(register, value, unit=1):
+    return _with_crc(struct.pack('>BBHH', unit, 0x06, register, value))
+
+
+def write_register_response(response, request):
+    assert(response == request)
+
+
+def write_registers_request(register, values, unit=1):
+    request = struct.pack('>BBHHB', unit, 0x10, register, len(values), len(values) * 2)
+    for value in values:
+        request += struct.pack('>H', value)
+    return _with_crc(request)
+
+
+def write_registers_response(response, register, values, unit=1):
+    assert(modbus_crc_valid(response))
+    assert(struct.unpack_from('>BBHH', response) == (unit, 0x10, register, len(values)))
+
+
+class RegisterCache:
+    """Read-through register cache for RTUClient
+
+    Each register value expires ttl seconds after being read, where ttl
+    is taken from ttls (a mapping of register to seconds) or default_ttl;
+    registers with a TTL of 0 are never cached.  A read is a hit if every
+    requested register is cached, whatever ranges they were read in; on a
+    miss, only the span of missing registers is read.
+    """
+
+    def __init__(self, default_ttl=1.0, ttls=None, clock=time.monotonic):
+        self.default_ttl = default_ttl
+        self.ttls = dict(ttls or {})
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._units = {}
+
+    def lookup(self, base, length, unit=1):
+        """Cached values of a register range, with None where not cached"""
+        registers = self._units.get(unit, {})
+        now = self.clock()
+        values = []
+        for register in range(base, base + length):
+            entry = registers.get(register)
+            values.append(entry[0] if entry is not None and entry[1] > now else None)
+        return values
+
+    def update(self, base, values, unit=1):
+        registers = self._units.setdefault(unit, {})
+        now = self.clock()
+        for register, value in enumerate(values, base):
+            ttl = self.ttls.get(register, self.default_ttl)
+            if ttl > 0:
+                registers[register] = (value, now + ttl)
+
+    def invalidate(self, base=None, length=1, unit=None):
+        """Drop a register range of a unit, or everything if base is None"""
+        if base is None:
+            if unit is None:
+                self._units.clear()
+            else:
+                self._units.pop(unit, None)
+            return
+        for registers in ([self._units.get(unit, {})] if unit is not None else self._units.values()):
+            for register in range(base, base + length):
+                registers.pop(register, None)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
 class RTUClient:
-    def __init__(self, socket, baudrate):
+    def __init__(self, socket, baudrate, cache=None):
         self.socket = socket
+        self.cache = cache
         self._last_frame_end = time.time()
-        if baudrate > 19200:
-            self._silent_interval = 1.75/1000
-        else:
-            self._silent_interval = 3.5 * (1 + 8 + 2) / baudrate
+        self._silent_interval = silent_interval(baudrate)
 
     def read_registers(self, base, length, unit=1):
-        request = struct.pack('>B', unit) + \
-            struct.pack('>B', 0x03) + \
-            struct.pack('>H', base) + \
-            struct.pack('>H', length)
-        request += struct.pack('<H', modbus_crc(request))
-        self.send(request)
+        if self.cache is None:
+            return self._read_registers(base, length, unit=unit)
+        values = self.cache.lookup(base, length, unit=unit)
+        if None not in values:
+            self.cache.hits += 1
+            return values
+        self.cache.misses += 1
+        first = values.index(None)
+        last = length - values[::-1].index(None)
+        values[first:last] = self._read_registers(base + first, last - first, unit=unit)
+        self.cache.update(base + first, values[first:last], unit=unit)
+        return values
 
+    def _read_registers(self, base, length, unit=1):
+        self.send(read_registers_request(base, length, unit=unit))
         expected_response_length = 5 + (2 * length)
         response = self.recv(expected_response_length)
-
-        assert(struct.unpack('<H', response[-2:])[0] == modbus_crc(response[0:-2]))
-        assert(struct.unpack('>B', response[0:1])[0] == unit)
-        assert(struct.unpack('>B', response[1:2])[0] == 0x03)
-        assert(struct.unpack('>B', response[2:3])[0] == (length * 2))
-
-        registers = []
-        for i in range(length):
-            pos = 3 + (i * 2)
-            val = struct.unpack('>H', response[pos:pos+2])[0]
-            logging.debug('Register 0x{:02x}: {}'.format(pos, val))
-            registers.append(val)
-        return registers
+        return read_registers_response(response, length, unit=unit)
 
     def write_register(self, register, value, unit=1):
-        request = struct.pack('>B', unit) + \
-            struct.pack('>B', 0x06) + \
-            struct.pack('>H', register) + \
-            struct.pack('>H', value)
-        request += struct.pack('<H', modbus_crc(request))
+        if self.cache is not None:
+            self.cache.invalidate(register, 1, unit=unit)
+        request = write_register_request(register, value, unit=unit)
         self.send(request)
         expected_response_length = 8
         response = self.recv(expected_response_length)
-        assert(response == request)
+        write_register_response(response, request)
 
     def write_registers(self, register, values, unit=1):
-        request = struct.pack('>B', unit) + \
-            struct.pack('>B', 0x10) + \
-            struct.pack('>H', register) + \
-            struct.pack('>H', len(values)) + \
-            struct.pack('>B', len(values) * 2)
-        for value in values:
-            request += struct.pack('>H', value)
-        request += struct.pack('<H', modbus_crc(request))
-        self.send(request)
+        if self.cache is not None:
+            self.cache.invalidate(register, len(values), unit=unit)
+        self.send(write_registers_request(register, values, unit=unit))
         expected_response_length = 8
         response = self.recv(expected_response_length)
-        assert(struct.unpack('<H', response[-2:])[0] == modbus_crc(response[0:-2]))
-        assert(struct.unpack('>B', response[0:1])[0] == unit)
-        assert(struct.unpack('>B', response[1:2])[0] == 0x10)
-        assert(struct.unpack('>H', response[2:4])[0] == register)
-        assert(struct.unpack('>H', response[4:6])[0] == len(values))
+        write_registers_response(response, register, values, unit=unit)
 
     def send(self, data):
         ts = time.time()
@@ -126,11 +311,35 @@ class RTUClient:
             ))
             time.sleep(to_sleep)
 
+        # Discard any late response to an earlier, timed out request,
+        # which would otherwise be taken as the response to this one
+        reset_input_buffer = getattr(self.socket, 'reset_input_buffer', None)
+        if reset_input_buffer:
+            reset_input_buffer()
         result = self.socket.send(data)
         self._last_frame_end = time.time()
         return result
 
+    def _recv(self, size, response=None):
+        # Receive the next size bytes of a response.  Where possible they
+        # go straight into the transport's buffer, after the earlier part
+        # of the response, and the whole response is returned as a view.
+        recv_into = getattr(self.socket, 'recv_into', None)
+        if recv_into:
+            return recv_into(size, offset=(0 if response is None else len(response)))
+        data = self.socket.recv(size)
+        return (data if response is None else bytes(response) + data)
+
     def recv(self, size):
-        result = self.socket.recv(size)
-        self._last_frame_end = time.time()
-        return result
+        """Receive a response, which may be a view valid until the next"""
+        # An exception response is shorter than the expected response,
+        # so check the function code before waiting for the rest
+        try:
+            response = self._recv(3)
+            if response[1] & 0x80:
+                response = self._recv(2, response)
+                assert(modbus_crc_valid(response))
+                raise ModbusException(response[1] & 0x7f, response[2])
+            return self._recv(size - 3, response)
+        finally:
+            self._last_frame_end = time.time()
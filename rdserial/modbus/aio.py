@@ -0,0 +1,92 @@
+# rdserialtool
+# Copyright (C) 2019-2021 Ryan Finnie
+# SPDX-License-Identifier: MPL-2.0
+
+# asyncio version of RTUClient, for use with rdserial.device.aio
+# transports.  Transactions on a client are serialized, so multiple tasks
+# may share one device.
+
+import asyncio
+import logging
+
+from rdserial.modbus import (
+    ModbusException,
+    modbus_crc_valid,
+    silent_interval,
+    read_registers_request,
+    read_registers_response,
+    write_register_request,
+    write_register_response,
+    write_registers_request,
+    write_registers_response,
+)
+
+
+class AsyncRTUClient:
+    def __init__(self, socket, baudrate, timeout=None):
+        self.socket = socket
+        self.timeout = timeout
+        # Event loop time of the end of the last frame; may be created
+        # outside of a running loop
+        self._last_frame_end = 0.0
+        self._silent_interval = silent_interval(baudrate)
+        self._lock = asyncio.Lock()
+
+    async def transaction(self, request, expected_response_length, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        async with self._lock:
+            await self.send(request)
+            return await self.recv(expected_response_length, timeout=timeout)
+
+    async def read_registers(self, base, length, unit=1, timeout=None):
+        response = await self.transaction(
+            read_registers_request(base, length, unit=unit), 5 + (2 * length), timeout=timeout,
+        )
+        return read_registers_response(response, length, unit=unit)
+
+    async def write_register(self, register, value, unit=1, timeout=None):
+        request = write_register_request(register, value, unit=unit)
+        response = await self.transaction(request, 8, timeout=timeout)
+        write_register_response(response, request)
+
+    async def write_registers(self, register, values, unit=1, timeout=None):
+        response = await self.transaction(
+            write_registers_request(register, values, unit=unit), 8, timeout=timeout,
+        )
+        write_registers_response(response, register, values, unit=unit)
+
+    async def send(self, data):
+        loop = asyncio.get_running_loop()
+        ts = loop.time()
+        if ts < self._last_frame_end + self._silent_interval:
+            to_sleep = self._last_frame_end + self._silent_interval - ts
+            logging.debug('Sleeping {} for 3.5 char ({}) quiet period'.format(
+                to_sleep,
+                self._silent_interval,
+            ))
+            await asyncio.sleep(to_sleep)
+
+        # Discard any late response to an earlier, timed out request,
+        # which would otherwise be taken as the response to this one
+        self.socket.reset_input_buffer()
+        result = await self.socket.send(data)
+        self._last_frame_end = loop.time()
+        return result
+
+    async def recv(self, size, timeout=None):
+        loop = asyncio.get_running_loop()
+        deadline = (None if timeout is None else loop.time() + timeout)
+        try:
+            # An exception response is shorter than the expected response,
+            # so check the function code before waiting for the rest
+            header = await self.socket.recv(3, timeout=timeout)
+            if deadline is not None:
+                timeout = max(deadline - loop.time(), 0)
+            if header[1] & 0x80:
+                response = header + await self.socket.recv(2, timeout=timeout)
+                assert(modbus_crc_valid(response))
+                raise ModbusException(header[1] & 0x7f, header[2])
+            return header + await self.socket.recv(size - 3, timeout=timeout)
+        finally:
+            self._last_frame_end = loop.time()
@@ -0,0 +1,79 @@
+# rdserialtool
+# Copyright (C) 2019-2021 Ryan Finnie
+# SPDX-License-Identifier: MPL-2.0
+
+# Device settings profiles for DPS/RD devices.  A profile is a JSON or
+# TOML file (by .toml extension) giving field values in the units of
+# the JSON output, for the device and for any of its memory groups:
+#
+#   {"settings": {"setting_volts": 5.0, "output_state": false},
+#    "groups": {"1": {"setting_volts": 3.3, "setting_amps": 0.5}}}
+#
+#   [settings]
+#   setting_volts = 5.0
+#   [groups.1]
+#   setting_volts = 3.3
+#
+# Only fields which are both readable and writable may be set.
+
+import json
+
+try:
+    import tomllib
+    HAS_TOMLLIB = True
+except ImportError:
+    try:
+        import tomli as tomllib
+        HAS_TOMLLIB = True
+    except ImportError:
+        HAS_TOMLLIB = False
+
+GROUPS = range(10)
+
+
+def load_profile(filename):
+    if filename.endswith('.toml'):
+        if not HAS_TOMLLIB:
+            raise NotImplementedError('tomllib not available')
+        with open(filename, 'rb') as f:
+            profile = tomllib.load(f)
+    else:
+        with open(filename) as f:
+            profile = json.load(f)
+    unknown = set(profile) - {'settings', 'groups'}
+    if unknown:
+        raise ValueError('unknown section(s): {}'.format(', '.join(sorted(unknown))))
+    return profile
+
+
+def _table_registers(table, settings, section):
+    registers = {}
+    for name, value in settings.items():
+        key = '{}.{}'.format(section, name)
+        properties = table.properties.get(name)
+        if properties is None or properties['register'] not in table.writable:
+            raise ValueError('{}: unknown or read-only field'.format(key))
+        if not isinstance(value, (int, float)):
+            raise ValueError('{}: invalid value {!r}'.format(key, value))
+        raw = properties['to_int'](value)
+        if not 0 <= raw <= 0xffff:
+            raise ValueError('{}: value {!r} out of range ({} to {})'.format(
+                key, value, properties['from_int'](0), properties['from_int'](0xffff),
+            ))
+        registers[properties['register']] = raw
+    return registers
+
+
+def profile_registers(profile, device_state_class, device_group_state_class):
+    """Raw register values set by a loaded profile"""
+    registers = _table_registers(
+        device_state_class.register_table, profile.get('settings', {}), 'settings',
+    )
+    for key, settings in profile.get('groups', {}).items():
+        group = (int(key) if str(key).isdigit() else None)
+        if group not in GROUPS:
+            raise ValueError('groups.{}: invalid group'.format(key))
+        registers.update(_table_registers(
+            device_group_state_class.group_register_table(group), settings, 'groups.{}'.format(key),
+        ))
+    return registers
@@ -0,0 +1,108 @@
+# rdserialtool
+# Copyright (C) 2019-2021 Ryan Finnie
+# SPDX-License-Identifier: MPL-2.0
+
+# Fixed-rate scheduling for watch mode.  Deadlines are multiples of the
+# period on the monotonic clock, so the collection rate does not drift
+# with I/O time, and devices polled with the same period sample together.
+
+import math
+import time
+
+POLICY_SKIP = 'skip'
+POLICY_CATCH_UP = 'catch-up'
+POLICIES = (POLICY_SKIP, POLICY_CATCH_UP)
+
+
+class Scheduler:
+    """Deadline-based fixed-rate scheduler
+
+    Call wait() after each unit of work; it sleeps until the next period
+    boundary.  If the work overran one or more deadlines, the skip policy
+    drops the missed periods and waits for the next boundary, while the
+    catch-up policy returns immediately until the schedule is met again.
+
+    Jitter is the lateness of each wakeup relative to its deadline.  A
+    period of 0 never waits.
+    """
+
+    def __init__(self, period, policy=POLICY_SKIP, clock=time.monotonic, sleep=time.sleep):
+        if period < 0:
+            raise ValueError('Period must not be negative', period)
+        if policy not in POLICIES:
+            raise ValueError('Unknown overrun policy', policy)
+        self.period = period
+        self.policy = policy
+        self.clock = clock
+        self.sleep = sleep
+        self.deadline = None
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.jitter_max = 0.0
+        self._jitter_mean = 0.0
+        self._jitter_m2 = 0.0
+
+    def next_boundary(self, now):
+        return (math.floor(now / self.period) + 1) * self.period
+
+    def wait(self):
+        """Sleep until the next deadline; returns the wakeup lateness"""
+        now = self.clock()
+        if not self.period:
+            # Free-running
+            self._add_jitter(0.0)
+            return 0.0
+        if self.deadline is None:
+            self.deadline = self.next_boundary(now)
+        else:
+            self.deadline += self.period
+            if now > self.deadline:
+                self.overruns += 1
+                if self.policy == POLICY_SKIP:
+                    missed = math.floor((now - self.deadline) / self.period) + 1
+                    self.skipped += missed
+                    self.deadline += missed * self.period
+
+        remaining = self.deadline - now
+        if remaining > 0:
+            self.sleep(remaining)
+            now = self.clock()
+        jitter = max(now - self.deadline, 0.0)
+        self._add_jitter(jitter)
+        return jitter
+
+    def _add_jitter(self, jitter):
+        # Welford's online mean and variance
+        self.ticks += 1
+        delta = jitter - self._jitter_mean
+        self._jitter_mean += delta / self.ticks
+        self._jitter_m2 += delta * (jitter - self._jitter_mean)
+        if jitter > self.jitter_max:
+            self.jitter_max = jitter
+
+    @property
+    def jitter_mean(self):
+        return self._jitter_mean
+
+    @property
+    def jitter_stdev(self):
+        if self.ticks < 2:
+            return 0.0
+        return math.sqrt(self._jitter_m2 / (self.ticks - 1))
+
+    def stats(self):
+        return {
+            'ticks': self.ticks,
+            'overruns': self.overruns,
+            'skipped': self.skipped,
+            'jitter_mean': self.jitter_mean,
+            'jitter_stdev': self.jitter_stdev,
+            'jitter_max': self.jitter_max,
+        }
+
+    def __str__(self):
+        return '{} periods, {} overruns ({} periods skipped), jitter mean {:.03f}ms, stdev {:.03f}ms, max {:.03f}ms'.format(
+            self.ticks, self.overruns, self.skipped,
+            self.jitter_mean * 1000, self.jitter_stdev * 1000, self.jitter_max * 1000,
+        )
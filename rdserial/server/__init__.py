@@ -0,0 +1,208 @@
+# rdserialtool
+# Copyright (C) 2019-2021 Ryan Finnie
+# SPDX-License-Identifier: MPL-2.0
+
+# Unix socket daemon keeping a device connection open for many clients.
+#
+# The protocol is newline-delimited JSON.  Each request is an object with
+# a "command" key, and gets a single response object with "ok" set, plus
+# "error" if ok is false:
+#
+#   {"command": "read", "max_age": 1.0}  -> {"ok": true, "sample": {...}}
+#   {"command": "read", "groups": [1, 2]}  -> {"ok": true, "sample": {...}}
+#   {"command": "set", "settings": {"set_volts": 5.0}}  -> {"ok": true}
+#   {"command": "stats"}  -> {"ok": true, "stats": {...}}
+#
+# Settings are rdserialtool command option names (see COMMAND_ARGS), with
+# "group" selecting the group for set_group_* settings.  A read's "groups"
+# selects the DPS/RD memory groups read, instead of the daemon's own.
+
+import copy
+import json
+import logging
+import os
+import socket
+import socketserver
+import stat
+import threading
+import time
+
+COMMAND_ARGS = (
+    # DPS/RD
+    'set_volts', 'set_amps', 'set_clock', 'set_output_state', 'set_key_lock',
+    'set_brightness', 'load_group', 'set_group_volts', 'set_group_amps',
+    'set_group_cutoff_volts', 'set_group_cutoff_amps', 'set_group_cutoff_watts',
+    'set_group_brightness', 'set_group_maintain_output', 'set_group_poweron_output',
+    'profile',
+    # UM
+    'next_screen', 'rotate_screen', 'clear_data_group', 'set_record_threshold',
+    'set_screen_brightness', 'set_screen_timeout', 'previous_screen',
+    'set_data_group', 'next_data_group',
+)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                response = self.server.dispatch(json.loads(line))
+            except Exception as e:
+                logging.debug('Server: Request failed', exc_info=True)
+                response = {'ok': False, 'error': str(e)}
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serve a connected tool's samples and commands over a Unix socket
+
+    tool is a set-up rdserial.um.tool.Tool or rdserial.dps.tool.Tool.
+    Device access is serialized; reads within cache_ttl seconds of the
+    last collection (or the client's max_age) are answered from cache,
+    and concurrent readers waiting on the bus share one collection.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, tool, cache_ttl=1.0):
+        self.path = path
+        self.tool = tool
+        self.cache_ttl = cache_ttl
+        self.bus_lock = threading.Lock()
+        self.reads = 0
+        self.collections = 0
+        self.sets = 0
+        # Cached (sample, monotonic time) by group selection
+        self._samples = {}
+        # Replace a stale socket left by an unclean exit
+        try:
+            if stat.S_ISSOCK(os.stat(path).st_mode):
+                os.unlink(path)
+        except FileNotFoundError:
+            pass
+        super().__init__(path, _Handler)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def _cached(self, key, max_age):
+        sample, sample_time = self._samples.get(key, (None, None))
+        if sample is None or time.monotonic() - sample_time > max_age:
+            return None
+        return sample
+
+    def _collect(self, groups):
+        if groups is None:
+            return self.tool.sample_record(self.tool.collect())
+        if not hasattr(self.tool, 'selected_groups'):
+            raise ValueError('Groups are not supported by this device')
+        args = copy.copy(self.tool.args)
+        args.group = list(groups)
+        args.all_groups = False
+        base_args = self.tool.args
+        self.tool.args = args
+        self.tool.replan()
+        try:
+            return self.tool.sample_record(self.tool.collect())
+        finally:
+            self.tool.args = base_args
+            self.tool.replan()
+
+    def read(self, max_age=None, groups=None):
+        if max_age is None:
+            max_age = self.cache_ttl
+        if groups is not None:
+            groups = tuple(sorted(set(groups)))
+            if not all(isinstance(x, int) and 0 <= x <= 9 for x in groups):
+                raise ValueError('Invalid groups {}'.format(list(groups)))
+        self.reads += 1
+        sample = self._cached(groups, max_age)
+        if sample is not None:
+            return sample
+        with self.bus_lock:
+            sample = self._cached(groups, max_age)
+            if sample is None:
+                sample = self._collect(groups)
+                self._samples[groups] = (sample, time.monotonic())
+                self.collections += 1
+        return sample
+
+    def set(self, settings):
+        args = copy.copy(self.tool.args)
+        for name in COMMAND_ARGS:
+            setattr(args, name, None)
+        for name, value in settings.items():
+            if name == 'group':
+                args.group = [value]
+                args.all_groups = False
+            elif name in COMMAND_ARGS:
+                setattr(args, name, value)
+            else:
+                raise ValueError('Unknown setting "{}"'.format(name))
+        with self.bus_lock:
+            base_args = self.tool.args
+            self.tool.args = args
+            try:
+                self.tool.send_commands()
+            finally:
+                self.tool.args = base_args
+            self._samples.clear()
+            self.sets += 1
+
+    def stats(self):
+        return {
+            'reads': self.reads,
+            'collections': self.collections,
+            'sets': self.sets,
+        }
+
+    def dispatch(self, request):
+        command = request.get('command')
+        if command == 'read':
+            return {'ok': True, 'sample': self.read(request.get('max_age'), request.get('groups'))}
+        elif command == 'set':
+            self.set(request.get('settings', {}))
+            return {'ok': True}
+        elif command == 'stats':
+            return {'ok': True, 'stats': self.stats()}
+        raise ValueError('Unknown command "{}"'.format(command))
+
+
+class Client:
+    """Client for a Server socket"""
+
+    def __init__(self, path, timeout=None):
+        self.path = path
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
+        self.socket.connect(path)
+        self.file = self.socket.makefile('rwb')
+
+    def request(self, command, **kwargs):
+        self.file.write(json.dumps(dict(kwargs, command=command)).encode() + b'\n')
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise EOFError('Server closed the connection', self.path)
+        response = json.loads(line)
+        if not response['ok']:
+            raise RuntimeError(response['error'])
+        return response
+
+    def read(self, max_age=None, groups=None):
+        return self.request('read', max_age=max_age, groups=groups)['sample']
+
+    def set(self, **settings):
+        self.request('set', settings=settings)
+
+    def stats(self):
+        return self.request('stats')['stats']
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
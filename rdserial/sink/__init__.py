@@ -0,0 +1,276 @@
+# rdserialtool
+# Copyright (C) 2019-2021 Ryan Finnie
+# SPDX-License-Identifier: MPL-2.0
+
+# Output sinks for collected samples.  Records are plain dicts whose keys
+# are already in output order (see record_template), so encoders need not
+# sort them.  Tabular sinks flatten nested groups, data groups and trends
+# into dotted column names (e.g. "groups.0.setting_volts").
+
+import csv
+import json
+import operator
+import sqlite3
+import sys
+import time
+
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+
+def record_template(names):
+    """Sorted top-level keys of records with the given fields"""
+    return tuple(sorted(set(names)))
+
+
+def flatten(record, prefix=''):
+    """Flatten nested dicts and lists into dotted keys"""
+    out = {}
+    for key, value in record.items():
+        name = '{}{}'.format(prefix, key)
+        if isinstance(value, dict):
+            out.update(flatten(value, name + '.'))
+        elif isinstance(value, list):
+            out.update(flatten(dict(enumerate(value)), name + '.'))
+        else:
+            out[name] = value
+    return out
+
+
+def open_sink(args, table=None, columns=None, device_id=None):
+    """Open the output sink selected by rdserialtool arguments
+
+    table, columns and device_id describe the samples for SQLite.
+    Returns None for human-readable output.
+    """
+    if args.sqlite:
+        return SQLiteSink(
+            args.sqlite, table, columns, device_id,
+            batch_size=args.row_group_size, flush_interval=args.flush_interval,
+        )
+    elif args.arrow:
+        return ArrowSink(args.arrow, format='arrow', row_group_size=args.row_group_size)
+    elif args.parquet:
+        return ArrowSink(args.parquet, format='parquet', row_group_size=args.row_group_size)
+    elif args.csv:
+        return CSVSink(flush_interval=args.flush_interval)
+    elif args.json:
+        return NDJSONSink(flush_interval=args.flush_interval)
+    return None
+
+
+class NDJSONSink:
+    """Newline-delimited JSON sink with batched writes
+
+    Encoded records are buffered and written to the file in one call,
+    once flush_interval seconds have passed since the last write (0 writes
+    every record immediately).  orjson is used if available; the
+    standard library encoder is set up to give the same compact output.
+    """
+
+    def __init__(self, file=None, flush_interval=0.0, clock=time.monotonic):
+        self.file = (sys.stdout if file is None else file)
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self.records = 0
+        self._lines = []
+        self._last_flush = clock()
+        if HAS_ORJSON:
+            self._encode = self._encode_orjson
+        else:
+            self._encode = json.JSONEncoder(check_circular=False, separators=(',', ':')).encode
+
+    @staticmethod
+    def _encode_orjson(record):
+        return orjson.dumps(record, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def write(self, record):
+        self._lines.append(self._encode(record))
+        self._lines.append('\n')
+        self.records += 1
+        if self.clock() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self._lines:
+            self.file.write(''.join(self._lines))
+            self._lines = []
+        self.file.flush()
+        self._last_flush = self.clock()
+
+    def close(self):
+        self.flush()
+
+
+class CSVSink:
+    """CSV sink with batched writes
+
+    The columns are taken from the first record, and the header row is
+    written once.  Rows are buffered as with NDJSONSink.
+    """
+
+    def __init__(self, file=None, flush_interval=0.0, clock=time.monotonic):
+        self.file = (sys.stdout if file is None else file)
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self.records = 0
+        self.columns = None
+        self._row = None
+        self._rows = []
+        self._writer = csv.writer(self.file, lineterminator='\n')
+        self._last_flush = clock()
+
+    def write(self, record):
+        record = flatten(record)
+        if self.columns is None:
+            self.columns = tuple(record)
+            self._row = operator.itemgetter(*self.columns)
+            self._rows.append(self.columns)
+        if len(self.columns) == 1:
+            self._rows.append((self._row(record),))
+        else:
+            self._rows.append(self._row(record))
+        self.records += 1
+        if self.clock() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self._rows:
+            self._writer.writerows(self._rows)
+            self._rows = []
+        self.file.flush()
+        self._last_flush = self.clock()
+
+    def close(self):
+        self.flush()
+
+
+class ArrowSink:
+    """Arrow IPC or Parquet file sink
+
+    Samples are buffered into per-column lists, and written as a record
+    batch (Arrow) or row group (Parquet) every row_group_size samples.
+    The schema is inferred from the first batch.
+    """
+
+    def __init__(self, filename, format='parquet', row_group_size=4096):
+        if not HAS_PYARROW:
+            raise NotImplementedError('pyarrow not available')
+        if format not in ('arrow', 'parquet'):
+            raise ValueError('Unknown format', format)
+        self.filename = filename
+        self.format = format
+        self.row_group_size = row_group_size
+        self.records = 0
+        self.columns = None
+        self.schema = None
+        self._data = None
+        self._rows = 0
+        self._file = None
+        self._writer = None
+
+    def write(self, record):
+        record = flatten(record)
+        if self.columns is None:
+            self.columns = tuple(record)
+            self._data = {x: [] for x in self.columns}
+        for column in self.columns:
+            self._data[column].append(record.get(column))
+        self._rows += 1
+        self.records += 1
+        if self._rows >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if not self._rows:
+            return
+        table = pyarrow.Table.from_pydict(self._data, schema=self.schema)
+        if self._writer is None:
+            self.schema = table.schema
+            if self.format == 'parquet':
+                self._writer = pyarrow.parquet.ParquetWriter(self.filename, self.schema)
+            else:
+                self._file = pyarrow.OSFile(self.filename, 'wb')
+                self._writer = pyarrow.ipc.new_file(self._file, self.schema)
+        self._writer.write_table(table)
+        self._data = {x: [] for x in self.columns}
+        self._rows = 0
+
+    def close(self):
+        self.flush()
+        if self._writer:
+            self._writer.close()
+        if self._file:
+            self._file.close()
+        self._writer = self._file = None
+
+
+class SQLiteSink:
+    """SQLite time-series sink
+
+    Samples go into one table per device family, with a device_id and
+    time column followed by the given (flattened) sample columns; dots
+    in column names become underscores.  Columns missing from an
+    existing table are added.  Rows are inserted with executemany in one
+    transaction per batch_size samples or flush_interval seconds, with
+    the database in WAL mode.
+    """
+
+    def __init__(self, filename, table, columns, device_id, batch_size=4096, flush_interval=0.0, clock=time.monotonic):
+        self.filename = filename
+        self.table = table
+        self.columns = tuple(columns)
+        self.device_id = device_id
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self.records = 0
+        self._rows = []
+        self.db = sqlite3.connect(filename, timeout=30)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+
+        names = [x.replace('.', '_') for x in self.columns]
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS "{}" (device_id TEXT NOT NULL, time REAL NOT NULL)'.format(table))
+            existing = {x[1] for x in self.db.execute('PRAGMA table_info("{}")'.format(table))}
+            for name in names:
+                if name not in existing:
+                    self.db.execute('ALTER TABLE "{}" ADD COLUMN "{}" REAL'.format(table, name))
+            self.db.execute('CREATE INDEX IF NOT EXISTS "{0}_device_id_time" ON "{0}" (device_id, time)'.format(table))
+        self._insert = 'INSERT INTO "{}" (device_id, time, {}) VALUES (?, ?, {})'.format(
+            table,
+            ', '.join('"{}"'.format(x) for x in names),
+            ', '.join('?' for x in names),
+        )
+        self._last_flush = clock()
+
+    def write(self, record):
+        record = flatten(record)
+        self._rows.append(
+            (self.device_id, record['collection_time']) + tuple(record.get(x) for x in self.columns)
+        )
+        self.records += 1
+        if len(self._rows) >= self.batch_size or self.clock() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self._rows:
+            with self.db:
+                self.db.executemany(self._insert, self._rows)
+            self._rows = []
+        self._last_flush = self.clock()
+
+    def close(self):
+        self.flush()
+        self.db.close()
@@ -3,17 +3,49 @@
 # SPDX-License-Identifier: MPL-2.0
 
 import argparse
+import copy
+import json
 import sys
 import os
 import logging
+import signal
+import threading
 import time
 
 from rdserial import __version__
 import rdserial.device
+import rdserial.gateway
+import rdserial.modbus
+import rdserial.profile
+import rdserial.scheduler
+import rdserial.server
 import rdserial.um.tool
 import rdserial.dps.tool
 
 
+supported_devices = []
+supported_devices += rdserial.um.tool.supported_devices
+supported_devices += rdserial.dps.tool.supported_devices
+
+poll_spec_keys = {
+    'name': str,
+    'device': str,
+    'bluetooth_address': str,
+    'bluetooth_port': int,
+    'serial_device': str,
+    'replay': str,
+    'baud': int,
+    'modbus_unit': int,
+    'cold_poll_cycles': int,
+    'watch_seconds': float,
+    'record': str,
+    'arrow': str,
+    'parquet': str,
+    'sqlite': str,
+    'profile': str,
+}
+
+
 def parse_args(argv=None):
     """Parse user arguments."""
     if argv is None:
@@ -28,6 +60,32 @@ def parse_args(argv=None):
             raise argparse.ArgumentTypeError('Must be between 0.00 and 0.30, in 0.01 steps')
         return val
 
+    def field_list(string):
+        return [x.strip() for x in string.split(',') if x.strip()]
+
+    def gateway_address(string):
+        host, sep, port = string.rpartition(':')
+        try:
+            return (host or '127.0.0.1', int(port))
+        except ValueError:
+            raise argparse.ArgumentTypeError('Invalid gateway address "{}"'.format(string))
+
+    def poll_spec(string):
+        spec = {}
+        for part in string.split(','):
+            key, sep, val = part.partition('=')
+            key = key.strip().replace('-', '_')
+            if not sep or key not in poll_spec_keys:
+                raise argparse.ArgumentTypeError('Invalid device specification "{}"'.format(part))
+            spec[key] = poll_spec_keys[key](val.strip())
+        if spec.get('device') not in supported_devices:
+            raise argparse.ArgumentTypeError('A supported device= is required')
+        if len([x for x in ('bluetooth_address', 'serial_device', 'replay') if x in spec]) != 1:
+            raise argparse.ArgumentTypeError(
+                'Exactly one of bluetooth-address=, serial-device= or replay= is required'
+            )
+        return spec
+
     parser = argparse.ArgumentParser(
         description='rdserialtool ({})'.format(__version__),
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
@@ -49,16 +107,13 @@ def parse_args(argv=None):
         help='Print extra debugging information.',
     )
 
-    supported_devices = []
-    supported_devices += rdserial.um.tool.supported_devices
-    supported_devices += rdserial.dps.tool.supported_devices
     parser.add_argument(
-        '--device', '-d', required=True,
+        '--device', '-d',
         choices=sorted(supported_devices),
         help='Device type',
     )
 
-    device_group = parser.add_mutually_exclusive_group(required=True)
+    device_group = parser.add_mutually_exclusive_group()
     device_group.add_argument(
         '--bluetooth-address', '-b',
         help='Bluetooth EUI-48 address of the device',
@@ -67,23 +122,117 @@ def parse_args(argv=None):
         '--serial-device', '-s',
         help='Serial filename (e.g. /dev/rfcomm0) of the device',
     )
+    device_group.add_argument(
+        '--replay', metavar='FILE',
+        help='Replay a capture file made with --record instead of connecting to a device',
+    )
 
     parser.add_argument(
         '--bluetooth-port', type=int, default=1,
         help='Bluetooth RFCOMM port number',
     )
+    device_group.add_argument(
+        '--poll', metavar='SPEC', type=poll_spec, action='append',
+        help=(
+            'Poll multiple devices concurrently; may be given multiple times.  '
+            'SPEC is a comma-separated list of key=value settings: device= and one of '
+            'serial-device=, bluetooth-address= or replay= are required, and '
+            'name=, bluetooth-port=, baud=, modbus-unit=, cold-poll-cycles=, watch-seconds=, '
+            'record=, arrow=, parquet=, sqlite= and profile= override the global options for that device.  '
+            'With several devices, --csv is not available, and record, arrow and parquet files must differ'
+        ),
+    )
+
+    device_group.add_argument(
+        '--query', metavar='SOCKET',
+        help=(
+            'Instead of connecting to a device, send any settings to and read a JSON sample from '
+            'a --serve daemon'
+        ),
+    )
+    parser.add_argument(
+        '--serve', metavar='SOCKET',
+        help='Keep the device connection open and serve reads and settings on this Unix socket',
+    )
+    parser.add_argument(
+        '--gateway', metavar='[HOST:]PORT', type=gateway_address,
+        help='Keep the device connection open and act as a Modbus TCP gateway on this address [DPS/RD]',
+    )
+    parser.add_argument(
+        '--gateway-window', type=float, default=0.01,
+        help='Seconds the gateway waits for concurrent requests to merge before using the bus',
+    )
+    parser.add_argument(
+        '--gateway-cache-ttl', type=float, default=0.0,
+        help='Seconds the gateway may answer register reads from cache (default: 0, no cache)',
+    )
+    parser.add_argument(
+        '--cache-ttl', type=float, default=None,
+        help=(
+            'Maximum age in seconds of a cached sample returned by --serve (default: 1.0), '
+            'or accepted by --query (default: the daemon setting)'
+        ),
+    )
+    parser.add_argument(
+        '--replay-realtime', action='store_true',
+        help='Replay captures at their original timing rather than as fast as possible',
+    )
     parser.add_argument(
         '--baud', type=int, default=9600,
         help='Serial port baud rate',
     )
+    parser.add_argument(
+        '--serial-timeout', type=float, default=None,
+        help='Seconds to wait for a complete serial response (default: 1.0 with --gateway, otherwise wait forever)',
+    )
+    parser.add_argument(
+        '--serial-inter-byte-timeout', type=float, default=None,
+        help='Maximum seconds between bytes of a serial response',
+    )
     parser.add_argument(
         '--connect-delay', type=float, default=0.3,
         help='Seconds to wait after connecting to the serial port',
     )
-    parser.add_argument(
+    output_group = parser.add_mutually_exclusive_group()
+    output_group.add_argument(
         '--json', action='store_true',
         help='Output JSON data',
     )
+    output_group.add_argument(
+        '--csv', action='store_true',
+        help='Output CSV data, with a header row',
+    )
+    output_group.add_argument(
+        '--arrow', metavar='FILE',
+        help='Write samples to an Arrow IPC file (requires pyarrow)',
+    )
+    output_group.add_argument(
+        '--parquet', metavar='FILE',
+        help='Write samples to a Parquet file (requires pyarrow)',
+    )
+    output_group.add_argument(
+        '--sqlite', metavar='PATH',
+        help='Append samples to a SQLite database, with one table per device family',
+    )
+    parser.add_argument(
+        '--fields', type=field_list,
+        help=(
+            'Comma-separated list of fields to collect and output (default: all).  '
+            'DPS/RD devices only read the registers needed; groups are always read in full'
+        ),
+    )
+    parser.add_argument(
+        '--flush-interval', type=float, default=0.0,
+        help='Buffer JSON/CSV/SQLite output, writing it at most once per this many seconds',
+    )
+    parser.add_argument(
+        '--row-group-size', type=int, default=4096,
+        help='Maximum number of samples buffered per Arrow/Parquet record batch or SQLite transaction',
+    )
+    parser.add_argument(
+        '--record', metavar='FILE',
+        help='Append raw device data to a binary capture file',
+    )
     parser.add_argument(
         '--watch', action='store_true',
         help='Repeat data collection until cancelled',
@@ -92,10 +241,18 @@ def parse_args(argv=None):
         '--watch-seconds', type=float, default=2.0,
         help='Number of seconds between collections in watch mode',
     )
+    parser.add_argument(
+        '--watch-policy', choices=rdserial.scheduler.POLICIES, default=rdserial.scheduler.POLICY_SKIP,
+        help='When a collection overruns its period, skip the missed periods or catch up on them',
+    )
     parser.add_argument(
         '--trend-points', type=int, default=5,
         help='Number of points to remember for determining a trend in watch mode',
     )
+    parser.add_argument(
+        '--json-trends', action='store_true',
+        help='Add rolling mean, min, max, standard deviation and EWMA of numeric fields to JSON output',
+    )
 
     parser_group_dps = parser.add_argument_group(
         'DPS/RD-related arguments'
@@ -105,6 +262,25 @@ def parse_args(argv=None):
         '--modbus-unit', type=int, default=1,
         help='Modbus unit number',
     )
+    parser_group_dps.add_argument(
+        '--max-read-gap', type=int, default=16,
+        help='Maximum number of unneeded registers to read between needed ones when coalescing reads',
+    )
+    parser_group_dps.add_argument(
+        '--profile', metavar='FILE',
+        help='Apply device and group settings from a JSON or TOML profile, writing only those which differ',
+    )
+    parser_group_dps.add_argument(
+        '--verify-writes', action='store_true',
+        help='Read back written registers and fail if they do not hold the values set',
+    )
+    parser_group_dps.add_argument(
+        '--cold-poll-cycles', type=int, default=1,
+        help=(
+            'In watch mode, only re-read cold registers (identification, clock, settings and groups) '
+            'every this many polls, reusing the last values in between'
+        ),
+    )
     parser_group_dps.add_argument(
         '--group', type=int, action='append',
         help='Display/set selected group(s)',
@@ -229,8 +405,81 @@ def parse_args(argv=None):
         '--next-data-group', action='store_true',
         help='Change to the next data group',
     )
+    parser_group_um.add_argument(
+        '--stream', action='store_true',
+        help=(
+            'Poll continuously as fast as the device responds, reading in a separate thread '
+            'from decoding and output'
+        ),
+    )
+    parser_group_um.add_argument(
+        '--stream-queue', type=int, default=64,
+        help='Maximum number of frames buffered between reading and output in stream mode',
+    )
+    parser_group_um.add_argument(
+        '--stream-overflow', choices=['block', 'drop'], default='block',
+        help='When the stream buffer is full, pause reading or drop the oldest buffered frame',
+    )
 
     args = parser.parse_args(args=argv[1:])
+    if args.cold_poll_cycles < 1:
+        parser.error('--cold-poll-cycles must be at least 1')
+    if args.trend_points < 1:
+        parser.error('--trend-points must be at least 1')
+    if args.row_group_size < 1:
+        parser.error('--row-group-size must be at least 1')
+    if args.stream_queue < 1:
+        parser.error('--stream-queue must be at least 1')
+    if args.gateway and args.device not in rdserial.dps.tool.supported_devices:
+        parser.error('--gateway requires a DPS/RD device')
+    if args.fields:
+        for device in ([x['device'] for x in args.poll] if args.poll else [args.device]):
+            if device in rdserial.um.tool.supported_devices:
+                names = rdserial.um.tool.field_names(device)
+            elif device in rdserial.dps.tool.supported_devices:
+                names = rdserial.dps.tool.field_names(device)
+            else:
+                continue
+            unknown = [x for x in args.fields if x not in names]
+            if unknown:
+                parser.error('Unknown field(s) for {}: {} (valid fields: {})'.format(
+                    device, ', '.join(unknown), ', '.join(sorted(names)),
+                ))
+    if args.poll:
+        profiles = [(spec['device'], spec.get('profile', args.profile)) for spec in args.poll]
+    else:
+        profiles = [(args.device, args.profile)]
+    for device, profile in profiles:
+        if not profile or device not in rdserial.dps.tool.supported_devices:
+            continue
+        try:
+            rdserial.profile.profile_registers(
+                rdserial.profile.load_profile(profile), *rdserial.dps.tool.state_classes(device),
+            )
+        except (OSError, ValueError, NotImplementedError) as e:
+            parser.error('Invalid profile {}: {}'.format(profile, e))
+    if args.poll and len(args.poll) > 1:
+        # Each device writes its own sink; only SQLite (keyed by device)
+        # and JSON can be shared
+        if args.csv:
+            parser.error('--csv cannot be used when polling more than one device')
+        for key in ('record', 'arrow', 'parquet'):
+            paths = [spec.get(key, getattr(args, key)) for spec in args.poll]
+            paths = [x for x in paths if x]
+            if len(paths) != len(set(paths)):
+                parser.error('Polled devices cannot share a --{0} file; give each device its own {0}='.format(key))
+    if args.gateway and args.serial_timeout is None:
+        # One lost response must not stall the bus for every client
+        args.serial_timeout = 1.0
+    if args.profile and args.device in rdserial.um.tool.supported_devices:
+        parser.error('--profile requires a DPS/RD device')
+    if not (args.poll or args.query):
+        if not args.device:
+            parser.error('the following arguments are required: --device/-d')
+        if not (args.bluetooth_address or args.serial_device or args.replay):
+            parser.error(
+                'one of the arguments --bluetooth-address/-b --serial-device/-s --replay --poll --query is required'
+            )
 
     return args
 
@@ -258,31 +507,174 @@ class RDSerialTool:
         logging.info('Copyright (C) 2019 Ryan Finnie')
         logging.info('')
 
-        if self.args.serial_device:
-            logging.info('Connecting to {} {}'.format(self.args.device.upper(), self.args.serial_device))
-            self.socket = rdserial.device.Serial(
-                self.args.serial_device,
-                baudrate=self.args.baud,
+        if self.args.poll:
+            return self.poll_devices()
+        if self.args.query:
+            return self.query()
+
+        self.socket = self.connect(self.args)
+        if self.args.serve:
+            ret = self.serve()
+        elif self.args.gateway:
+            ret = self.gateway()
+        else:
+            ret = self.make_tool(self).main()
+
+        self.socket.close()
+        return ret
+
+    def connect(self, args):
+        if args.replay:
+            logging.info('Replaying {} {}'.format(args.device.upper(), args.replay))
+            socket = rdserial.device.Replay(
+                args.replay,
+                realtime=args.replay_realtime,
+            )
+        elif args.serial_device:
+            logging.info('Connecting to {} {}'.format(args.device.upper(), args.serial_device))
+            socket = rdserial.device.Serial(
+                args.serial_device,
+                baudrate=args.baud,
+                timeout=args.serial_timeout,
+                inter_byte_timeout=args.serial_inter_byte_timeout,
             )
         else:
-            logging.info('Connecting to {} {}'.format(self.args.device.upper(), self.args.bluetooth_address))
-            self.socket = rdserial.device.Bluetooth(
-                self.args.bluetooth_address,
-                port=self.args.bluetooth_port,
+            logging.info('Connecting to {} {}'.format(args.device.upper(), args.bluetooth_address))
+            socket = rdserial.device.Bluetooth(
+                args.bluetooth_address,
+                port=args.bluetooth_port,
             )
-        self.socket.connect()
+        socket.connect()
         logging.info('Connection established')
         logging.info('')
-        time.sleep(self.args.connect_delay)
-
-        if self.args.device in rdserial.um.tool.supported_devices:
-            tool = rdserial.um.tool.Tool(self)
-        elif self.args.device in rdserial.dps.tool.supported_devices:
-            tool = rdserial.dps.tool.Tool(self)
-        ret = tool.main()
-
-        self.socket.close()
-        return ret
+        if not args.replay:
+            time.sleep(args.connect_delay)
+        return socket
+
+    def make_tool(self, parent):
+        if parent.args.device in rdserial.um.tool.supported_devices:
+            return rdserial.um.tool.Tool(parent)
+        elif parent.args.device in rdserial.dps.tool.supported_devices:
+            return rdserial.dps.tool.Tool(parent)
+
+    def serve(self):
+        tool = self.make_tool(self)
+        tool.setup()
+        tool.send_commands()
+        server = rdserial.server.Server(
+            self.args.serve, tool,
+            cache_ttl=(1.0 if self.args.cache_ttl is None else self.args.cache_ttl),
+        )
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        logging.info('Serving {} on {}'.format(self.args.device.upper(), self.args.serve))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            logging.info('{reads} reads ({collections} from the device), {sets} settings'.format(**server.stats()))
+
+    def gateway(self):
+        cache = None
+        if self.args.gateway_cache_ttl:
+            cache = rdserial.modbus.RegisterCache(default_ttl=self.args.gateway_cache_ttl)
+        gateway = rdserial.gateway.Gateway(
+            self.args.gateway,
+            rdserial.modbus.RTUClient(self.socket, baudrate=self.args.baud, cache=cache),
+            default_unit=self.args.modbus_unit,
+            window=self.args.gateway_window,
+            max_gap=self.args.max_read_gap,
+        )
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        logging.info('Modbus TCP gateway for {} on {}:{}'.format(self.args.device.upper(), *self.args.gateway))
+        try:
+            gateway.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            gateway.server_close()
+            logging.info('{requests} requests in {transactions} RTU transactions'.format(**gateway.stats()))
+            if cache is not None:
+                logging.info('Register cache: {hits} hits, {misses} misses'.format(**cache.stats()))
+
+    def query(self):
+        client = rdserial.server.Client(self.args.query)
+        settings = {
+            x: getattr(self.args, x) for x in rdserial.server.COMMAND_ARGS
+            if getattr(self.args, x, None) not in (None, False)
+        }
+        if settings and self.args.group:
+            settings['group'] = self.args.group[0]
+        if settings.get('profile'):
+            # The daemon may run in another directory
+            settings['profile'] = os.path.abspath(settings['profile'])
+        groups = (list(range(10)) if self.args.all_groups else self.args.group)
+        try:
+            if settings:
+                client.set(**settings)
+            print(json.dumps(client.read(max_age=self.args.cache_ttl, groups=groups), sort_keys=True))
+        finally:
+            client.close()
+
+    def poll_devices(self):
+        output_lock = threading.Lock()
+        # Devices stop at their next poll once this is set, so each can
+        # flush its sink and close its recorder
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+        threads = []
+        for spec in self.args.poll:
+            thread = threading.Thread(target=self.poll_device, args=(spec, output_lock, stop))
+            thread.start()
+            threads.append(thread)
+        # Sleep rather than join with a timeout; a join interrupted by
+        # Ctrl-C can leave a running thread looking finished
+        while [x for x in threads if x.is_alive()]:
+            try:
+                time.sleep(0.2)
+            except KeyboardInterrupt:
+                stop.set()
+        for thread in threads:
+            thread.join()
+
+    def poll_device(self, spec, output_lock, stop):
+        device = PolledDevice(self.args, spec)
+        try:
+            device.socket = self.connect(device.args)
+        except Exception:
+            logging.exception('{}: Connection failed'.format(device.name))
+            return
+        tool = self.make_tool(device)
+        tool.device_name = device.name
+        tool.output_lock = output_lock
+        tool.stop = stop
+        try:
+            tool.main()
+        except Exception:
+            logging.exception('{}: An exception has occurred'.format(device.name))
+        finally:
+            device.socket.close()
+
+
+class PolledDevice:
+    """Per-device arguments and connection for --poll"""
+
+    def __init__(self, args, spec):
+        self.args = copy.copy(args)
+        self.args.bluetooth_address = None
+        self.args.serial_device = None
+        self.args.replay = None
+        self.name = spec.get('name')
+        for key, val in spec.items():
+            if key != 'name':
+                setattr(self.args, key, val)
+        if not self.name:
+            self.name = '{}@{}'.format(
+                self.args.device,
+                self.args.serial_device or self.args.bluetooth_address or self.args.replay,
+            )
+        self.socket = None
 
 
 def main():
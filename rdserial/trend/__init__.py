@@ -0,0 +1,135 @@
+# rdserialtool
+# Copyright (C) 2019-2021 Ryan Finnie
+# SPDX-License-Identifier: MPL-2.0
+
+# Constant-cost rolling statistics for watch mode trends.
+
+import array
+import collections
+import math
+
+
+class RollingWindow:
+    """Fixed-size rolling window of float samples
+
+    Samples are kept in an array ring buffer with running sums, so adding
+    a sample and reading the mean or standard deviation are O(1).  Sums
+    are of the samples less a shift near the mean, and are recomputed
+    once per pass over the buffer, so rounding error neither cancels
+    badly nor accumulates.  min and max use monotonic queues (amortized
+    O(1)).  ewma is an exponentially weighted moving average with the
+    given alpha, by default 2 / (size + 1).
+    """
+
+    __slots__ = (
+        'size', 'alpha', 'ewma', 'count',
+        '_values', '_pos', '_seq', '_shift', '_sum', '_sumsq', '_mins', '_maxes',
+    )
+
+    def __init__(self, size, alpha=None):
+        if size < 1:
+            raise ValueError('Window size must be at least 1', size)
+        self.size = size
+        self.alpha = (2 / (size + 1) if alpha is None else alpha)
+        self.ewma = None
+        self.count = 0
+        self._values = array.array('d', bytes(8 * size))
+        self._pos = 0
+        self._seq = 0
+        self._shift = None
+        self._sum = 0.0
+        self._sumsq = 0.0
+        self._mins = collections.deque()
+        self._maxes = collections.deque()
+
+    def fill(self, value):
+        """Reset the window to size copies of value"""
+        value = float(value)
+        for i in range(self.size):
+            self._values[i] = value
+        self._pos = 0
+        self.count = self.size
+        self._shift = value
+        self._sum = 0.0
+        self._sumsq = 0.0
+        self._mins.clear()
+        self._maxes.clear()
+        self._mins.append((self._seq + self.size - 1, value))
+        self._maxes.append((self._seq + self.size - 1, value))
+        self._seq += self.size
+        self.ewma = value
+
+    def push(self, value):
+        """Add a sample, replacing the oldest once the window is full"""
+        value = float(value)
+        if self._shift is None:
+            self._shift = value
+        if self.count == self.size:
+            old = self._values[self._pos] - self._shift
+            self._sum -= old
+            self._sumsq -= old * old
+        else:
+            self.count += 1
+        self._values[self._pos] = value
+        shifted = value - self._shift
+        self._sum += shifted
+        self._sumsq += shifted * shifted
+        self._pos += 1
+        if self._pos == self.size:
+            self._pos = 0
+            values = self._values[:self.count]
+            self._shift = math.fsum(values) / self.count
+            self._sum = math.fsum(x - self._shift for x in values)
+            self._sumsq = math.fsum((x - self._shift) ** 2 for x in values)
+
+        seq = self._seq
+        self._seq += 1
+        expired = seq - self.size
+        mins = self._mins
+        while mins and mins[-1][1] >= value:
+            mins.pop()
+        mins.append((seq, value))
+        if mins[0][0] <= expired:
+            mins.popleft()
+        maxes = self._maxes
+        while maxes and maxes[-1][1] <= value:
+            maxes.pop()
+        maxes.append((seq, value))
+        if maxes[0][0] <= expired:
+            maxes.popleft()
+
+        if self.ewma is None:
+            self.ewma = value
+        else:
+            self.ewma += self.alpha * (value - self.ewma)
+
+    @property
+    def mean(self):
+        if not self.count:
+            return None
+        return self._shift + self._sum / self.count
+
+    @property
+    def stdev(self):
+        """Sample standard deviation"""
+        if self.count < 2:
+            return 0.0
+        variance = (self._sumsq - self._sum * self._sum / self.count) / (self.count - 1)
+        return math.sqrt(max(variance, 0.0))
+
+    @property
+    def min(self):
+        return self._mins[0][1] if self._mins else None
+
+    @property
+    def max(self):
+        return self._maxes[0][1] if self._maxes else None
+
+    def stats(self):
+        return {
+            'mean': self.mean,
+            'min': self.min,
+            'max': self.max,
+            'stdev': self.stdev,
+            'ewma': self.ewma,
+        }
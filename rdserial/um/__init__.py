@@ -5,6 +5,7 @@
 import struct
 import datetime
 import logging
+import time
 
 CHARGING_UNKNOWN = 0
 CHARGING_QC2 = 1
@@ -18,9 +19,7 @@ CHARGING_SAMSUNG = 8
 
 
 class DataGroup:
-    group = 0
-    amp_hours = 0
-    watt_hours = 0
+    __slots__ = ('group', 'amp_hours', 'watt_hours')
 
     def __repr__(self):
         return ('<DataGroup {}: {:0.03f}Ah, {:0.03f}Wh>'.format(
@@ -29,11 +28,165 @@ class DataGroup:
             self.watt_hours,
         ))
 
-    def __init__(self, group=0):
+    def __init__(self, group=0, amp_hours=0, watt_hours=0):
         self.group = group
+        self.amp_hours = amp_hours
+        self.watt_hours = watt_hours
+
+
+# Frame layout: name, description, position, length, scale.  A scale of
+# None passes the value through, bool converts to a boolean, and numeric
+# scales divide the raw value.  Fields marked as device-scaled are further
+# multiplied on devices with extra precision (UM25C).
+FIELD_LAYOUT = (
+    ('start', 'Start bytes', 0, 2, None, False),
+    ('volts', 'Volts', 2, 2, 100, True),
+    ('amps', 'Amps', 4, 2, 1000, True),
+    ('watts', 'Watts', 6, 4, 1000, False),
+    ('temp_c', 'Temperature (Celsius)', 10, 2, None, False),
+    ('temp_f', 'Temperature (Fahrenheit)', 12, 2, None, False),
+    ('data_group_selected', 'Currently selected data group', 14, 2, None, False),
+    ('data_line_positive_volts', 'Positive data line volts', 96, 2, 100, False),
+    ('data_line_negative_volts', 'Negative data line volts', 98, 2, 100, False),
+    ('charging_mode', 'Charging mode', 100, 2, None, False),
+    ('record_amphours', 'Recorded amp-hours', 102, 4, 1000, False),
+    ('record_watthours', 'Recorded watt-hours', 106, 4, 1000, False),
+    ('record_threshold', 'Recording threshold (Amps)', 110, 2, 100, False),
+    ('record_seconds', 'Recorded time (Seconds)', 112, 4, None, False),
+    ('recording', 'Recording', 116, 2, bool, False),
+    ('screen_timeout', 'Screen timeout (Minutes)', 118, 2, None, False),
+    ('screen_brightness', 'Screen brightness', 120, 2, None, False),
+    ('resistance', 'Resistance (Ohms)', 122, 4, 10, False),
+    ('screen_selected', 'Currently selected screen', 126, 2, None, False),
+    ('end', 'End bytes', 128, 2, None, False),
+)
+DATA_GROUPS_POSITION = 16
+FRAME_LENGTH = 130
+
+# Position of each field, and of the first data group value, in the flat
+# tuple of raw frame integers
+DATA_GROUPS_INDEX = len([x for x in FIELD_LAYOUT if x[2] < DATA_GROUPS_POSITION])
+RAW_INDEXES = {
+    x[0]: (i if i < DATA_GROUPS_INDEX else i + 20) for i, x in enumerate(FIELD_LAYOUT)
+}
+
+
+def _conversions(scale):
+    if scale is None:
+        return {
+            'from_int': lambda x: x,
+            'to_int': lambda x: int(x),
+        }
+    elif scale is bool:
+        return {
+            'from_int': lambda x: bool(x),
+            'to_int': lambda x: int(x),
+        }
+    return {
+        'from_int': lambda x: x / scale,
+        'to_int': lambda x: int(round(x * scale)),
+    }
+
+
+class FrameCodec:
+    """Precompiled decoder/encoder for a single UM device type
+
+    The whole 130-byte frame is handled by a single struct.Struct, as a
+    flat tuple of raw integers: the fields in FIELD_LAYOUT order, with the
+    20 data group amp-hour/watt-hour values in the middle.  scales is the
+    matching scale table.  Use get_codec() to get the shared instance for
+    a device type.
+    """
+
+    def __init__(self, device_type='UM24C'):
+        self.device_type = device_type
+        if device_type == 'UM25C':
+            self.device_multiplier = 10
+        else:
+            self.device_multiplier = 1
+
+        self.field_properties = {}
+        pack_format = '>'
+        scales = []
+        for name, description, position, length, scale, multiplied in FIELD_LAYOUT:
+            if multiplied:
+                scale = scale * self.device_multiplier
+            self.field_properties[name] = {
+                'description': description,
+                'position': position,
+                'length': length,
+                **_conversions(scale),
+            }
+            if len(scales) == DATA_GROUPS_INDEX:
+                pack_format += '20L'
+                scales += [1000] * 20
+            pack_format += ('L' if length == 4 else 'H')
+            scales.append(scale)
+        self.struct = struct.Struct(pack_format)
+        assert(self.struct.size == FRAME_LENGTH)
+        self.scales = tuple(scales)
+
+    def unpack(self, data, offset=0):
+        return self.struct.unpack_from(data, offset)
+
+    def pack(self, raw):
+        return self.struct.pack(*raw)
+
+    def from_raw(self, index, value):
+        scale = self.scales[index]
+        if scale is None:
+            return value
+        elif scale is bool:
+            return bool(value)
+        return value / scale
+
+    def to_raw(self, index, value):
+        scale = self.scales[index]
+        if scale is None or scale is bool:
+            return int(value)
+        return int(round(value * scale))
+
+
+_codecs = {}
+
+
+def get_codec(device_type='UM24C'):
+    codec = _codecs.get(device_type)
+    if codec is None:
+        codec = _codecs[device_type] = FrameCodec(device_type)
+    return codec
+
+
+class _Field:
+    """Lazily-decoded view of a raw frame value"""
+
+    __slots__ = ('index',)
+
+    def __init__(self, index):
+        self.index = index
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return obj.codec.from_raw(self.index, obj._raw[self.index])
+
+    def __set__(self, obj, value):
+        raw = list(obj._raw)
+        raw[self.index] = obj.codec.to_raw(self.index, value)
+        obj._raw = tuple(raw)
 
 
 class Response:
+    """A single UM sample
+
+    Only the raw integers of the frame are stored, alongside the shared
+    per-device codec; field values are scaled on attribute access.
+    data_groups is decoded on first access, and the list (including
+    changes to its DataGroup objects) is encoded back by dump().
+    """
+
+    __slots__ = ('device_type', 'codec', 'collection_timestamp', '_raw', '_data_groups')
+
     def __repr__(self):
         return ('<Response: {} at {}, {:0.02f}V, {:0.03f}A>'.format(
             self.device_type,
@@ -42,209 +195,72 @@ class Response:
             self.amps,
         ))
 
-    def __init__(self, data=None, collection_time=None, device_type='UM24C'):
+    def __init__(self, data=None, collection_time=None, device_type='UM24C', collection_timestamp=None):
         self.device_type = device_type
-        if device_type == 'UM25C':
-            self.device_multiplier = 10
-        else:
-            self.device_multiplier = 1
+        self.codec = get_codec(device_type)
 
-        self.field_properties = {
-            'start': {
-                'description': 'Start bytes',
-                'position': 0,
-                'length': 2,
-                'from_int': lambda x: x,
-                'to_int': lambda x: int(x),
-            },
-            'volts': {
-                'description': 'Volts',
-                'position': 2,
-                'length': 2,
-                'from_int': lambda x: x / (100 * self.device_multiplier),
-                'to_int': lambda x: int(x * (100 * self.device_multiplier)),
-            },
-            'amps': {
-                'description': 'Amps',
-                'position': 4,
-                'length': 2,
-                'from_int': lambda x: x / (1000 * self.device_multiplier),
-                'to_int': lambda x: int(x * (1000 * self.device_multiplier)),
-            },
-            'watts': {
-                'description': 'Watts',
-                'position': 6,
-                'length': 4,
-                'from_int': lambda x: x / 1000,
-                'to_int': lambda x: int(x * 1000),
-            },
-            'temp_c': {
-                'description': 'Temperature (Celsius)',
-                'position': 10,
-                'length': 2,
-                'from_int': lambda x: x,
-                'to_int': lambda x: int(x),
-            },
-            'temp_f': {
-                'description': 'Temperature (Fahrenheit)',
-                'position': 12,
-                'length': 2,
-                'from_int': lambda x: x,
-                'to_int': lambda x: int(x),
-            },
-            'data_group_selected': {
-                'description': 'Currently selected data group',
-                'position': 14,
-                'length': 2,
-                'from_int': lambda x: x,
-                'to_int': lambda x: int(x),
-            },
-            'data_line_positive_volts': {
-                'description': 'Positive data line volts',
-                'position': 96,
-                'length': 2,
-                'from_int': lambda x: x / 100,
-                'to_int': lambda x: int(x * 100),
-            },
-            'data_line_negative_volts': {
-                'description': 'Negative data line volts',
-                'position': 98,
-                'length': 2,
-                'from_int': lambda x: x / 100,
-                'to_int': lambda x: int(x * 100),
-            },
-            'charging_mode': {
-                'description': 'Charging mode',
-                'position': 100,
-                'length': 2,
-                'from_int': lambda x: x,
-                'to_int': lambda x: int(x),
-            },
-            'record_amphours': {
-                'description': 'Recorded amp-hours',
-                'position': 102,
-                'length': 4,
-                'from_int': lambda x: x / 1000,
-                'to_int': lambda x: int(x * 1000),
-            },
-            'record_watthours': {
-                'description': 'Recorded watt-hours',
-                'position': 106,
-                'length': 4,
-                'from_int': lambda x: x / 1000,
-                'to_int': lambda x: int(x * 1000),
-            },
-            'record_threshold': {
-                'description': 'Recording threshold (Amps)',
-                'position': 110,
-                'length': 2,
-                'from_int': lambda x: x / 100,
-                'to_int': lambda x: int(x * 100),
-            },
-            'record_seconds': {
-                'description': 'Recorded time (Seconds)',
-                'position': 112,
-                'length': 4,
-                'from_int': lambda x: x,
-                'to_int': lambda x: int(x),
-            },
-            'recording': {
-                'description': 'Recording',
-                'position': 116,
-                'length': 2,
-                'from_int': lambda x: bool(x),
-                'to_int': lambda x: int(x),
-            },
-            'screen_timeout': {
-                'description': 'Screen timeout (Minutes)',
-                'position': 118,
-                'length': 2,
-                'from_int': lambda x: x,
-                'to_int': lambda x: int(x),
-            },
-            'screen_brightness': {
-                'description': 'Screen brightness',
-                'position': 120,
-                'length': 2,
-                'from_int': lambda x: x,
-                'to_int': lambda x: int(x),
-            },
-            'resistance': {
-                'description': 'Resistance (Ohms)',
-                'position': 122,
-                'length': 4,
-                'from_int': lambda x: x / 10,
-                'to_int': lambda x: int(x * 10),
-            },
-            'screen_selected': {
-                'description': 'Currently selected screen',
-                'position': 126,
-                'length': 2,
-                'from_int': lambda x: x,
-                'to_int': lambda x: int(x),
-            },
-            'end': {
-                'description': 'End bytes',
-                'position': 128,
-                'length': 2,
-                'from_int': lambda x: x,
-                'to_int': lambda x: int(x),
-            },
-        }
-
-        if collection_time is None:
-            collection_time = datetime.datetime.now()
-        self.collection_time = collection_time
-        for name in self.field_properties:
-            setattr(self, name, 0)
-        self.data_groups = [DataGroup(x) for x in range(10)]
+        if collection_timestamp is not None:
+            self.collection_timestamp = collection_timestamp
+        elif collection_time is not None:
+            self.collection_time = collection_time
+        else:
+            self.collection_timestamp = time.time()
+        self._data_groups = None
 
         if data:
             self.load(data)
+        else:
+            self._raw = (0,) * len(self.codec.scales)
+
+    @property
+    def collection_time(self):
+        return datetime.datetime.fromtimestamp(self.collection_timestamp)
+
+    @collection_time.setter
+    def collection_time(self, collection_time):
+        self.collection_timestamp = collection_time.timestamp()
+
+    @property
+    def device_multiplier(self):
+        return self.codec.device_multiplier
+
+    @property
+    def field_properties(self):
+        return self.codec.field_properties
+
+    @property
+    def data_groups(self):
+        if self._data_groups is None:
+            raw = self._raw
+            self._data_groups = [
+                DataGroup(i, raw[DATA_GROUPS_INDEX + i * 2] / 1000, raw[DATA_GROUPS_INDEX + i * 2 + 1] / 1000)
+                for i in range(10)
+            ]
+        return self._data_groups
+
+    @data_groups.setter
+    def data_groups(self, data_groups):
+        self._data_groups = data_groups
 
     def dump(self):
-        data = bytearray(130)
-        for name in self.field_properties:
-            pos = self.field_properties[name]['position']
-            pos_len = self.field_properties[name]['length']
-            if pos_len == 2:
-                pack_format = '>H'
-            elif pos_len == 4:
-                pack_format = '>L'
-            else:
-                pack_format = 'B'
-            conversion_dump = self.field_properties[name]['to_int']
-            data[pos:pos+pos_len] = struct.pack(pack_format, conversion_dump(getattr(self, name)))
-
-        for data_group in self.data_groups:
-            if (data_group.group > 9) or (data_group.group < 0):
-                continue
-            pos = 16 + (data_group.group * 8)
-            data[pos:pos+4] = struct.pack('>L', int(data_group.amp_hours * 1000))
-            data[pos+4:pos+8] = struct.pack('>L', int(data_group.watt_hours * 1000))
-        return bytes(data)
+        if self._data_groups is not None:
+            raw = list(self._raw)
+            for data_group in self._data_groups:
+                if (data_group.group > 9) or (data_group.group < 0):
+                    continue
+                raw[DATA_GROUPS_INDEX + data_group.group * 2] = int(round(data_group.amp_hours * 1000))
+                raw[DATA_GROUPS_INDEX + data_group.group * 2 + 1] = int(round(data_group.watt_hours * 1000))
+            self._raw = tuple(raw)
+        return self.codec.pack(self._raw)
 
     def load(self, data):
-        if len(data) != 130:
+        if len(data) != FRAME_LENGTH:
             raise ValueError('Invalid data length', data)
         logging.debug('Start: 0x{:02x}{:02x}, end: 0x{:02x}{:02x}'.format(data[0], data[1], data[128], data[129]))
-        for name in self.field_properties:
-            pos = self.field_properties[name]['position']
-            pos_len = self.field_properties[name]['length']
-            if pos_len == 2:
-                pack_format = '>H'
-            elif pos_len == 4:
-                pack_format = '>L'
-            else:
-                pack_format = 'B'
-            conversion_load = self.field_properties[name]['from_int']
-            val = conversion_load(struct.unpack(pack_format, data[pos:pos+pos_len])[0])
-            setattr(self, name, val)
-
-        self.data_groups = []
-        for i in range(10):
-            data_group = DataGroup(i)
-            pos = 16 + (i * 8)
-            data_group.amp_hours = struct.unpack('>L', data[pos:pos+4])[0] / 1000
-            data_group.watt_hours = struct.unpack('>L', data[pos+4:pos+8])[0] / 1000
-            self.data_groups.append(data_group)
+        self._raw = self.codec.unpack(data)
+        self._data_groups = None
+
+
+for _name, _index in RAW_INDEXES.items():
+    setattr(Response, _name, _Field(_index))
+del _name, _index
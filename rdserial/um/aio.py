@@ -0,0 +1,21 @@
+# rdserialtool
+# Copyright (C) 2019-2021 Ryan Finnie
+# SPDX-License-Identifier: MPL-2.0
+
+# asyncio UM polling, for use with rdserial.device.aio transports.
+
+import rdserial.um
+
+
+async def poll(socket, device_type='UM24C', timeout=None):
+    """Request and decode a single UM frame"""
+    # Discard any late frame from an earlier, timed out poll
+    socket.reset_input_buffer()
+    await socket.send(b'\xf0')
+    data = await socket.recv(rdserial.um.FRAME_LENGTH, timeout=timeout)
+    return rdserial.um.Response(data, device_type=device_type)
+
+
+async def send_command(socket, command):
+    """Send a single-byte UM command (e.g. b'\\xf1' for the next screen)"""
+    return await socket.send(command)
@@ -2,21 +2,39 @@
 # Copyright (C) 2019-2021 Ryan Finnie
 # SPDX-License-Identifier: MPL-2.0
 
-import json
 import time
-import datetime
 import logging
-import statistics
+import queue
+import threading
 
+import rdserial.capture
+import rdserial.scheduler
+import rdserial.sink
+import rdserial.trend
 import rdserial.um
 
 
 supported_devices = ['um24c', 'um25c', 'um34c']
 
 
+def field_names(device):
+    """Names accepted by --fields for a device"""
+    return tuple(rdserial.um.get_codec(device.upper()).field_properties) + ('data_groups',)
+
+
 class Tool:
     def __init__(self, parent=None):
         self.trends = {}
+        self.recorder = None
+        self.scheduler = None
+        self.sink = None
+        self.sample_template = None
+        self.sample_fields = None
+        self.stream_frames = 0
+        self.stream_dropped = 0
+        self.device_name = None
+        self.output_lock = threading.Lock()
+        self.stop = threading.Event()
         if parent is not None:
             self.args = parent.args
             self.socket = parent.socket
@@ -25,24 +43,78 @@ class Tool:
         if not self.args.watch:
             return ''
 
-        if name in self.trends:
-            trend = statistics.mean(self.trends[name])
-            self.trends[name] = self.trends[name][1:] + [value]
-            if value > trend:
-                return '\u2197'
-            elif value < trend:
-                return '\u2198'
-            else:
-                return ' '
+        window = self.trends.get(name)
+        if window is None:
+            self.trends[name] = rdserial.trend.RollingWindow(self.args.trend_points)
+            self.trends[name].fill(value)
+            return ' '
+        trend = window.mean
+        window.push(value)
+        if value > trend:
+            return '\u2197'
+        elif value < trend:
+            return '\u2198'
         else:
-            self.trends[name] = [value for x in range(self.args.trend_points)]
             return ' '
 
-    def print_json(self, response):
-        out = {x: getattr(response, x) for x in response.field_properties}
-        out['data_groups'] = [{'amp_hours': x.amp_hours, 'watt_hours': x.watt_hours} for x in response.data_groups]
-        out['collection_time'] = (response.collection_time - datetime.datetime.fromtimestamp(0)).total_seconds()
-        print(json.dumps(out, sort_keys=True))
+    def json_trends(self, out):
+        """Rolling statistics of the numeric fields in out, after adding them"""
+        trends = {}
+        for name, value in out.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            window = self.trends.get(name)
+            if window is None:
+                window = self.trends[name] = rdserial.trend.RollingWindow(self.args.trend_points)
+            window.push(value)
+            trends[name] = window.stats()
+        return trends
+
+    def print_fields(self, response):
+        for name in self.args.fields:
+            if name == 'data_groups':
+                for data_group in response.data_groups:
+                    print('Data group {}: {:8.03f}Ah, {:8.03f}Wh'.format(
+                        data_group.group, data_group.amp_hours, data_group.watt_hours,
+                    ))
+                continue
+            value = getattr(response, name)
+            print('{}: {}{}'.format(
+                response.field_properties[name]['description'],
+                value,
+                self.trend_s(name, value),
+            ))
+        if response.collection_time:
+            print('Collection time: {}'.format(response.collection_time))
+
+    def sample_columns(self):
+        """Flattened names of every sample field, for tabular sinks"""
+        columns = list(rdserial.um.get_codec(self.args.device.upper()).field_properties)
+        for group in range(10):
+            columns += ['data_groups.{}.amp_hours'.format(group), 'data_groups.{}.watt_hours'.format(group)]
+        return columns
+
+    def sample_record(self, response):
+        if self.sample_template is None:
+            names = list(self.args.fields or list(response.field_properties) + ['data_groups'])
+            self.sample_fields = tuple(x for x in names if x != 'data_groups')
+            names.append('collection_time')
+            if self.args.json_trends:
+                names.append('trends')
+            if self.device_name:
+                names.append('device_name')
+            self.sample_template = rdserial.sink.record_template(names)
+        out = dict.fromkeys(self.sample_template)
+        for x in self.sample_fields:
+            out[x] = getattr(response, x)
+        if 'data_groups' in out:
+            out['data_groups'] = [{'amp_hours': x.amp_hours, 'watt_hours': x.watt_hours} for x in response.data_groups]
+        if self.args.json_trends:
+            out['trends'] = self.json_trends(out)
+        out['collection_time'] = response.collection_timestamp
+        if self.device_name:
+            out['device_name'] = self.device_name
+        return out
 
     def print_human(self, response):
         logging.debug('DUMP: {}'.format(repr(response.dump())))
@@ -89,8 +161,10 @@ class Tool:
             response.record_threshold,
         ))
 
+        data_groups = response.data_groups
+
         def make_dgpart(response, idx):
-            data_group = response.data_groups[idx]
+            data_group = data_groups[idx]
             return '{}{:d}: {:8.03f}Ah{}, {:8.03f}Wh{}'.format(
                 '*' if data_group.group == response.data_group_selected else ' ',
                 data_group.group,
@@ -161,23 +235,33 @@ class Tool:
             # it'll eat commands.  Sleeping 0.5s between commands is safe.
             time.sleep(0.5)
 
+    def output(self, response):
+        with self.output_lock:
+            if self.sink:
+                self.sink.write(self.sample_record(response))
+                return
+            if self.device_name:
+                print('{}:'.format(self.device_name))
+            if self.args.fields:
+                self.print_fields(response)
+            else:
+                self.print_human(response)
+            if self.args.watch or self.args.stream:
+                print()
+
+    def collect(self):
+        self.socket.send(b'\xf0')
+        data = self.socket.recv_into(rdserial.um.FRAME_LENGTH)
+        if self.recorder:
+            self.recorder.write_frame(data)
+        return rdserial.um.Response(data, device_type=self.args.device.upper())
+
     def loop(self):
-        while True:
+        while not self.stop.is_set():
             try:
-                self.socket.send(b'\xf0')
-                if self.args.json:
-                    self.print_json(rdserial.um.Response(
-                        self.socket.recv(130),
-                        collection_time=datetime.datetime.now(),
-                        device_type=self.args.device.upper(),
-                    ))
-                else:
-                    self.print_human(rdserial.um.Response(
-                        self.socket.recv(130),
-                        collection_time=datetime.datetime.now(),
-                        device_type=self.args.device.upper(),
-                    ))
-            except KeyboardInterrupt:
+                response = self.collect()
+                self.output(response)
+            except (KeyboardInterrupt, EOFError):
                 raise
             except Exception:
                 if self.args.watch:
@@ -185,15 +269,110 @@ class Tool:
                 else:
                     raise
             if self.args.watch:
-                if not self.args.json:
-                    print()
-                time.sleep(self.args.watch_seconds)
+                self.scheduler.wait()
             else:
                 return
 
+    def stream_reader(self, frames, stop):
+        """Stream mode I/O thread
+
+        Requests the next frame as soon as the previous one arrives, and
+        queues (collection time, frame) pairs.  An exception ending the
+        stream is queued in place of a frame.
+        """
+        try:
+            while not stop.is_set():
+                self.socket.send(b'\xf0')
+                data = bytes(self.socket.recv_into(rdserial.um.FRAME_LENGTH))
+                item = (time.time(), data)
+                self.stream_frames += 1
+                if self.args.stream_overflow == 'block':
+                    while not stop.is_set():
+                        try:
+                            frames.put(item, timeout=0.5)
+                            break
+                        except queue.Full:
+                            pass
+                    continue
+                while True:
+                    try:
+                        frames.put_nowait(item)
+                        break
+                    except queue.Full:
+                        try:
+                            frames.get_nowait()
+                            self.stream_dropped += 1
+                        except queue.Empty:
+                            pass
+        except Exception as e:
+            frames.put(e)
+
+    def stream(self):
+        frames = queue.Queue(maxsize=self.args.stream_queue)
+        stop = threading.Event()
+        reader = threading.Thread(target=self.stream_reader, args=(frames, stop), daemon=True)
+        start = time.monotonic()
+        reader.start()
+        try:
+            while not self.stop.is_set():
+                try:
+                    item = frames.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                if isinstance(item, Exception):
+                    raise item
+                collection_timestamp, data = item
+                if self.recorder:
+                    self.recorder.write_frame(data)
+                response = rdserial.um.Response(
+                    data,
+                    device_type=self.args.device.upper(),
+                    collection_timestamp=collection_timestamp,
+                )
+                self.output(response)
+        finally:
+            stop.set()
+            elapsed = time.monotonic() - start
+            logging.info('{}Stream: {} frames read, {} dropped, {:.01f} frames/s'.format(
+                '{}: '.format(self.device_name) if self.device_name else '',
+                self.stream_frames, self.stream_dropped,
+                (self.stream_frames / elapsed if elapsed else 0),
+            ))
+
+    def setup(self):
+        for name in (self.args.fields or []):
+            if name not in field_names(self.args.device):
+                raise ValueError('Unknown field for {}'.format(self.args.device), name)
+
     def main(self):
+        self.setup()
+        if self.args.record:
+            self.recorder = rdserial.capture.CaptureWriter(self.args.record, self.args.device)
+        self.sink = rdserial.sink.open_sink(
+            self.args, table='um', columns=self.sample_columns(),
+            device_id=(self.device_name or '{}@{}'.format(self.args.device, self.socket)),
+        )
+        if self.args.watch:
+            self.scheduler = rdserial.scheduler.Scheduler(
+                self.args.watch_seconds, policy=self.args.watch_policy, sleep=self.stop.wait,
+            )
         try:
             self.send_commands()
-            self.loop()
+            if self.args.stream:
+                self.stream()
+            else:
+                self.loop()
         except KeyboardInterrupt:
             pass
+        except EOFError:
+            logging.info('End of replay')
+        finally:
+            if self.sink:
+                with self.output_lock:
+                    self.sink.close()
+            if self.recorder:
+                self.recorder.close()
+            if self.scheduler and self.scheduler.ticks:
+                logging.info('{}Watch schedule: {}'.format(
+                    '{}: '.format(self.device_name) if self.device_name else '', self.scheduler,
+                ))
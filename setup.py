@@ -44,6 +44,7 @@ setup(
     entry_points={
         'console_scripts': [
             'rdserialtool = rdserial.tool:main',
+            'rdserial-emulator = rdserial.emulator.tool:main',
         ],
     },
     test_suite='tests',
@@ -0,0 +1,106 @@
+# rdserialtool
+# Copyright (C) 2019-2021 Ryan Finnie
+# SPDX-License-Identifier: MPL-2.0
+
+import asyncio
+import time
+import unittest
+
+import rdserial.device.aio
+import rdserial.emulator
+import rdserial.modbus
+import rdserial.modbus.aio
+import rdserial.um.aio
+
+
+@unittest.skipUnless(rdserial.device.aio.HAS_SERIAL, 'pyserial not available')
+class TestAsyncModbus(unittest.TestCase):
+    def setUp(self):
+        self.emulator = rdserial.emulator.ModbusEmulator(device_mode='rd')
+        self.port = self.emulator.start()
+
+    def tearDown(self):
+        self.emulator.close()
+
+    def run_client(self, test, timeout=1.0):
+        async def run():
+            socket = rdserial.device.aio.AsyncSerial(self.port)
+            await socket.connect()
+            try:
+                await test(rdserial.modbus.aio.AsyncRTUClient(socket, 9600, timeout=timeout))
+            finally:
+                await socket.close()
+
+        asyncio.run(run())
+
+    def test_read_write(self):
+        async def test(client):
+            self.assertEqual(await client.read_registers(0x08, 2), [500, 1000])
+            await client.write_register(0x08, 1234)
+            await client.write_registers(0x09, [321])
+            self.assertEqual(await client.read_registers(0x08, 2), [1234, 321])
+
+        self.run_client(test)
+
+    def test_concurrent(self):
+        async def test(client):
+            results = await asyncio.gather(*[client.read_registers(0x08, 2) for i in range(5)])
+            self.assertEqual(results, [[500, 1000]] * 5)
+
+        self.run_client(test)
+
+    def test_exception(self):
+        async def test(client):
+            with self.assertRaises(rdserial.modbus.ModbusException) as cm:
+                await client.read_registers(0xf0, 0x20)
+            self.assertEqual(cm.exception.function, 0x03)
+            self.assertEqual(cm.exception.code, 0x02)
+            # The bus is still usable
+            self.assertEqual(await client.read_registers(0x08, 1), [500])
+
+        self.run_client(test)
+
+    def test_timeout(self):
+        async def test(client):
+            self.emulator.latency = 1.0
+            start = time.monotonic()
+            with self.assertRaises(TimeoutError):
+                await client.read_registers(0x08, 2, timeout=0.2)
+            elapsed = time.monotonic() - start
+            self.assertGreaterEqual(elapsed, 0.2)
+            self.assertLess(elapsed, 0.6)
+
+        self.run_client(test, timeout=None)
+
+
+@unittest.skipUnless(rdserial.device.aio.HAS_SERIAL, 'pyserial not available')
+class TestAsyncUM(unittest.TestCase):
+    def setUp(self):
+        self.emulator = rdserial.emulator.UMEmulator(device_type='UM25C')
+        self.port = self.emulator.start()
+
+    def tearDown(self):
+        self.emulator.close()
+
+    async def poll(self):
+        socket = rdserial.device.aio.AsyncSerial(self.port)
+        await socket.connect()
+        try:
+            response = await rdserial.um.aio.poll(socket, device_type='UM25C', timeout=1.0)
+            self.assertAlmostEqual(response.volts, 5.0, delta=0.06)
+            self.assertEqual(response.temp_c, 25)
+            self.assertEqual(response.record_threshold, 0.1)
+            self.assertIsNotNone(response.collection_time)
+            await rdserial.um.aio.send_command(socket, b'\xa3')
+            await asyncio.sleep(0.1)
+            response = await rdserial.um.aio.poll(socket, device_type='UM25C', timeout=1.0)
+            self.assertEqual(response.data_group_selected, 3)
+        finally:
+            await socket.close()
+
+    def test_poll(self):
+        asyncio.run(self.poll())
+
+
+if __name__ == '__main__':
+    unittest.main()
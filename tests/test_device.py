@@ -0,0 +1,67 @@
+# rdserialtool
+# Copyright (C) 2019-2021 Ryan Finnie
+# SPDX-License-Identifier: MPL-2.0
+
+import asyncio
+import time
+import unittest
+
+import rdserial.device
+import rdserial.device.aio
+import rdserial.emulator
+import rdserial.modbus
+import rdserial.modbus.aio
+
+
+@unittest.skipUnless(rdserial.device.HAS_SERIAL, 'pyserial not available')
+class TestSerialTimeout(unittest.TestCase):
+    def setUp(self):
+        self.emulator = rdserial.emulator.ModbusEmulator(device_mode='rd', latency=0.3)
+        port = self.emulator.start()
+        self.socket = rdserial.device.Serial(port, timeout=0.1)
+        self.socket.connect()
+        self.client = rdserial.modbus.RTUClient(self.socket, 9600)
+
+    def tearDown(self):
+        self.socket.close()
+        self.emulator.close()
+
+    def test_late_response_discarded(self):
+        with self.assertRaises(TimeoutError):
+            self.client.read_registers(0x08, 1)
+        # Let the late response arrive in the input buffer
+        time.sleep(0.4)
+        self.emulator.latency = 0.0
+        self.client.write_register(0x08, 1234)
+        self.assertEqual(self.client.read_registers(0x08, 1), [1234])
+
+
+@unittest.skipUnless(rdserial.device.aio.HAS_SERIAL, 'pyserial not available')
+class TestAsyncSerialTimeout(unittest.TestCase):
+    def setUp(self):
+        self.emulator = rdserial.emulator.ModbusEmulator(device_mode='rd', latency=0.3)
+        self.port = self.emulator.start()
+
+    def tearDown(self):
+        self.emulator.close()
+
+    async def late_response(self):
+        socket = rdserial.device.aio.AsyncSerial(self.port)
+        await socket.connect()
+        try:
+            client = rdserial.modbus.aio.AsyncRTUClient(socket, 9600, timeout=0.1)
+            with self.assertRaises(TimeoutError):
+                await client.read_registers(0x00, 2)
+            # Let the late response arrive in the input buffer
+            await asyncio.sleep(0.4)
+            self.emulator.latency = 0.0
+            self.assertEqual(await client.read_registers(0x08, 2), [500, 1000])
+        finally:
+            await socket.close()
+
+    def test_late_response_discarded(self):
+        asyncio.run(self.late_response())
+
+
+if __name__ == '__main__':
+    unittest.main()
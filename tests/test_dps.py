@@ -0,0 +1,38 @@
+# rdserialtool
+# Copyright (C) 2019-2021 Ryan Finnie
+# SPDX-License-Identifier: MPL-2.0
+
+import unittest
+
+import rdserial.dps
+import rdserial.dps.tool
+import rdserial.modbus
+
+
+class TestFillableRegisters(unittest.TestCase):
+    def test_fillable(self):
+        for device in ('dps', 'rd'):
+            device_state_class, device_group_state_class = rdserial.dps.tool.state_classes(device)
+            tables = [device_state_class.register_table] + [
+                device_group_state_class.group_register_table(group) for group in range(10)
+            ]
+            fillable = rdserial.dps.tool.fillable_registers(device)
+            for table in tables:
+                for name, properties in table.properties.items():
+                    if properties.get('read_only') or properties.get('write_only'):
+                        self.assertNotIn(properties['register'], fillable, (device, name))
+            self.assertIn(device_state_class.register_table.properties['setting_volts']['register'], fillable)
+
+    def test_clock_not_fillable(self):
+        table = rdserial.dps.RDDeviceState.register_table
+        fillable = rdserial.dps.tool.fillable_registers('rd')
+        clock = [v['register'] for name, v in table.properties.items() if name.startswith('datetime_')]
+        self.assertEqual(len(clock), 6)
+        self.assertFalse(fillable & set(clock))
+        # Even when a write surrounds the clock, it is not rewritten
+        blocks, fill = rdserial.modbus.plan_writes([min(clock) - 1, max(clock) + 1], fillable=fillable, known=clock)
+        self.assertEqual(len(blocks), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
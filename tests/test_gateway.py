@@ -0,0 +1,68 @@
+# rdserialtool
+# Copyright (C) 2019-2021 Ryan Finnie
+# SPDX-License-Identifier: MPL-2.0
+
+import socket
+import struct
+import threading
+import unittest
+
+import rdserial.device
+import rdserial.emulator
+import rdserial.gateway
+import rdserial.modbus
+
+
+@unittest.skipUnless(rdserial.device.HAS_SERIAL, 'pyserial not available')
+class TestExceptionResponses(unittest.TestCase):
+    def setUp(self):
+        self.emulator = rdserial.emulator.ModbusEmulator(device_mode='rd')
+        port = self.emulator.start()
+        self.socket = rdserial.device.Serial(port, timeout=1.0)
+        self.socket.connect()
+        self.client = rdserial.modbus.RTUClient(self.socket, 9600)
+
+    def tearDown(self):
+        self.socket.close()
+        self.emulator.close()
+
+    def test_client_exception(self):
+        with self.assertRaises(rdserial.modbus.ModbusException) as cm:
+            self.client.read_registers(0xf0, 0x20)
+        self.assertEqual(cm.exception.function, 0x03)
+        self.assertEqual(cm.exception.code, 0x02)
+        # The bus is still usable
+        self.client.write_register(0x08, 1234)
+        self.assertEqual(self.client.read_registers(0x08, 1), [1234])
+
+    def test_gateway_forwards_exception(self):
+        gateway = rdserial.gateway.Gateway(('127.0.0.1', 0), self.client, window=0.05)
+        thread = threading.Thread(target=gateway.serve_forever, daemon=True)
+        thread.start()
+        try:
+            responses = {}
+
+            def request(base, length):
+                with socket.create_connection(gateway.server_address) as sock:
+                    pdu = struct.pack('>BHH', 0x03, base, length)
+                    sock.sendall(struct.pack('>HHHB', 1, 0, len(pdu) + 1, 1) + pdu)
+                    header = rdserial.gateway._recv_exact(sock, rdserial.gateway.MBAP_HEADER.size)
+                    _, _, length, _ = rdserial.gateway.MBAP_HEADER.unpack(header)
+                    responses[base] = rdserial.gateway._recv_exact(sock, length - 1)
+
+            # Adjacent requests are merged; the device refuses the merged
+            # read, but only the invalid request should fail
+            threads = [threading.Thread(target=request, args=x) for x in ((0xe0, 0x10), (0xf0, 0x20))]
+            for x in threads:
+                x.start()
+            for x in threads:
+                x.join(5)
+            self.assertEqual(responses[0xf0], b'\x83\x02')
+            self.assertEqual(responses[0xe0][:2], b'\x03\x20')
+        finally:
+            gateway.shutdown()
+            gateway.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,272 @@
+# rdserialtool
+# Copyright (C) 2019-2021 Ryan Finnie
+# SPDX-License-Identifier: MPL-2.0
+
+import random
+import struct
+import unittest
+
+import rdserial.device
+import rdserial.modbus
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeSocket:
+    """Answers Modbus requests from a register list, recording them"""
+
+    def __init__(self):
+        self.registers = list(range(1000, 1100))
+        self.requests = []
+        self._response = b''
+
+    def send(self, data):
+        self.requests.append(bytes(data))
+        unit, function, register, length = struct.unpack_from('>BBHH', data)
+        if function == 0x03:
+            values = self.registers[register:register + length]
+            response = struct.pack('>BBB{}H'.format(length), unit, function, length * 2, *values)
+        elif function == 0x06:
+            self.registers[register] = length
+            response = bytes(data[:-2])
+        else:
+            self.registers[register:register + length] = struct.unpack_from('>{}H'.format(length), data, 7)
+            response = bytes(data[:6])
+        self._response = response + struct.pack('<H', rdserial.modbus.modbus_crc(response))
+        return len(data)
+
+    def recv(self, size):
+        response, self._response = self._response[:size], self._response[size:]
+        return response
+
+    def reads(self):
+        return [struct.unpack_from('>HH', x, 2) for x in self.requests if x[1] == 0x03]
+
+
+class FakeBufferedSocket(FakeSocket):
+    """FakeSocket receiving into a reusable buffer, like the transports"""
+
+    def __init__(self):
+        super().__init__()
+        self._buffer = bytearray()
+
+    def recv_into(self, size, offset=0):
+        view = rdserial.device._buffer_view(self, size, offset)
+        view[offset:] = self.recv(size)
+        return view
+
+
+def reference_crc(data, crc=0xffff):
+    for b in data:
+        crc ^= b
+        for i in range(8):
+            crc = (crc >> 1) ^ 0xa001 if crc & 1 else crc >> 1
+    return crc
+
+
+class TestCRC(unittest.TestCase):
+    def setUp(self):
+        self.random = random.Random(0)
+
+    def test_known(self):
+        # Read of 0x0000-0x0001 from unit 1
+        self.assertEqual(rdserial.modbus.modbus_crc(b'\x01\x03\x00\x00\x00\x02'), 0x0bc4)
+
+    def test_reference(self):
+        for length in list(range(0, 40)) + [255, 256, 257]:
+            data = bytes(self.random.randrange(256) for i in range(length))
+            self.assertEqual(rdserial.modbus.modbus_crc(data), reference_crc(data), length)
+            self.assertEqual(rdserial.modbus.modbus_crc(bytearray(data)), reference_crc(data), length)
+
+    def test_chunked(self):
+        data = bytes(self.random.randrange(256) for i in range(100))
+        for split in (0, 1, 7, 16, 17, 50, 99, 100):
+            crc = rdserial.modbus.modbus_crc(data[:split])
+            self.assertEqual(rdserial.modbus.modbus_crc(data[split:], crc), reference_crc(data), split)
+
+    def test_valid(self):
+        for length in (1, 6, 15, 16, 253):
+            data = bytes(self.random.randrange(256) for i in range(length))
+            frame = data + struct.pack('<H', reference_crc(data))
+            self.assertTrue(rdserial.modbus.modbus_crc_valid(frame), length)
+            self.assertFalse(rdserial.modbus.modbus_crc_valid(frame[:-1] + bytes([frame[-1] ^ 1])), length)
+        self.assertFalse(rdserial.modbus.modbus_crc_valid(b''))
+        self.assertFalse(rdserial.modbus.modbus_crc_valid(b'\xff\xff'))
+
+
+class TestPlanReads(unittest.TestCase):
+    def test_empty(self):
+        self.assertEqual(rdserial.modbus.plan_reads([]), [])
+
+    def test_merge(self):
+        self.assertEqual(rdserial.modbus.plan_reads([5, 1, 3, 3, 2]), [(1, 5)])
+
+    def test_max_length(self):
+        self.assertEqual(rdserial.modbus.plan_reads([0, 124]), [(0, 125)])
+        self.assertEqual(rdserial.modbus.plan_reads([0, 125]), [(0, 1), (125, 1)])
+        self.assertEqual(rdserial.modbus.plan_reads(range(300)), [(0, 125), (125, 125), (250, 50)])
+        self.assertEqual(rdserial.modbus.plan_reads(range(10), max_length=4), [(0, 4), (4, 4), (8, 2)])
+
+    def test_max_gap(self):
+        self.assertEqual(rdserial.modbus.plan_reads([0, 4], max_gap=3), [(0, 5)])
+        self.assertEqual(rdserial.modbus.plan_reads([0, 5], max_gap=3), [(0, 1), (5, 1)])
+        self.assertEqual(rdserial.modbus.plan_reads([0, 1], max_gap=0), [(0, 2)])
+        self.assertEqual(rdserial.modbus.plan_reads([0, 2], max_gap=0), [(0, 1), (2, 1)])
+
+    def test_blocks_cover_registers(self):
+        registers = random.Random(0).sample(range(1000), 100)
+        for max_gap in (None, 0, 5, 50):
+            blocks = rdserial.modbus.plan_reads(registers, max_gap=max_gap)
+            covered = [x for base, length in blocks for x in range(base, base + length)]
+            self.assertTrue(set(registers) <= set(covered))
+            self.assertEqual(len(covered), len(set(covered)))
+            self.assertTrue(all(length <= rdserial.modbus.MAX_READ_REGISTERS for base, length in blocks))
+            for base, length in blocks:
+                self.assertIn(base, registers)
+                self.assertIn(base + length - 1, registers)
+
+
+class TestRTUClient(unittest.TestCase):
+    def test_recv_into(self):
+        socket = FakeBufferedSocket()
+        client = rdserial.modbus.RTUClient(socket, 115200)
+        # The buffer grows with the header in place
+        self.assertEqual(client.read_registers(0x00, 2), [1000, 1001])
+        self.assertEqual(client.read_registers(0x10, 20), list(range(1016, 1036)))
+        client.write_register(0x02, 5)
+        client.write_registers(0x03, [6, 7])
+        self.assertEqual(client.read_registers(0x00, 6), [1000, 1001, 5, 6, 7, 1005])
+        socket.send(rdserial.modbus.read_registers_request(0x00, 1))
+        self.assertIsInstance(client.recv(7), memoryview)
+
+    def test_exception(self):
+        for socket in (FakeSocket(), FakeBufferedSocket()):
+            client = rdserial.modbus.RTUClient(socket, 115200)
+            response = b'\x01\x83\x02'
+            socket.send = lambda data: setattr(
+                socket, '_response', response + struct.pack('<H', rdserial.modbus.modbus_crc(response)),
+            )
+            with self.assertRaises(rdserial.modbus.ModbusException) as cm:
+                client.read_registers(0x00, 2)
+            self.assertEqual((cm.exception.function, cm.exception.code), (0x03, 0x02))
+
+
+class TestRegisterCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = rdserial.modbus.RegisterCache(default_ttl=1.0, ttls={0x10: 5.0, 0x11: 0}, clock=self.clock)
+        self.socket = FakeSocket()
+        self.client = rdserial.modbus.RTUClient(self.socket, 115200, cache=self.cache)
+
+    def test_ttl(self):
+        self.assertEqual(self.client.read_registers(0x0e, 4), [1014, 1015, 1016, 1017])
+        self.assertEqual(self.cache.lookup(0x0e, 4), [1014, 1015, 1016, None])
+        self.clock.now = 0.99
+        self.assertEqual(self.cache.lookup(0x0e, 3), [1014, 1015, 1016])
+        self.clock.now = 1.0
+        self.assertEqual(self.cache.lookup(0x0e, 3), [None, None, 1016])
+        self.clock.now = 5.0
+        self.assertEqual(self.cache.lookup(0x0e, 3), [None, None, None])
+
+    def test_range_hit(self):
+        self.client.read_registers(0x00, 4)
+        self.client.read_registers(0x04, 4)
+        self.assertEqual(self.client.read_registers(0x02, 4), [1002, 1003, 1004, 1005])
+        self.assertEqual(self.socket.reads(), [(0x00, 4), (0x04, 4)])
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'misses': 2})
+
+    def test_partial_miss(self):
+        self.client.read_registers(0x00, 2)
+        self.client.read_registers(0x06, 2)
+        self.assertEqual(self.client.read_registers(0x00, 8), [1000 + x for x in range(8)])
+        self.assertEqual(self.socket.reads(), [(0x00, 2), (0x06, 2), (0x02, 4)])
+        self.client.read_registers(0x00, 8)
+        self.assertEqual(len(self.socket.reads()), 3)
+
+    def test_uncached_register(self):
+        self.client.read_registers(0x11, 1)
+        self.client.read_registers(0x11, 1)
+        self.assertEqual(self.socket.reads(), [(0x11, 1), (0x11, 1)])
+
+    def test_units(self):
+        self.client.read_registers(0x00, 2, unit=1)
+        self.assertEqual(self.cache.lookup(0x00, 2, unit=2), [None, None])
+
+    def test_write_invalidates(self):
+        self.client.read_registers(0x00, 8)
+        self.client.write_register(0x02, 1)
+        self.client.write_registers(0x05, [2, 3])
+        self.assertEqual(self.client.read_registers(0x00, 8), [1000, 1001, 1, 1003, 1004, 2, 3, 1007])
+        self.assertEqual(self.socket.reads(), [(0x00, 8), (0x02, 5)])
+
+    def test_invalidate(self):
+        self.client.read_registers(0x00, 4, unit=1)
+        self.client.read_registers(0x00, 4, unit=2)
+        self.cache.invalidate(0x01, 2, unit=1)
+        self.assertEqual(self.cache.lookup(0x00, 4, unit=1), [1000, None, None, 1003])
+        self.assertEqual(self.cache.lookup(0x00, 4, unit=2), [1000, 1001, 1002, 1003])
+        self.cache.invalidate(0x00)
+        self.assertEqual(self.cache.lookup(0x00, 1, unit=2), [None])
+        self.cache.invalidate(unit=1)
+        self.assertEqual(self.cache.lookup(0x03, 1, unit=1), [None])
+        self.cache.invalidate()
+        self.assertEqual(self.cache.lookup(0x00, 4, unit=2), [None] * 4)
+
+
+class TestPlanWrites(unittest.TestCase):
+    def test_no_fill(self):
+        self.assertEqual(rdserial.modbus.plan_writes([1, 3]), ([(1, 1), (3, 1)], ()))
+        self.assertEqual(rdserial.modbus.plan_writes([3, 1, 2]), ([(1, 3)], ()))
+
+    def test_fill_known(self):
+        self.assertEqual(rdserial.modbus.plan_writes([1, 4], fillable=[2, 3], known=[2, 3]), ([(1, 4)], ()))
+        # A gap register which is not fillable splits the write
+        self.assertEqual(
+            rdserial.modbus.plan_writes([1, 4], fillable=[2], known=[2, 3]),
+            ([(1, 1), (4, 1)], ()),
+        )
+
+    def test_fill_unknown(self):
+        # One read and one write beats two writes only when it saves a transaction
+        self.assertEqual(rdserial.modbus.plan_writes([1, 4], fillable=[2, 3]), ([(1, 1), (4, 1)], ()))
+        self.assertEqual(
+            rdserial.modbus.plan_writes([1, 4, 7], fillable=[2, 3, 5, 6], known=[5, 6]),
+            ([(1, 1), (4, 4)], ()),
+        )
+        self.assertEqual(
+            rdserial.modbus.plan_writes([1, 4, 7, 10], fillable=[2, 3, 5, 6, 8, 9]),
+            ([(1, 10)], (2, 3, 5, 6, 8, 9)),
+        )
+
+    def test_max_length(self):
+        registers = range(300)
+        blocks, fill = rdserial.modbus.plan_writes(registers)
+        self.assertEqual(blocks, [(0, 123), (123, 123), (246, 54)])
+        self.assertEqual(fill, ())
+        blocks, fill = rdserial.modbus.plan_writes([0, 122, 123], fillable=range(124), known=range(124))
+        self.assertEqual(blocks, [(0, 123), (123, 1)])
+        self.assertEqual(rdserial.modbus.plan_writes([0, 1, 2], max_length=2), ([(0, 2), (2, 1)], ()))
+
+    def test_fill_only_fillable(self):
+        rng = random.Random(0)
+        for i in range(50):
+            registers = set(rng.sample(range(200), 20))
+            fillable = set(rng.sample(range(200), 100)) - registers
+            known = set(rng.sample(range(200), 100))
+            blocks, fill = rdserial.modbus.plan_writes(registers, fillable=fillable, known=known)
+            covered = [x for base, length in blocks for x in range(base, base + length)]
+            self.assertEqual(len(covered), len(set(covered)))
+            self.assertTrue(registers <= set(covered))
+            self.assertTrue(set(covered) - registers <= fillable)
+            self.assertEqual(set(fill), set(covered) - registers - known)
+            self.assertTrue(all(length <= rdserial.modbus.MAX_WRITE_REGISTERS for base, length in blocks))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+# rdserialtool
+# Copyright (C) 2019-2021 Ryan Finnie
+# SPDX-License-Identifier: MPL-2.0
+
+import unittest
+
+import rdserial.dps
+import rdserial.profile
+
+
+def registers(profile):
+    return rdserial.profile.profile_registers(profile, rdserial.dps.RDDeviceState, rdserial.dps.RDGroupState)
+
+
+class TestProfileRegisters(unittest.TestCase):
+    def test_valid(self):
+        self.assertEqual(registers({'settings': {'setting_volts': 5.0}}), {0x08: 500})
+
+    def test_out_of_range(self):
+        with self.assertRaisesRegex(ValueError, r'^settings\.setting_volts: value 70000 out of range'):
+            registers({'settings': {'setting_volts': 70000}})
+        with self.assertRaisesRegex(ValueError, r'^groups\.1\.setting_amps: value -1 out of range'):
+            registers({'groups': {'1': {'setting_amps': -1}}})
+
+    def test_invalid(self):
+        with self.assertRaisesRegex(ValueError, r'^settings\.volts: unknown or read-only field'):
+            registers({'settings': {'volts': 5.0}})
+        with self.assertRaisesRegex(ValueError, r'^settings\.setting_volts: invalid value'):
+            registers({'settings': {'setting_volts': '5'}})
+        with self.assertRaisesRegex(ValueError, r'^groups\.10: invalid group'):
+            registers({'groups': {'10': {}}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+# rdserialtool
+# Copyright (C) 2019-2021 Ryan Finnie
+# SPDX-License-Identifier: MPL-2.0
+
+import statistics
+import unittest
+
+import rdserial.scheduler
+
+
+class FakeClock:
+    """Clock whose sleep advances time, waking late by oversleep"""
+
+    def __init__(self, now=0.0):
+        self.now = now
+        self.oversleep = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds + self.oversleep
+
+
+class TestScheduler(unittest.TestCase):
+    def scheduler(self, period=1.0, policy=rdserial.scheduler.POLICY_SKIP, now=0.25):
+        self.clock = FakeClock(now)
+        return rdserial.scheduler.Scheduler(period, policy=policy, clock=self.clock, sleep=self.clock.sleep)
+
+    def test_on_time(self):
+        scheduler = self.scheduler()
+        self.assertEqual(scheduler.wait(), 0.0)
+        self.assertEqual(self.clock.now, 1.0)
+        self.clock.now += 0.5
+        self.assertEqual(scheduler.wait(), 0.0)
+        self.assertEqual(self.clock.now, 2.0)
+        self.assertEqual(self.clock.sleeps, [0.75, 0.5])
+        self.assertEqual(scheduler.stats(), {
+            'ticks': 2, 'overruns': 0, 'skipped': 0, 'jitter_mean': 0.0, 'jitter_stdev': 0.0, 'jitter_max': 0.0,
+        })
+
+    def test_skip(self):
+        scheduler = self.scheduler()
+        scheduler.wait()
+        # Work overruns the deadlines at 2.0 and 3.0
+        self.clock.now = 3.5
+        self.assertEqual(scheduler.wait(), 0.0)
+        self.assertEqual(self.clock.now, 4.0)
+        self.assertEqual(scheduler.overruns, 1)
+        self.assertEqual(scheduler.skipped, 2)
+        self.clock.now += 0.25
+        scheduler.wait()
+        self.assertEqual(self.clock.now, 5.0)
+        self.assertEqual((scheduler.ticks, scheduler.overruns, scheduler.skipped), (3, 1, 2))
+
+    def test_catch_up(self):
+        scheduler = self.scheduler(policy=rdserial.scheduler.POLICY_CATCH_UP)
+        scheduler.wait()
+        self.clock.now = 3.5
+        # The missed deadlines at 2.0 and 3.0 return at once
+        self.assertEqual(scheduler.wait(), 1.5)
+        self.assertEqual(scheduler.wait(), 0.5)
+        self.assertEqual(self.clock.now, 3.5)
+        self.assertEqual(scheduler.wait(), 0.0)
+        self.assertEqual(self.clock.now, 4.0)
+        self.assertEqual(self.clock.sleeps, [0.75, 0.5])
+        self.assertEqual((scheduler.ticks, scheduler.overruns, scheduler.skipped), (4, 2, 0))
+        self.assertEqual(scheduler.jitter_max, 1.5)
+        self.assertEqual(scheduler.jitter_mean, 0.5)
+
+    def test_jitter(self):
+        scheduler = self.scheduler(period=0.5)
+        jitters = []
+        for oversleep in (0.0, 0.125, 0.0625, 0.25, 0.0, 0.03125):
+            self.clock.oversleep = oversleep
+            jitters.append(scheduler.wait())
+        self.assertEqual(jitters, [0.0, 0.125, 0.0625, 0.25, 0.0, 0.03125])
+        self.assertEqual(scheduler.overruns, 0)
+        self.assertAlmostEqual(scheduler.jitter_mean, statistics.mean(jitters))
+        self.assertAlmostEqual(scheduler.jitter_stdev, statistics.stdev(jitters))
+        self.assertEqual(scheduler.jitter_max, 0.25)
+
+    def test_free_running(self):
+        scheduler = self.scheduler(period=0)
+        for i in range(3):
+            self.assertEqual(scheduler.wait(), 0.0)
+        self.assertEqual(self.clock.sleeps, [])
+        self.assertEqual(scheduler.ticks, 3)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            rdserial.scheduler.Scheduler(-1)
+        with self.assertRaises(ValueError):
+            rdserial.scheduler.Scheduler(1, policy='wait')
+
+
+if __name__ == '__main__':
+    unittest.main()
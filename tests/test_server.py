@@ -0,0 +1,61 @@
+# rdserialtool
+# Copyright (C) 2019-2021 Ryan Finnie
+# SPDX-License-Identifier: MPL-2.0
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+import rdserial.device
+import rdserial.emulator
+import rdserial.server
+
+
+@unittest.skipUnless(rdserial.device.HAS_SERIAL, 'pyserial not available')
+class TestServerGroups(unittest.TestCase):
+    def setUp(self):
+        self.emulator = rdserial.emulator.ModbusEmulator(device_mode='rd')
+        port = self.emulator.start()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'rd.sock')
+        self.daemon = subprocess.Popen([
+            sys.executable, '-m', 'rdserial.tool', '--quiet', '--device', 'rd', '--serial-device', port,
+            '--connect-delay', '0', '--serve', self.path,
+        ])
+        deadline = time.monotonic() + 10
+        while not os.path.exists(self.path):
+            self.assertIsNone(self.daemon.poll())
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.05)
+        self.client = rdserial.server.Client(self.path, timeout=10)
+
+    def tearDown(self):
+        self.client.close()
+        self.daemon.terminate()
+        self.daemon.wait()
+        self.tmpdir.cleanup()
+        self.emulator.close()
+
+    def test_groups(self):
+        self.assertEqual(self.client.read()['groups'], {})
+        sample = self.client.read(groups=[1, 3])
+        self.assertEqual(sorted(sample['groups']), ['1', '3'])
+        self.assertIn('setting_volts', sample['groups']['1'])
+        # The daemon's own selection is unchanged
+        self.assertEqual(self.client.read(max_age=0)['groups'], {})
+        with self.assertRaises(RuntimeError):
+            self.client.read(groups=[10])
+
+    def test_query(self):
+        output = subprocess.run(
+            [sys.executable, '-m', 'rdserial.tool', '--quiet', '--query', self.path, '--group', '2'],
+            stdout=subprocess.PIPE, check=True,
+        ).stdout
+        self.assertIn(b'"groups": {"2": {', output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+# rdserialtool
+# Copyright (C) 2019-2021 Ryan Finnie
+# SPDX-License-Identifier: MPL-2.0
+
+import datetime
+import io
+import unittest
+from unittest import mock
+
+import rdserial.dps
+import rdserial.sink
+import rdserial.um
+
+
+class TestNDJSONSink(unittest.TestCase):
+    record = {'amps': 0.5, 'collection_time': 1700000000.25, 'groups': {0: {'volts': 5.0}}, 'name': 'a'}
+    line = '{"amps":0.5,"collection_time":1700000000.25,"groups":{"0":{"volts":5.0}},"name":"a"}\n'
+
+    def write(self):
+        out = io.StringIO()
+        sink = rdserial.sink.NDJSONSink(out, flush_interval=60)
+        sink.write(self.record)
+        sink.write(self.record)
+        self.assertEqual(out.getvalue(), '')
+        sink.close()
+        return out.getvalue()
+
+    def test_stdlib(self):
+        with mock.patch('rdserial.sink.HAS_ORJSON', False):
+            self.assertEqual(self.write(), self.line * 2)
+
+    @unittest.skipUnless(rdserial.sink.HAS_ORJSON, 'orjson not available')
+    def test_orjson(self):
+        self.assertEqual(self.write(), self.line * 2)
+
+
+class TestCollectionTime(unittest.TestCase):
+    def test_timestamp(self):
+        for cls in (rdserial.um.Response, rdserial.dps.RDDeviceState):
+            sample = cls(collection_timestamp=1700000000.5)
+            self.assertEqual(sample.collection_time, datetime.datetime.fromtimestamp(1700000000.5))
+            now = datetime.datetime.now()
+            sample = cls(collection_time=now)
+            self.assertEqual(sample.collection_time, now)
+            self.assertEqual(sample.collection_timestamp, now.timestamp())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+# rdserialtool
+# Copyright (C) 2019-2021 Ryan Finnie
+# SPDX-License-Identifier: MPL-2.0
+
+import random
+import statistics
+import unittest
+
+import rdserial.trend
+
+
+class TestRollingWindow(unittest.TestCase):
+    def assertWindow(self, window, values):
+        values = values[-window.size:]
+        self.assertEqual(window.count, len(values))
+        self.assertAlmostEqual(window.mean, statistics.mean(values), places=9)
+        self.assertAlmostEqual(window.stdev, statistics.stdev(values) if len(values) > 1 else 0.0, places=6)
+        self.assertEqual(window.min, min(values))
+        self.assertEqual(window.max, max(values))
+
+    def test_empty(self):
+        window = rdserial.trend.RollingWindow(5)
+        self.assertEqual(window.stats(), {'mean': None, 'min': None, 'max': None, 'stdev': 0.0, 'ewma': None})
+        with self.assertRaises(ValueError):
+            rdserial.trend.RollingWindow(0)
+
+    def test_statistics(self):
+        rng = random.Random(0)
+        for size in (1, 2, 7, 60):
+            window = rdserial.trend.RollingWindow(size)
+            values = []
+            for i in range(size * 5 + 3):
+                values.append(rng.uniform(-10, 10))
+                window.push(values[-1])
+                self.assertWindow(window, values)
+
+    def test_large_offset(self):
+        # A small signal on a large offset, where naive sums lose precision
+        rng = random.Random(0)
+        window = rdserial.trend.RollingWindow(50)
+        values = []
+        for i in range(1000):
+            values.append(1e6 + rng.uniform(-0.01, 0.01))
+            window.push(values[-1])
+        self.assertWindow(window, values)
+
+    def test_monotonic(self):
+        window = rdserial.trend.RollingWindow(4)
+        values = []
+        for value in list(range(10)) + list(range(10, 0, -1)):
+            values.append(float(value))
+            window.push(value)
+            self.assertWindow(window, values)
+
+    def test_fill(self):
+        window = rdserial.trend.RollingWindow(4)
+        window.push(100)
+        window.fill(5)
+        self.assertEqual(window.count, 4)
+        self.assertEqual(window.ewma, 5.0)
+        self.assertWindow(window, [5.0] * 4)
+        values = [5.0] * 4
+        for value in (1, 9, 2, 8, 3):
+            values.append(float(value))
+            window.push(value)
+            self.assertWindow(window, values)
+
+    def test_ewma(self):
+        window = rdserial.trend.RollingWindow(3)
+        self.assertEqual(window.alpha, 0.5)
+        expected = None
+        for value in (4.0, 8.0, 0.0, 2.0):
+            window.push(value)
+            expected = value if expected is None else expected + 0.5 * (value - expected)
+            self.assertAlmostEqual(window.ewma, expected)
+        self.assertEqual(rdserial.trend.RollingWindow(3, alpha=0.1).alpha, 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
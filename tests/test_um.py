@@ -0,0 +1,42 @@
+# rdserialtool
+# Copyright (C) 2019-2021 Ryan Finnie
+# SPDX-License-Identifier: MPL-2.0
+
+import unittest
+
+import rdserial.um
+
+
+class TestResponse(unittest.TestCase):
+    def test_round_trip(self):
+        response = rdserial.um.Response(device_type='UM25C')
+        response.volts = 5.1
+        response.amps = 0.123
+        response.record_threshold = 0.29
+        decoded = rdserial.um.Response(response.dump(), device_type='UM25C')
+        self.assertEqual(decoded.volts, 5.1)
+        self.assertEqual(decoded.amps, 0.123)
+        self.assertEqual(decoded.record_threshold, 0.29)
+
+    def test_data_group_changes_kept(self):
+        response = rdserial.um.Response(device_type='UM24C')
+        response.data_groups[3].amp_hours = 1.234
+        response.data_groups[3].watt_hours = 0.007
+        self.assertEqual(response.data_groups[3].amp_hours, 1.234)
+        decoded = rdserial.um.Response(response.dump(), device_type='UM24C')
+        self.assertEqual(decoded.data_groups[3].amp_hours, 1.234)
+        self.assertEqual(decoded.data_groups[3].watt_hours, 0.007)
+        self.assertEqual(decoded.data_groups[4].amp_hours, 0)
+
+    def test_data_groups_reloaded(self):
+        response = rdserial.um.Response(device_type='UM24C')
+        response.data_groups[0].amp_hours = 1.0
+        frame = response.dump()
+        response.load(rdserial.um.Response(device_type='UM24C').dump())
+        self.assertEqual(response.data_groups[0].amp_hours, 0)
+        response.load(frame)
+        self.assertEqual(response.data_groups[0].amp_hours, 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()